@@ -0,0 +1,134 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_query(query):
+    """Case-fold, collapse whitespace and drop trailing punctuation so trivially different queries match"""
+    return " ".join(str(query or "").lower().split()).rstrip("?!. ")
+
+
+def answer_cache_key(system_prompt, formatted_context, query, variant):
+    """Fingerprint of everything that determines an LLM answer"""
+    digest = hashlib.sha256()
+    for part in (variant, system_prompt, formatted_context, normalize_query(query)):
+        digest.update(str(part or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def evidence_key(formatted_context):
+    """Fingerprint of the retrieved context an answer was built from"""
+    return hashlib.sha256(str(formatted_context or "").encode("utf-8")).hexdigest()
+
+
+def context_tags(context):
+    """
+    Entity tags for the data an answer was built from. Patients are tagged individually;
+    retrieved guidelines, exercises and similar-patient rankings are tagged by collection,
+    since inserting or editing any row can change which rows retrieval returns.
+    """
+    tags = set()
+    patient = context.get("patient")
+    if patient and patient.get("id") is not None:
+        tags.add(f"patients:{patient['id']}")
+    if context.get("similar_patients"):
+        tags.add("patients")
+        for similar in context["similar_patients"]:
+            if similar.get("id") is not None:
+                tags.add(f"patients:{similar['id']}")
+    if context.get("guidelines") or (patient and patient.get("relevant_guidelines")):
+        tags.add("guidelines")
+    if context.get("exercises") or (patient and patient.get("recommended_exercises")):
+        tags.add("exercises")
+    return tags
+
+
+class AnswerCache:
+    """
+    Size-bounded LRU cache of LLM answers with a TTL. Entries carry entity tags so a write
+    can invalidate every answer that was built from the rows it touched.
+    """
+
+    def __init__(self, max_entries=500, ttl_seconds=600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (answer, tags, expires_at)
+        self._keys_by_tag = {}
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0
+        }
+
+    def _drop_locked(self, key):
+        """Remove an entry and its tag references (caller holds the lock)"""
+        _, tags, _ = self._entries.pop(key)
+        for tag in tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry[2] <= time.monotonic():
+                self._drop_locked(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def put(self, key, answer, tags=()):
+        if self.max_entries <= 0:
+            return
+        tags = frozenset(tags)
+        with self._lock:
+            if key in self._entries:
+                self._drop_locked(key)
+            self._entries[key] = (answer, tags, time.monotonic() + self.ttl_seconds)
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop_locked(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def invalidate(self, *tags):
+        """Drop every answer built from any of the tagged entities; returns how many were dropped"""
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys.update(self._keys_by_tag.get(tag, ()))
+            for key in keys:
+                self._drop_locked(key)
+            self._stats["invalidations"] += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+            self._keys_by_tag.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds
+            })
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
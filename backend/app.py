@@ -1,10 +1,32 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS, cross_origin
 import os
 from dotenv import load_dotenv
 from clinical_rag import ClinicalRAG
+from direct_groq import llm_stats
+from embeddings import (
+    ReindexJob,
+    model_registry,
+    embedding_fingerprint,
+    content_hash,
+    exercise_embedding_text,
+    guideline_embedding_text
+)
+from patient_vectors import (
+    PATIENT_EMBEDDING_COLUMNS,
+    patient_embedding_texts,
+    compose_patient_vector
+)
+from vector_codec import to_vector_param, vector_to_base64
+from retrieval_filters import (
+    SIMILAR_PATIENT_CONSTRAINTS,
+    decode_similarity_cursor,
+    normalize_similarity_constraints
+)
+from patient_context import PATIENT_LIST_COLUMNS
 import signal
 import sys
+import time
 
 # Load environment variables from .env.local file if it exists
 env_file_path = '.env.local'
@@ -30,6 +52,39 @@ if not os.environ.get("GROQ_API_KEY"):
 # Initialize the Clinical RAG pipeline
 clinical_rag = ClinicalRAG()
 
+# Rows read per keyset page when streaming the patient list
+PATIENT_LIST_PAGE_SIZE = int(os.environ.get("PATIENT_LIST_PAGE_SIZE", "500"))
+
+# Largest number of patients one POST /api/patients/similar:batch request may ask about
+SIMILAR_BATCH_MAX_PATIENTS = int(os.environ.get("SIMILAR_BATCH_MAX_PATIENTS", "1000"))
+
+# Optionally load the embedding model at import time. Run a pre-fork server with preloading
+# (e.g. gunicorn --preload) so every worker shares the same weights copy-on-write.
+if os.environ.get("PRELOAD_EMBEDDING_MODEL", "").lower() in ("1", "true", "yes"):
+    model_registry.warm_up()
+
+# Apply pending schema migrations (tables, columns and indexes) in place
+if os.environ.get("RUN_MIGRATIONS_ON_STARTUP", "true").lower() in ("1", "true", "yes"):
+    try:
+        clinical_rag.run_migrations()
+    except Exception as e:
+        print(f"Could not apply schema migrations: {e}")
+
+# Load the in-memory vector indexes (falls back to IRIS vector search if unavailable)
+clinical_rag.load_vector_indexes()
+
+# Build the BM25 indexes for hybrid guideline/exercise retrieval
+clinical_rag.load_lexical_indexes()
+
+# Background job that refreshes stale guideline/exercise embeddings
+reindex_job = ReindexJob(clinical_rag.reindex_stale_embeddings)
+if os.environ.get("REINDEX_EMBEDDINGS_ON_STARTUP", "").lower() in ("1", "true", "yes"):
+    reindex_job.start()
+
+def include_embeddings_requested():
+    """Whether the client opted in to receiving embedding vectors (base64 little-endian float32)"""
+    return request.args.get('include_embeddings', '').lower() in ('1', 'true', 'yes')
+
 def signal_handler(sig, frame):
     """Handle SIGINT (Ctrl+C) and SIGTERM signals gracefully"""
     print("\nShutting down server...")
@@ -38,91 +93,33 @@ def signal_handler(sig, frame):
 
 @app.route('/api/initialize', methods=['POST'])
 def initialize_database():
-    """Initialize database tables for the clinical application with enhanced schema"""
+    """
+    Bring the database schema up to date by applying pending migrations in place.
+    Pass {"reset": true} to drop every table and start from an empty schema.
+    """
     try:
-        conn = clinical_rag.get_db_connection()
-        cursor = conn.cursor()
-        
-        try:
-            # Create schema if it doesn't exist
-            cursor.execute(f"CREATE SCHEMA {clinical_rag.SCHEMA_NAME}")
-        except Exception:
-            # Schema might already exist
-            pass
-        
-        try:
-            # Drop existing tables if they exist
-            cursor.execute(f"DROP TABLE {clinical_rag.PATIENT_TABLE}")
-            cursor.execute(f"DROP TABLE {clinical_rag.GUIDELINES_TABLE}")
-            cursor.execute(f"DROP TABLE {clinical_rag.EXERCISES_TABLE}")
-            cursor.execute(f"DROP TABLE {clinical_rag.SCHEMA_NAME}.PatientExercises")
-        except Exception:
-            # Tables might not exist yet
-            pass
-        
-        # Create patient data table with improved vector embeddings
-        cursor.execute(f"""
-            CREATE TABLE {clinical_rag.PATIENT_TABLE} (
-                id INTEGER PRIMARY KEY,
-                patient_id VARCHAR(50),
-                name VARCHAR(100),
-                age INTEGER,
-                gender VARCHAR(20),
-                condition VARCHAR(100),
-                medical_history VARCHAR(1000),
-                current_treatment VARCHAR(1000),
-                treatment_outcomes VARCHAR(1000),
-                progress_notes VARCHAR(2000),
-                assessment VARCHAR(2000),
-                adherence_rate INTEGER,
-                embedded_notes VECTOR(DOUBLE, 384),
-                embedded_history VECTOR(DOUBLE, 384),
-                embedded_treatment VECTOR(DOUBLE, 384),
-                embedded_demographics VECTOR(DOUBLE, 384),
-                embedded_outcomes VECTOR(DOUBLE, 384)
-            )
-        """)
-        
-        # Keep the same structure for other tables
-        cursor.execute(f"""
-            CREATE TABLE {clinical_rag.GUIDELINES_TABLE} (
-                id INTEGER PRIMARY KEY,
-                condition VARCHAR(100),
-                guideline_text VARCHAR(2000),
-                source VARCHAR(200),
-                embedded_text VECTOR(DOUBLE, 384)
-            )
-        """)
-        
-        cursor.execute(f"""
-            CREATE TABLE {clinical_rag.EXERCISES_TABLE} (
-                id INTEGER PRIMARY KEY,
-                condition VARCHAR(100),
-                severity VARCHAR(50),
-                exercise_name VARCHAR(100),
-                description VARCHAR(1000),
-                benefits VARCHAR(1000),
-                contraindications VARCHAR(500),
-                embedded_text VECTOR(DOUBLE, 384)
-            )
-        """)
-
-        cursor.execute(f"""
-            CREATE TABLE {clinical_rag.SCHEMA_NAME}.PatientExercises (
-                id INTEGER PRIMARY KEY,
-                patient_id INTEGER,
-                exercise_id INTEGER,
-                assigned_date VARCHAR(50),
-                status VARCHAR(50),
-                notes VARCHAR(1000)
-            )
-        """)
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        return jsonify({"message": "Database initialized successfully"})
+        data = request.get_json(silent=True) or {}
+        reset = bool(data.get('reset', False))
+        applied = clinical_rag.run_migrations(reset=reset)
+        
+        if reset:
+            # The tables were recreated, so id reservations start over
+            with clinical_rag.db_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    clinical_rag.id_allocator.reset(cursor)
+                    conn.commit()
+                finally:
+                    cursor.close()
+        
+        clinical_rag.load_vector_indexes()
+        clinical_rag.load_lexical_indexes()
+        clinical_rag.clear_answer_caches()
+        return jsonify({
+            "message": "Database initialized successfully",
+            "reset": reset,
+            "migrations": applied
+        })
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -378,94 +375,107 @@ def seed_sample_data():
             }
         ]
         
-        conn = clinical_rag.get_db_connection()
-        cursor = conn.cursor()
+        # Embed every patient facet, guideline and exercise text in one batched pass
+        patient_texts = [patient_embedding_texts(patient) for patient in patients]
+        guideline_texts = [guideline_embedding_text(guideline) for guideline in guidelines]
+        exercise_texts = [exercise_embedding_text(exercise) for exercise in exercises]
         
-        # Insert patients with multiple embeddings
-        for patient in patients:
-            # Create separate embeddings for different aspects
-            history_embedding = clinical_rag.model.encode(patient['medical_history'], normalize_embeddings=True).tolist()
-            treatment_embedding = clinical_rag.model.encode(patient['current_treatment'], normalize_embeddings=True).tolist()
-            
-            # Create demographics embedding
-            demographics_text = f"Age {patient['age']} {patient.get('gender', 'Unknown')} {patient['condition']}"
-            demographics_embedding = clinical_rag.model.encode(demographics_text, normalize_embeddings=True).tolist()
-            
-            # Create outcomes embedding
-            outcomes_text = f"{patient.get('treatment_outcomes', '')} {patient['assessment']}"
-            outcomes_embedding = clinical_rag.model.encode(outcomes_text, normalize_embeddings=True).tolist()
-            
-            # Create combined embedding for backward compatibility
-            combined_text = f"{patient['medical_history']} {patient['current_treatment']} {patient['progress_notes']} {patient['assessment']}"
-            combined_embedding = clinical_rag.model.encode(combined_text, normalize_embeddings=True).tolist()
+        all_texts = [text for texts in patient_texts for text in texts.values()] + guideline_texts + exercise_texts
+        vectors = iter(clinical_rag.embed_batch(all_texts))
+        patient_vectors = [{facet: next(vectors) for facet in texts} for texts in patient_texts]
+        guideline_vectors = [next(vectors) for _ in guidelines]
+        exercise_vectors = [next(vectors) for _ in exercises]
+        
+        with clinical_rag.db_connection() as conn:
+            cursor = conn.cursor()
+        
+            # Insert patients with multiple embeddings
+            for patient, facet_vectors in zip(patients, patient_vectors):
+                composite_embedding = compose_patient_vector(facet_vectors)
             
-            # Make sure the field order exactly matches the table definition
-            cursor.execute(
-                f"""
-                INSERT INTO {clinical_rag.PATIENT_TABLE} 
-                (id, patient_id, name, age, gender, condition, medical_history, current_treatment, 
-                treatment_outcomes, progress_notes, assessment, adherence_rate, 
-                embedded_notes, embedded_history, embedded_treatment, embedded_demographics, embedded_outcomes)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, TO_VECTOR(?), TO_VECTOR(?), TO_VECTOR(?), TO_VECTOR(?), TO_VECTOR(?))
-                """,
-                (
-                    patient["id"], 
-                    patient["patient_id"], 
-                    patient["name"], 
-                    patient["age"],
-                    patient["gender"],
-                    patient["condition"], 
-                    patient["medical_history"], 
-                    patient["current_treatment"],
-                    patient.get("treatment_outcomes", ""),
-                    patient["progress_notes"], 
-                    patient["assessment"],
-                    patient["adherence_rate"],
-                    str(combined_embedding),
-                    str(history_embedding),
-                    str(treatment_embedding),
-                    str(demographics_embedding),
-                    str(outcomes_embedding)
+                # Make sure the field order exactly matches the table definition
+                cursor.execute(
+                    f"""
+                    INSERT INTO {clinical_rag.PATIENT_TABLE} 
+                    (id, patient_id, name, age, gender, condition, medical_history, current_treatment, 
+                    treatment_outcomes, progress_notes, assessment, adherence_rate, 
+                    embedded_notes, embedded_history, embedded_treatment, embedded_demographics, embedded_outcomes,
+                    embedded_composite)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, TO_VECTOR(?), TO_VECTOR(?), TO_VECTOR(?), TO_VECTOR(?), TO_VECTOR(?), TO_VECTOR(?))
+                    """,
+                    (
+                        patient["id"], 
+                        patient["patient_id"], 
+                        patient["name"], 
+                        patient["age"],
+                        patient["gender"],
+                        patient["condition"], 
+                        patient["medical_history"], 
+                        patient["current_treatment"],
+                        patient.get("treatment_outcomes", ""),
+                        patient["progress_notes"], 
+                        patient["assessment"],
+                        patient["adherence_rate"],
+                        to_vector_param(facet_vectors["notes"]),
+                        to_vector_param(facet_vectors["history"]),
+                        to_vector_param(facet_vectors["treatment"]),
+                        to_vector_param(facet_vectors["demographics"]),
+                        to_vector_param(facet_vectors["outcomes"]),
+                        to_vector_param(composite_embedding)
+                    )
                 )
-            )
         
-        # Insert guidelines and exercises (same as before)
-        for guideline in guidelines:
-            embedding = clinical_rag.model.encode(guideline["guideline_text"], normalize_embeddings=True).tolist()
-            
-            cursor.execute(
-                f"INSERT INTO {clinical_rag.GUIDELINES_TABLE} VALUES (?, ?, ?, ?, TO_VECTOR(?))",
-                (
-                    guideline["id"],
-                    guideline["condition"],
-                    guideline["guideline_text"],
-                    guideline["source"],
-                    str(embedding)
+            # Insert guidelines and exercises (same as before)
+            for guideline, embedding_text, embedding in zip(guidelines, guideline_texts, guideline_vectors):
+                cursor.execute(
+                    f"""
+                    INSERT INTO {clinical_rag.GUIDELINES_TABLE}
+                    (id, condition, guideline_text, source, embedded_text, embedding_model, content_hash)
+                    VALUES (?, ?, ?, ?, TO_VECTOR(?), ?, ?)
+                    """,
+                    (
+                        guideline["id"],
+                        guideline["condition"],
+                        guideline["guideline_text"],
+                        guideline["source"],
+                        to_vector_param(embedding),
+                        embedding_fingerprint(),
+                        content_hash(embedding_text)
+                    )
                 )
-            )
         
-        for exercise in exercises:
-            combined_text = f"{exercise['exercise_name']} {exercise['description']} {exercise['benefits']}"
-            embedding = clinical_rag.model.encode(combined_text, normalize_embeddings=True).tolist()
-            
-            cursor.execute(
-                f"INSERT INTO {clinical_rag.EXERCISES_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, TO_VECTOR(?))",
-                (
-                    exercise["id"],
-                    exercise["condition"],
-                    exercise["severity"],
-                    exercise["exercise_name"],
-                    exercise["description"],
-                    exercise["benefits"],
-                    exercise["contraindications"],
-                    str(embedding)
+            for exercise, combined_text, embedding in zip(exercises, exercise_texts, exercise_vectors):
+                cursor.execute(
+                    f"""
+                    INSERT INTO {clinical_rag.EXERCISES_TABLE}
+                    (id, condition, severity, exercise_name, description, benefits, contraindications,
+                    embedded_text, embedding_model, content_hash)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, TO_VECTOR(?), ?, ?)
+                    """,
+                    (
+                        exercise["id"],
+                        exercise["condition"],
+                        exercise["severity"],
+                        exercise["exercise_name"],
+                        exercise["description"],
+                        exercise["benefits"],
+                        exercise["contraindications"],
+                        to_vector_param(embedding),
+                        embedding_fingerprint(),
+                        content_hash(combined_text)
+                    )
                 )
-            )
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+            # Sample rows use explicit ids, so later reservations continue after them
+            clinical_rag.id_allocator.reset(cursor)
         
+            conn.commit()
+            cursor.close()
+        
+        clinical_rag.load_vector_indexes()
+        clinical_rag.load_lexical_indexes()
+        clinical_rag.rebuild_patient_neighbors()
+        clinical_rag.clear_answer_caches()
         return jsonify({
             "message": "Sample data seeded successfully", 
             "patients_added": len(patients),
@@ -478,63 +488,98 @@ def seed_sample_data():
 
 @app.route('/api/patients', methods=['GET'])
 def get_patients():
-    """Get a list of all patients with explicit field selection"""
+    """
+    List patients in id order as a streamed JSON document.
+    Query parameters: after_id and limit for keyset pagination (no limit returns every patient),
+    fields for a comma-separated column projection, condition, min_adherence and max_adherence as filters,
+    include_embeddings to add the vector columns (base64 float32).
+    The response carries next_after_id, the cursor for the next page (null on the last page)
+    """
+    fields = [field.strip().lower() for field in request.args.get('fields', '').split(',') if field.strip()]
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', type=int)
+    condition = request.args.get('condition')
+    min_adherence = request.args.get('min_adherence', type=int)
+    max_adherence = request.args.get('max_adherence', type=int)
+    include_embeddings = include_embeddings_requested()
+    
+    if limit is not None and limit < 1:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    unknown_fields = set(fields) - set(PATIENT_LIST_COLUMNS)
+    if unknown_fields:
+        return jsonify({"error": f"Unknown patient fields: {', '.join(sorted(unknown_fields))}"}), 400
+    
+    def generate():
+        yield '{"patients": ['
+        count = 0
+        last_id = None
+        has_more = False
+        error = None
+        try:
+            # One extra row tells whether another page follows
+            for patient in clinical_rag.iter_patients(
+                fields=fields or None,
+                after_id=after_id,
+                limit=None if limit is None else limit + 1,
+                condition=condition,
+                min_adherence=min_adherence,
+                max_adherence=max_adherence,
+                include_embeddings=include_embeddings,
+                page_size=PATIENT_LIST_PAGE_SIZE
+            ):
+                if limit is not None and count == limit:
+                    has_more = True
+                    break
+                yield ("," if count else "") + app.json.dumps(patient)
+                count += 1
+                last_id = patient["id"]
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            error = str(e)
+        
+        trailer = {"count": count, "next_after_id": last_id if has_more else None}
+        if error:
+            trailer["error"] = error
+        yield "], " + app.json.dumps(trailer)[1:]
+    
+    response = Response(stream_with_context(generate()), mimetype='application/json')
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+@app.route('/api/patients/count', methods=['GET'])
+def get_patient_count():
+    """Get the total count of patients in the database"""
     try:
-        conn = clinical_rag.get_db_connection()
-        cursor = conn.cursor()
-        
-        # Explicitly select specific fields to avoid issues with column order
-        cursor.execute(
-            f"""
-            SELECT id, patient_id, name, age, gender, condition, 
-                   medical_history, current_treatment, treatment_outcomes,
-                   progress_notes, assessment, adherence_rate
-            FROM {clinical_rag.PATIENT_TABLE}
-            """
-        )
+        with clinical_rag.db_connection() as conn:
+            cursor = conn.cursor()
         
-        # Get column names from cursor description
-        column_names = [column[0].lower() for column in cursor.description]
+            cursor.execute(
+                f"SELECT COUNT(*) FROM {clinical_rag.PATIENT_TABLE}"
+            )
         
-        patients = []
-        for row in cursor.fetchall():
-            # Create a dictionary with explicit key-value pairs
-            patient_dict = {}
-            for i, col_name in enumerate(column_names):
-                patient_dict[col_name] = row[i]
-            
-            patients.append(patient_dict)
+            count = cursor.fetchone()[0]
         
-        cursor.close()
-        conn.close()
+            cursor.close()
         
-        response = jsonify({"patients": patients})
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        return response
+            return jsonify({"patient_count": count})
     
     except Exception as e:
-        import traceback
-        traceback.print_exc()  # This will print the full error stack trace to your console
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/patients/count', methods=['GET'])
-def get_patient_count():
-    """Get the total count of patients in the database"""
+@app.route('/api/patients/context', methods=['GET'])
+def get_patient_contexts():
+    """Get several patients with the exercises and guidelines for their conditions (ids=1,2,3)"""
     try:
-        conn = clinical_rag.get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            f"SELECT COUNT(*) FROM {clinical_rag.PATIENT_TABLE}"
-        )
-        
-        count = cursor.fetchone()[0]
+        ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+        if not ids:
+            return jsonify({"error": "ids is required"}), 400
         
-        cursor.close()
-        conn.close()
-        
-        return jsonify({"patient_count": count})
+        contexts = clinical_rag.load_patient_contexts(ids)
+        return jsonify({"patients": [contexts[i].to_dict() for i in ids if i in contexts]})
     
+    except ValueError:
+        return jsonify({"error": "ids must be a comma-separated list of integers"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -542,83 +587,83 @@ def get_patient_count():
 def get_patient_details(patient_id):
     """Get detailed information about a specific patient"""
     try:
-        conn = clinical_rag.get_db_connection()
-        cursor = conn.cursor()
+        with clinical_rag.db_connection() as conn:
+            cursor = conn.cursor()
         
-        # Get the column names from the table to ensure proper field mapping
-        cursor.execute(f"SELECT * FROM {clinical_rag.PATIENT_TABLE} WHERE id = ?", (patient_id,))
+            include_embeddings = include_embeddings_requested()
+            columns = list(PATIENT_LIST_COLUMNS)
+            embedding_columns = list(PATIENT_EMBEDDING_COLUMNS) if include_embeddings else []
+            cursor.execute(
+                f"SELECT {', '.join(columns + embedding_columns)} FROM {clinical_rag.PATIENT_TABLE} WHERE id = ?",
+                (patient_id,)
+            )
         
-        # Get column names from cursor description
-        column_names = [column[0] for column in cursor.description]
+            # Fetch the patient data
+            row = cursor.fetchone()
+            if not row:
+                cursor.close()
+                return jsonify({"error": "Patient not found"}), 404
+        
+            patient = dict(zip(columns, row))
+            if include_embeddings:
+                patient["embeddings"] = {
+                    column: vector_to_base64(value)
+                    for column, value in zip(embedding_columns, row[len(columns):])
+                }
         
-        # Fetch the patient data
-        row = cursor.fetchone()
-        if not row:
-            cursor.close()
-            conn.close()
-            return jsonify({"error": "Patient not found"}), 404
-        
-        # Create a dictionary with explicit key-value pairs to ensure correct mapping
-        patient = {}
-        for i, column_name in enumerate(column_names):
-            # Skip vector fields
-            if not column_name.startswith('embedded_'):
-                patient[column_name.lower()] = row[i]
-        
-        # Get relevant exercises for this patient's condition
-        cursor.execute(
-            f"""
-            SELECT TOP 3 exercise_name, description, benefits
-            FROM {clinical_rag.EXERCISES_TABLE}
-            WHERE condition = ?
-            """,
-            (patient.get("condition", ""),)
-        )
+            # Get relevant exercises for this patient's condition
+            cursor.execute(
+                f"""
+                SELECT TOP 3 exercise_name, description, benefits
+                FROM {clinical_rag.EXERCISES_TABLE}
+                WHERE condition = ?
+                """,
+                (patient.get("condition", ""),)
+            )
         
-        exercises = []
-        for row in cursor.fetchall():
-            exercises.append({
-                "name": row[0],
-                "description": row[1],
-                "benefits": row[2]
-            })
+            exercises = []
+            for row in cursor.fetchall():
+                exercises.append({
+                    "name": row[0],
+                    "description": row[1],
+                    "benefits": row[2]
+                })
         
-        patient["recommended_exercises"] = exercises
-        
-        # Get assigned exercises for this patient
-        cursor.execute(
-            f"""
-            SELECT pe.id, pe.exercise_id, pe.assigned_date, pe.status, pe.notes,
-                   e.exercise_name, e.description, e.benefits, e.contraindications, e.severity
-            FROM {clinical_rag.SCHEMA_NAME}.PatientExercises pe
-            JOIN {clinical_rag.EXERCISES_TABLE} e ON pe.exercise_id = e.id
-            WHERE pe.patient_id = ?
-            ORDER BY pe.assigned_date DESC
-            """,
-            (patient_id,)
-        )
+            patient["recommended_exercises"] = exercises
         
-        assigned_exercises = []
-        for row in cursor.fetchall():
-            assigned_exercises.append({
-                "id": row[0],
-                "exercise_id": row[1],
-                "assigned_date": row[2],
-                "status": row[3],
-                "notes": row[4],
-                "exercise_name": row[5],
-                "description": row[6],
-                "benefits": row[7],
-                "contraindications": row[8],
-                "severity": row[9]
-            })
+            # Get assigned exercises for this patient
+            cursor.execute(
+                f"""
+                SELECT pe.id, pe.exercise_id, pe.assigned_date, pe.status, pe.notes,
+                       e.exercise_name, e.description, e.benefits, e.contraindications, e.severity
+                FROM {clinical_rag.SCHEMA_NAME}.PatientExercises pe
+                JOIN {clinical_rag.EXERCISES_TABLE} e ON pe.exercise_id = e.id
+                WHERE pe.patient_id = ?
+                ORDER BY pe.assigned_date DESC
+                """,
+                (patient_id,)
+            )
         
-        patient["assigned_exercises"] = assigned_exercises
+            assigned_exercises = []
+            for row in cursor.fetchall():
+                assigned_exercises.append({
+                    "id": row[0],
+                    "exercise_id": row[1],
+                    "assigned_date": row[2],
+                    "status": row[3],
+                    "notes": row[4],
+                    "exercise_name": row[5],
+                    "description": row[6],
+                    "benefits": row[7],
+                    "contraindications": row[8],
+                    "severity": row[9]
+                })
+        
+            patient["assigned_exercises"] = assigned_exercises
         
-        cursor.close()
-        conn.close()
+            cursor.close()
         
-        return jsonify({"patient": patient})
+            return jsonify({"patient": patient})
     
     except Exception as e:
         import traceback
@@ -662,6 +707,10 @@ def delete_patient(patient_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Patient fields that can be changed through PUT /api/patient/<id>
+EDITABLE_PATIENT_FIELDS = ["name", "age", "gender", "condition", "medical_history",
+                           "current_treatment", "progress_notes", "assessment"]
+
 @app.route('/api/patient/<int:patient_id>', methods=['PUT'])
 def update_patient_progress(patient_id):
     """Update all editable fields for a patient"""
@@ -669,141 +718,120 @@ def update_patient_progress(patient_id):
         data = request.json
         print(f"Received update for patient {patient_id}: {data}")
         
+        # Take the assignment id before checking out a connection: reserving a new id block
+        # checks out one of its own
+        assign_exercise = "exercise_id" in data and data["exercise_id"]
+        new_id = clinical_rag.id_allocator.next_id(clinical_rag.PATIENT_EXERCISES_TABLE) if assign_exercise else None
+        
         # Connect to the database
-        conn = clinical_rag.get_db_connection()
-        cursor = conn.cursor()
+        with clinical_rag.db_connection() as conn:
+            cursor = conn.cursor()
         
-        # First check if the patient exists
-        cursor.execute(
-            f"SELECT id FROM {clinical_rag.PATIENT_TABLE} WHERE id = ?",
-            (patient_id,)
-        )
+            # First check if the patient exists
+            cursor.execute(
+                f"SELECT id FROM {clinical_rag.PATIENT_TABLE} WHERE id = ?",
+                (patient_id,)
+            )
         
-        if not cursor.fetchone():
-            cursor.close()
-            conn.close()
-            return jsonify({"status": "error", "message": "Patient not found"}), 404
+            if not cursor.fetchone():
+                cursor.close()
+                return jsonify({"status": "error", "message": "Patient not found"}), 404
         
-        # Build the update query dynamically based on what fields were provided
-        update_fields = []
-        params = []
+            # Build the update query dynamically based on what fields were provided
+            update_fields = []
+            params = []
         
-        # Add all editable fields (except patient_id which is not editable)
-        if "name" in data:
-            update_fields.append("name = ?")
-            params.append(data["name"])
+            # Add all editable fields (except patient_id which is not editable)
+            if "name" in data:
+                update_fields.append("name = ?")
+                params.append(data["name"])
             
-        if "age" in data:
-            update_fields.append("age = ?")
-            params.append(data["age"])
+            if "age" in data:
+                update_fields.append("age = ?")
+                params.append(data["age"])
 
-        if "gender" in data:
-            update_fields.append("gender = ?")
-            params.append(data["gender"])
+            if "gender" in data:
+                update_fields.append("gender = ?")
+                params.append(data["gender"])
             
-        if "condition" in data:
-            update_fields.append("condition = ?")
-            params.append(data["condition"])
+            if "condition" in data:
+                update_fields.append("condition = ?")
+                params.append(data["condition"])
             
-        if "medical_history" in data:
-            update_fields.append("medical_history = ?")
-            params.append(data["medical_history"])
+            if "medical_history" in data:
+                update_fields.append("medical_history = ?")
+                params.append(data["medical_history"])
             
-        if "current_treatment" in data:
-            update_fields.append("current_treatment = ?")
-            params.append(data["current_treatment"])
-        
-        # Always include progress_notes and assessment as they were in the original function
-        if "progress_notes" in data:
-            update_fields.append("progress_notes = ?")
-            params.append(data["progress_notes"])
+            if "current_treatment" in data:
+                update_fields.append("current_treatment = ?")
+                params.append(data["current_treatment"])
+        
+            # Always include progress_notes and assessment as they were in the original function
+            if "progress_notes" in data:
+                update_fields.append("progress_notes = ?")
+                params.append(data["progress_notes"])
             
-        if "assessment" in data:
-            update_fields.append("assessment = ?")
-            params.append(data["assessment"])
-        
-        # If there's nothing to update, return early
-        if not update_fields:
-            return jsonify({"status": "warning", "message": "No fields to update"})
-        
-        # Create the embedded notes for vector search
-        # We need to get current values for fields that aren't being updated
-        cursor.execute(
-            f"""
-            SELECT medical_history, current_treatment, progress_notes, assessment
-            FROM {clinical_rag.PATIENT_TABLE}
-            WHERE id = ?
-            """,
-            (patient_id,)
-        )
-        current_data = cursor.fetchone()
-        
-        # Prepare data for vector embedding - use new values where provided, otherwise use current values
-        medical_history = data.get("medical_history", current_data[0])
-        current_treatment = data.get("current_treatment", current_data[1])
-        progress_notes = data.get("progress_notes", current_data[2])
-        assessment = data.get("assessment", current_data[3])
-        
-        # Create a new embedding for the combined text
-        combined_text = f"{medical_history} {current_treatment} {progress_notes} {assessment}"
-        embedding = clinical_rag.model.encode(combined_text, normalize_embeddings=True).tolist()
-        
-        # Add the embedding update to our query
-        update_fields.append("embedded_notes = TO_VECTOR(?)")
-        params.append(str(embedding))
-        
-        # Add the patient_id as the last parameter for the WHERE clause
-        params.append(patient_id)
-        
-        # Execute the update query
-        update_query = f"""
-            UPDATE {clinical_rag.PATIENT_TABLE}
-            SET {', '.join(update_fields)}
-            WHERE id = ?
-        """
-        
-        print(f"Executing query: {update_query}")
-        print(f"With parameters: {params}")
+            if "assessment" in data:
+                update_fields.append("assessment = ?")
+                params.append(data["assessment"])
+        
+            # If there's nothing to update, return early
+            if not update_fields:
+                return jsonify({"status": "warning", "message": "No fields to update"})
+        
+            # Add the patient_id as the last parameter for the WHERE clause
+            params.append(patient_id)
+        
+            # Execute the update query
+            update_query = f"""
+                UPDATE {clinical_rag.PATIENT_TABLE}
+                SET {', '.join(update_fields)}
+                WHERE id = ?
+            """
         
-        cursor.execute(update_query, params)
+            print(f"Executing query: {update_query}")
+            print(f"With parameters: {params}")
         
-        # If an exercise_id was provided, also assign that exercise
-        if "exercise_id" in data and data["exercise_id"]:
-            try:
-                exercise_id = data["exercise_id"]
-                exercise_notes = data.get("exercise_notes", "Assigned during progress update")
-                
-                # Get the next ID
-                cursor.execute(f"SELECT MAX(id) FROM {clinical_rag.SCHEMA_NAME}.PatientExercises")
-                max_id = cursor.fetchone()[0]
-                new_id = 1 if max_id is None else max_id + 1
+            cursor.execute(update_query, params)
+            
+            # Re-embed only the facets whose source fields changed, along with the composite vector
+            changed_fields = [field for field in EDITABLE_PATIENT_FIELDS if field in data]
+            refreshed_facets = clinical_rag.refresh_patient_embeddings(cursor, patient_id, changed_fields)
+        
+            # If an exercise_id was provided, also assign that exercise
+            if assign_exercise:
+                try:
+                    exercise_id = data["exercise_id"]
+                    exercise_notes = data.get("exercise_notes", "Assigned during progress update")
                 
-                # Get current date
-                from datetime import datetime
-                assigned_date = datetime.now().strftime("%Y-%m-%d")
+                    # Get current date
+                    from datetime import datetime
+                    assigned_date = datetime.now().strftime("%Y-%m-%d")
                 
-                # Insert the exercise assignment
-                cursor.execute(
-                    f"INSERT INTO {clinical_rag.SCHEMA_NAME}.PatientExercises VALUES (?, ?, ?, ?, ?, ?)",
-                    (new_id, patient_id, exercise_id, assigned_date, "Assigned", exercise_notes)
-                )
+                    # Insert the exercise assignment
+                    cursor.execute(
+                        f"INSERT INTO {clinical_rag.SCHEMA_NAME}.PatientExercises VALUES (?, ?, ?, ?, ?, ?)",
+                        (new_id, patient_id, exercise_id, assigned_date, "Assigned", exercise_notes)
+                    )
                 
-                result = {"status": "success", "exercise_assigned": True}
-            except Exception as e:
-                # If exercise assignment fails, log it but don't fail the whole request
-                print(f"Error assigning exercise: {str(e)}")
-                result = {
-                    "status": "success", 
-                    "exercise_assigned": False,
-                    "exercise_error": str(e)
-                }
-        else:
-            result = {"status": "success"}
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+                    result = {"status": "success", "exercise_assigned": True}
+                except Exception as e:
+                    # If exercise assignment fails, log it but don't fail the whole request
+                    print(f"Error assigning exercise: {str(e)}")
+                    result = {
+                        "status": "success", 
+                        "exercise_assigned": False,
+                        "exercise_error": str(e)
+                    }
+            else:
+                result = {"status": "success"}
+        
+            conn.commit()
+            cursor.close()
         
+        if refreshed_facets:
+            clinical_rag.refresh_patient_neighbors(patient_id)
+        clinical_rag.invalidate_answers("patients", patient_id)
         return jsonify(result)
     
     except Exception as e:
@@ -817,35 +845,42 @@ def get_exercises():
     try:
         condition = request.args.get('condition')
         
-        conn = clinical_rag.get_db_connection()
-        cursor = conn.cursor()
-        
-        query = f"SELECT * FROM {clinical_rag.EXERCISES_TABLE}"
-        params = []
+        with clinical_rag.db_connection() as conn:
+            cursor = conn.cursor()
         
-        if condition:
-            query += " WHERE condition = ?"
-            params.append(condition)
-        
-        cursor.execute(query, params)
-        
-        exercises = []
-        for row in cursor.fetchall():
-            exercises.append({
-                "id": row[0],
-                "condition": row[1],
-                "severity": row[2],
-                "name": row[3],
-                "exercise_name": row[3],
-                "description": row[4],
-                "benefits": row[5],
-                "contraindications": row[6]
-            })
+            include_embeddings = include_embeddings_requested()
+            query = f"""
+                SELECT id, condition, severity, exercise_name, description, benefits, contraindications
+                       {', embedded_text' if include_embeddings else ''}
+                FROM {clinical_rag.EXERCISES_TABLE}
+            """
+            params = []
+        
+            if condition:
+                query += " WHERE condition = ?"
+                params.append(condition)
+        
+            cursor.execute(query, params)
+        
+            exercises = []
+            for row in cursor.fetchall():
+                exercise = {
+                    "id": row[0],
+                    "condition": row[1],
+                    "severity": row[2],
+                    "name": row[3],
+                    "exercise_name": row[3],
+                    "description": row[4],
+                    "benefits": row[5],
+                    "contraindications": row[6]
+                }
+                if include_embeddings:
+                    exercise["embeddings"] = {"embedded_text": vector_to_base64(row[7])}
+                exercises.append(exercise)
         
-        cursor.close()
-        conn.close()
+            cursor.close()
         
-        return jsonify({"exercises": exercises})
+            return jsonify({"exercises": exercises})
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -878,31 +913,38 @@ def get_guidelines():
     try:
         condition = request.args.get('condition')
         
-        conn = clinical_rag.get_db_connection()
-        cursor = conn.cursor()
+        with clinical_rag.db_connection() as conn:
+            cursor = conn.cursor()
         
-        query = f"SELECT * FROM {clinical_rag.GUIDELINES_TABLE}"
-        params = []
+            include_embeddings = include_embeddings_requested()
+            query = f"""
+                SELECT id, condition, guideline_text, source
+                       {', embedded_text' if include_embeddings else ''}
+                FROM {clinical_rag.GUIDELINES_TABLE}
+            """
+            params = []
         
-        if condition:
-            query += " WHERE condition = ?"
-            params.append(condition)
-        
-        cursor.execute(query, params)
-        
-        guidelines = []
-        for row in cursor.fetchall():
-            guidelines.append({
-                "id": row[0],
-                "condition": row[1],
-                "guideline_text": row[2],
-                "source": row[3]
-            })
+            if condition:
+                query += " WHERE condition = ?"
+                params.append(condition)
+        
+            cursor.execute(query, params)
+        
+            guidelines = []
+            for row in cursor.fetchall():
+                guideline = {
+                    "id": row[0],
+                    "condition": row[1],
+                    "guideline_text": row[2],
+                    "source": row[3]
+                }
+                if include_embeddings:
+                    guideline["embeddings"] = {"embedded_text": vector_to_base64(row[4])}
+                guidelines.append(guideline)
         
-        cursor.close()
-        conn.close()
+            cursor.close()
         
-        return jsonify({"guidelines": guidelines})
+            return jsonify({"guidelines": guidelines})
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -933,38 +975,37 @@ def add_guideline():
 def get_patient_exercises(patient_id):
     """Get exercises assigned to a specific patient"""
     try:
-        conn = clinical_rag.get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get assigned exercises with their details
-        cursor.execute(f"""
-            SELECT pe.id, pe.exercise_id, pe.assigned_date, pe.status, pe.notes,
-                   e.exercise_name, e.description, e.benefits, e.contraindications, e.severity
-            FROM {clinical_rag.SCHEMA_NAME}.PatientExercises pe
-            JOIN {clinical_rag.EXERCISES_TABLE} e ON pe.exercise_id = e.id
-            WHERE pe.patient_id = ?
-            ORDER BY pe.assigned_date DESC
-        """, (patient_id,))
-        
-        exercises = []
-        for row in cursor.fetchall():
-            exercises.append({
-                "id": row[0],
-                "exercise_id": row[1],
-                "assigned_date": row[2],
-                "status": row[3],
-                "notes": row[4],
-                "exercise_name": row[5],
-                "description": row[6],
-                "benefits": row[7],
-                "contraindications": row[8],
-                "severity": row[9]
-            })
+        with clinical_rag.db_connection() as conn:
+            cursor = conn.cursor()
+        
+            # Get assigned exercises with their details
+            cursor.execute(f"""
+                SELECT pe.id, pe.exercise_id, pe.assigned_date, pe.status, pe.notes,
+                       e.exercise_name, e.description, e.benefits, e.contraindications, e.severity
+                FROM {clinical_rag.SCHEMA_NAME}.PatientExercises pe
+                JOIN {clinical_rag.EXERCISES_TABLE} e ON pe.exercise_id = e.id
+                WHERE pe.patient_id = ?
+                ORDER BY pe.assigned_date DESC
+            """, (patient_id,))
+        
+            exercises = []
+            for row in cursor.fetchall():
+                exercises.append({
+                    "id": row[0],
+                    "exercise_id": row[1],
+                    "assigned_date": row[2],
+                    "status": row[3],
+                    "notes": row[4],
+                    "exercise_name": row[5],
+                    "description": row[6],
+                    "benefits": row[7],
+                    "contraindications": row[8],
+                    "severity": row[9]
+                })
         
-        cursor.close()
-        conn.close()
+            cursor.close()
         
-        return jsonify({"exercises": exercises})
+            return jsonify({"exercises": exercises})
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -985,25 +1026,22 @@ def assign_patient_exercise(patient_id):
         status = data.get("status", "Assigned")
         notes = data.get("notes", "")
         
-        conn = clinical_rag.get_db_connection()
-        cursor = conn.cursor()
+        # Get the next ID before checking out a connection
+        new_id = clinical_rag.id_allocator.next_id(clinical_rag.PATIENT_EXERCISES_TABLE)
         
-        # Get the next ID
-        cursor.execute(f"SELECT MAX(id) FROM {clinical_rag.SCHEMA_NAME}.PatientExercises")
-        max_id = cursor.fetchone()[0]
-        new_id = 1 if max_id is None else max_id + 1
+        with clinical_rag.db_connection() as conn:
+            cursor = conn.cursor()
         
-        # Insert the exercise assignment
-        cursor.execute(
-            f"INSERT INTO {clinical_rag.SCHEMA_NAME}.PatientExercises VALUES (?, ?, ?, ?, ?, ?)",
-            (new_id, patient_id, data["exercise_id"], assigned_date, status, notes)
-        )
+            # Insert the exercise assignment
+            cursor.execute(
+                f"INSERT INTO {clinical_rag.SCHEMA_NAME}.PatientExercises VALUES (?, ?, ?, ?, ?, ?)",
+                (new_id, patient_id, data["exercise_id"], assigned_date, status, notes)
+            )
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+            conn.commit()
+            cursor.close()
         
-        return jsonify({"id": new_id, "status": "success"}), 201
+            return jsonify({"id": new_id, "status": "success"}), 201
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1014,49 +1052,46 @@ def update_patient_exercise(patient_id, assignment_id):
     try:
         data = request.json
         
-        conn = clinical_rag.get_db_connection()
-        cursor = conn.cursor()
+        with clinical_rag.db_connection() as conn:
+            cursor = conn.cursor()
         
-        # Check if assignment exists
-        cursor.execute(
-            f"SELECT id FROM {clinical_rag.SCHEMA_NAME}.PatientExercises WHERE id = ? AND patient_id = ?",
-            (assignment_id, patient_id)
-        )
+            # Check if assignment exists
+            cursor.execute(
+                f"SELECT id FROM {clinical_rag.SCHEMA_NAME}.PatientExercises WHERE id = ? AND patient_id = ?",
+                (assignment_id, patient_id)
+            )
         
-        if not cursor.fetchone():
-            cursor.close()
-            conn.close()
-            return jsonify({"error": "Exercise assignment not found"}), 404
+            if not cursor.fetchone():
+                cursor.close()
+                return jsonify({"error": "Exercise assignment not found"}), 404
         
-        # Update fields
-        updates = []
-        params = []
+            # Update fields
+            updates = []
+            params = []
         
-        if "status" in data:
-            updates.append("status = ?")
-            params.append(data["status"])
+            if "status" in data:
+                updates.append("status = ?")
+                params.append(data["status"])
         
-        if "notes" in data:
-            updates.append("notes = ?")
-            params.append(data["notes"])
+            if "notes" in data:
+                updates.append("notes = ?")
+                params.append(data["notes"])
         
-        if not updates:
-            cursor.close()
-            conn.close()
-            return jsonify({"error": "No fields to update"}), 400
-        
-        # Execute update
-        params.extend([assignment_id, patient_id])
-        cursor.execute(
-            f"UPDATE {clinical_rag.SCHEMA_NAME}.PatientExercises SET {', '.join(updates)} WHERE id = ? AND patient_id = ?",
-            params
-        )
+            if not updates:
+                cursor.close()
+                return jsonify({"error": "No fields to update"}), 400
+        
+            # Execute update
+            params.extend([assignment_id, patient_id])
+            cursor.execute(
+                f"UPDATE {clinical_rag.SCHEMA_NAME}.PatientExercises SET {', '.join(updates)} WHERE id = ? AND patient_id = ?",
+                params
+            )
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+            conn.commit()
+            cursor.close()
         
-        return jsonify({"status": "success"})
+            return jsonify({"status": "success"})
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1065,46 +1100,119 @@ def update_patient_exercise(patient_id, assignment_id):
 def delete_patient_exercise(patient_id, assignment_id):
     """Remove an assigned exercise from a patient"""
     try:
-        conn = clinical_rag.get_db_connection()
-        cursor = conn.cursor()
+        with clinical_rag.db_connection() as conn:
+            cursor = conn.cursor()
         
-        # Check if assignment exists
-        cursor.execute(
-            f"SELECT id FROM {clinical_rag.SCHEMA_NAME}.PatientExercises WHERE id = ? AND patient_id = ?",
-            (assignment_id, patient_id)
-        )
+            # Check if assignment exists
+            cursor.execute(
+                f"SELECT id FROM {clinical_rag.SCHEMA_NAME}.PatientExercises WHERE id = ? AND patient_id = ?",
+                (assignment_id, patient_id)
+            )
         
-        if not cursor.fetchone():
-            cursor.close()
-            conn.close()
-            return jsonify({"error": "Exercise assignment not found"}), 404
+            if not cursor.fetchone():
+                cursor.close()
+                return jsonify({"error": "Exercise assignment not found"}), 404
         
-        # Delete the assignment
-        cursor.execute(
-            f"DELETE FROM {clinical_rag.SCHEMA_NAME}.PatientExercises WHERE id = ? AND patient_id = ?",
-            (assignment_id, patient_id)
-        )
+            # Delete the assignment
+            cursor.execute(
+                f"DELETE FROM {clinical_rag.SCHEMA_NAME}.PatientExercises WHERE id = ? AND patient_id = ?",
+                (assignment_id, patient_id)
+            )
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+            conn.commit()
+            cursor.close()
         
-        return jsonify({"status": "success"})
+            return jsonify({"status": "success"})
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/patient/<int:patient_id>/similar', methods=['GET'])
 def get_similar_patients(patient_id):
-    """Get similar patients using IRIS vector search"""
+    """
+    Get similar patients using vector search. Optional constraints applied before ranking:
+    condition, same_condition, gender, min_age, max_age and min_score; pass the returned
+    next_cursor as cursor to get the next page
+    """
     try:
         limit = request.args.get('limit', 3, type=int)
-        result = clinical_rag.find_similar_patients_iris_vector(patient_id, limit=limit)
+        try:
+            constraints = normalize_similarity_constraints({
+                name: request.args.get(name) for name in SIMILAR_PATIENT_CONSTRAINTS
+            })
+            after = decode_similarity_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        except ValueError as e:
+            return jsonify({"error": str(e), "similar_patients": []}), 400
+        
+        result = clinical_rag.find_similar_patients_iris_vector(
+            patient_id, limit=limit, constraints=constraints, after=after
+        )
+        
+        # Optionally attach each similar patient's condition exercises and guidelines, loaded in one batch
+        if request.args.get('include_context', '').lower() in ('1', 'true', 'yes') and result.get("similar_patients"):
+            contexts = clinical_rag.load_patient_contexts([p["id"] for p in result["similar_patients"]])
+            for similar in result["similar_patients"]:
+                context = contexts.get(similar["id"])
+                if context:
+                    similar["recommended_exercises"] = context.recommended_exercises
+                    similar["relevant_guidelines"] = context.relevant_guidelines
+        
         return jsonify(result)
     except Exception as e:
         print(f"Error in similar patients endpoint: {e}")
         return jsonify({"error": str(e), "similar_patients": []})
 
+@app.route('/api/patients/similar:batch', methods=['POST'])
+def get_similar_patients_batch():
+    """
+    Similar patients for many patients in one call. Body: {"patient_ids": [...], "limit": 3,
+    "min_score": 0.6}; results are keyed by patient id, with ids lacking vectors listed as missing
+    """
+    try:
+        data = request.json or {}
+        patient_ids = data.get("patient_ids")
+        if not isinstance(patient_ids, list) or not patient_ids:
+            return jsonify({"error": "patient_ids must be a non-empty list"}), 400
+        if len(patient_ids) > SIMILAR_BATCH_MAX_PATIENTS:
+            return jsonify({"error": f"At most {SIMILAR_BATCH_MAX_PATIENTS} patient_ids per request"}), 400
+        try:
+            patient_ids = [int(patient_id) for patient_id in patient_ids]
+            limit = int(data.get("limit", 3))
+            min_score = float(data["min_score"]) if data.get("min_score") is not None else None
+        except (TypeError, ValueError):
+            return jsonify({"error": "patient_ids and limit must be integers, min_score a number"}), 400
+        
+        started = time.perf_counter()
+        result = clinical_rag.find_similar_patients_batch(patient_ids, limit=limit, min_score=min_score)
+        elapsed = time.perf_counter() - started
+        
+        return jsonify({
+            "results": {str(patient_id): similar for patient_id, similar in result["results"].items()},
+            "missing": result["missing"],
+            "count": len(result["results"]),
+            "duration_ms": round(elapsed * 1000, 1),
+            "patients_per_second": round(len(result["results"]) / elapsed, 1) if elapsed > 0 else None
+        })
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/patients/neighbors/rebuild', methods=['POST'])
+def rebuild_patient_neighbors():
+    """Recompute every patient's stored nearest-neighbor list, e.g. after a bulk import outside the API"""
+    try:
+        started = time.perf_counter()
+        lists = clinical_rag.rebuild_patient_neighbors()
+        return jsonify({
+            "status": "success",
+            "patients": lists,
+            "k": clinical_rag.patient_neighbors.k,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/exercises/search', methods=['POST'])
 def search_exercises_by_description():
     """Search for exercises using semantic matching based on a text description"""
@@ -1139,44 +1247,72 @@ def search_exercises_by_description():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
     
+@app.route('/api/embeddings/reindex', methods=['POST'])
+def reindex_embeddings():
+    """Re-embed guidelines and exercises whose stored embeddings are stale"""
+    try:
+        data = request.get_json(silent=True) or {}
+        force = bool(data.get("force", False))
+        batch_size = data.get("batch_size", 32)
+        
+        if data.get("background", True):
+            started = reindex_job.start(force=force, batch_size=batch_size)
+            if not started:
+                return jsonify({"error": "A re-index is already running", "job": reindex_job.status()}), 409
+            return jsonify({"status": "started", "job": reindex_job.status()}), 202
+        
+        if reindex_job.is_running():
+            return jsonify({"error": "A re-index is already running", "job": reindex_job.status()}), 409
+        
+        return jsonify({"status": "completed", "job": reindex_job.run(force=force, batch_size=batch_size)})
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/embeddings/reindex', methods=['GET'])
+def get_reindex_status():
+    """Get the status of the most recent embedding re-index"""
+    return jsonify({"job": reindex_job.status()})
+    
 @app.route('/api/exercises/<int:exercise_id>', methods=['DELETE'])
 def delete_exercise(exercise_id):
     """Delete an exercise recommendation from the database"""
     try:
-        conn = clinical_rag.get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if the exercise exists
-        cursor.execute(
-            f"SELECT id FROM {clinical_rag.EXERCISES_TABLE} WHERE id = ?",
-            (exercise_id,)
-        )
+        with clinical_rag.db_connection() as conn:
+            cursor = conn.cursor()
         
-        if not cursor.fetchone():
-            cursor.close()
-            conn.close()
-            return jsonify({"error": "Exercise not found"}), 404
+            # Check if the exercise exists
+            cursor.execute(
+                f"SELECT id FROM {clinical_rag.EXERCISES_TABLE} WHERE id = ?",
+                (exercise_id,)
+            )
         
-        # Delete the exercise
-        cursor.execute(
-            f"DELETE FROM {clinical_rag.EXERCISES_TABLE} WHERE id = ?",
-            (exercise_id,)
-        )
+            if not cursor.fetchone():
+                cursor.close()
+                return jsonify({"error": "Exercise not found"}), 404
         
-        # Also remove any assignments of this exercise to patients
-        try:
+            # Delete the exercise
             cursor.execute(
-                f"DELETE FROM {clinical_rag.SCHEMA_NAME}.PatientExercises WHERE exercise_id = ?",
+                f"DELETE FROM {clinical_rag.EXERCISES_TABLE} WHERE id = ?",
                 (exercise_id,)
             )
-        except Exception:
-            # It's okay if this fails - maybe the table doesn't exist or there are no assignments
-            pass
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+            # Also remove any assignments of this exercise to patients
+            try:
+                cursor.execute(
+                    f"DELETE FROM {clinical_rag.SCHEMA_NAME}.PatientExercises WHERE exercise_id = ?",
+                    (exercise_id,)
+                )
+            except Exception:
+                # It's okay if this fails - maybe the table doesn't exist or there are no assignments
+                pass
         
+            conn.commit()
+            cursor.close()
+        
+        clinical_rag.remove_from_vector_index("exercises", exercise_id)
+        clinical_rag.remove_from_lexical_index("exercises", exercise_id)
+        clinical_rag.invalidate_answers("exercises", exercise_id)
         return jsonify({"status": "success", "message": "Exercise deleted successfully"})
     
     except Exception as e:
@@ -1187,60 +1323,159 @@ def delete_exercise(exercise_id):
 def delete_guideline(guideline_id):
     """Delete a clinical guideline from the database"""
     try:
-        conn = clinical_rag.get_db_connection()
-        cursor = conn.cursor()
+        with clinical_rag.db_connection() as conn:
+            cursor = conn.cursor()
         
-        # Check if the guideline exists
-        cursor.execute(
-            f"SELECT id FROM {clinical_rag.GUIDELINES_TABLE} WHERE id = ?",
-            (guideline_id,)
-        )
+            # Check if the guideline exists
+            cursor.execute(
+                f"SELECT id FROM {clinical_rag.GUIDELINES_TABLE} WHERE id = ?",
+                (guideline_id,)
+            )
         
-        if not cursor.fetchone():
-            cursor.close()
-            conn.close()
-            return jsonify({"error": "Guideline not found"}), 404
+            if not cursor.fetchone():
+                cursor.close()
+                return jsonify({"error": "Guideline not found"}), 404
         
-        # Delete the guideline
-        cursor.execute(
-            f"DELETE FROM {clinical_rag.GUIDELINES_TABLE} WHERE id = ?",
-            (guideline_id,)
-        )
+            # Delete the guideline
+            cursor.execute(
+                f"DELETE FROM {clinical_rag.GUIDELINES_TABLE} WHERE id = ?",
+                (guideline_id,)
+            )
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+            conn.commit()
+            cursor.close()
         
+        clinical_rag.remove_from_vector_index("guidelines", guideline_id)
+        clinical_rag.remove_from_lexical_index("guidelines", guideline_id)
+        clinical_rag.invalidate_answers("guidelines", guideline_id)
         return jsonify({"status": "success", "message": "Guideline deleted successfully"})
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/debug/pool', methods=['GET'])
+def debug_pool():
+    """Debug endpoint exposing database connection pool metrics"""
+    return jsonify({"pool": clinical_rag.pool.metrics()})
+
+@app.route('/api/debug/model', methods=['GET'])
+def debug_model():
+    """Debug endpoint reporting whether the embedding model is loaded and how long loading took"""
+    return jsonify({"model": model_registry.stats()})
+
+@app.route('/api/debug/llm', methods=['GET'])
+def debug_llm():
+    """Debug endpoint exposing Groq call latency (overall and time to first streamed token)"""
+    return jsonify({"llm": llm_stats()})
+
+@app.route('/api/debug/retrieval', methods=['GET'])
+def debug_retrieval():
+    """Debug endpoint exposing concurrent retrieval stage counters and the stages each intent's plan skipped"""
+    return jsonify({
+        "retrieval": clinical_rag.retrieval_executor.stats(),
+        "plans": clinical_rag.retrieval_planner.stats()
+    })
+
+@app.route('/api/debug/answer_cache', methods=['GET'])
+def debug_answer_cache():
+    """Debug endpoint exposing exact and semantic answer cache hit rates, invalidations and saved LLM time"""
+    return jsonify({
+        "answer_cache": clinical_rag.answer_cache.stats(),
+        "semantic_cache": clinical_rag.semantic_cache.stats()
+    })
+
+@app.route('/api/debug/embedding_cache', methods=['GET'])
+def debug_embedding_cache():
+    """Debug endpoint exposing embedding cache hit/miss/eviction counters"""
+    return jsonify({"embedding_cache": clinical_rag.embedding_cache.stats()})
+
+@app.route('/api/debug/vector_index', methods=['GET'])
+def debug_vector_index():
+    """Debug endpoint comparing the in-memory vector indexes with IRIS"""
+    try:
+        sample_size = request.args.get('sample', 3, type=int)
+        return jsonify({"vector_indexes": clinical_rag.check_vector_index_consistency(sample_size=sample_size)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/debug/lexical_index', methods=['GET'])
+def debug_lexical_index():
+    """Debug endpoint reporting the BM25 indexes used for hybrid guideline/exercise retrieval"""
+    return jsonify({
+        "hybrid_retrieval": clinical_rag.hybrid_retrieval,
+        "lexical_indexes": {kind: index.stats() for kind, index in clinical_rag.lexical_indexes.items()}
+    })
+
+@app.route('/api/debug/query_match', methods=['GET'])
+def debug_query_match():
+    """Debug endpoint showing how the phrase table reads a query (?q=...): intent, route, matched labels and name spans"""
+    match = clinical_rag.query_matcher.match(request.args.get('q', ''))
+    return jsonify({
+        "intent": match.intent,
+        "route": match.route,
+        "labels": sorted(match.labels),
+        "patient_name": match.patient_name,
+        "name_spans": [{"start": start, "end": end, "text": text} for start, end, text in match.name_spans]
+    })
+
+@app.route('/api/debug/schema', methods=['GET'])
+def debug_schema():
+    """Debug endpoint reporting the applied schema version and pending migrations"""
+    try:
+        with clinical_rag.db_connection() as conn:
+            return jsonify({"schema": clinical_rag.migrations.status(conn)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/debug/patient_neighbors', methods=['GET'])
+def debug_patient_neighbors():
+    """Debug endpoint exposing neighbor graph lookups, fallbacks to live ranking and maintenance counters"""
+    return jsonify({"patient_neighbors": clinical_rag.patient_neighbors.stats()})
+
 @app.route('/api/debug/patients', methods=['GET'])
 def debug_patients():
     """Debug endpoint to list all patients"""
     try:
-        conn = clinical_rag.get_db_connection()
-        cursor = conn.cursor()
+        with clinical_rag.db_connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute(f"SELECT id, name, condition FROM {clinical_rag.PATIENT_TABLE}")
+            cursor.execute(f"SELECT id, name, condition FROM {clinical_rag.PATIENT_TABLE}")
         
-        patients = []
-        for row in cursor.fetchall():
-            patients.append({
-                "id": row[0],
-                "name": row[1],
-                "condition": row[2]
-            })
+            patients = []
+            for row in cursor.fetchall():
+                patients.append({
+                    "id": row[0],
+                    "name": row[1],
+                    "condition": row[2]
+                })
         
-        cursor.close()
-        conn.close()
+            cursor.close()
         
-        return jsonify({"patients": patients})
+            return jsonify({"patients": patients})
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def stream_chat_response(query, patient_id, filters, stream_format='sse'):
+    """
+    Stream a chat answer as server-sent events (default) or newline-delimited JSON.
+    Events: "evidence" once retrieval finishes, "token" per piece of the answer, then "done" or "error"
+    """
+    def generate():
+        for event, payload in clinical_rag.process_query_stream(query, patient_id, filters):
+            if stream_format == 'ndjson':
+                yield app.json.dumps({"event": event, "data": payload}) + "\n"
+            else:
+                yield f"event: {event}\ndata: {app.json.dumps(payload)}\n\n"
+        print("==== Completed Streaming Chat Request ====\n")
+    
+    mimetype = 'application/x-ndjson' if stream_format == 'ndjson' else 'text/event-stream'
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route('/api/chat', methods=['POST'])
 @cross_origin(origins="http://localhost:3000", supports_credentials=True)
 def chat():
@@ -1252,15 +1487,26 @@ def chat():
         patient_id = data.get('patient_id')
         condition = data.get('condition')
         
+        # Structured retrieval filters (condition, severity, source); "condition" is kept as a shorthand
+        filters = data.get('filters') if isinstance(data.get('filters'), dict) else {}
+        if condition:
+            filters.setdefault('condition', condition)
+        
         print(f"Query: {query}")
         print(f"Patient ID: {patient_id}")
-        print(f"Condition: {condition}")
+        print(f"Filters: {filters}")
         
         if not query:
             return jsonify({"error": "Query is required"}), 400
         
+        # Stream the evidence and then the answer tokens when the client asks for it
+        accept = request.headers.get('Accept', '')
+        if data.get('stream') or 'text/event-stream' in accept or 'application/x-ndjson' in accept:
+            stream_format = data.get('stream_format') or ('ndjson' if 'application/x-ndjson' in accept else 'sse')
+            return stream_chat_response(query, patient_id, filters, stream_format)
+        
         # Process the query through the RAG pipeline
-        result = clinical_rag.process_query(query, patient_id, condition)
+        result = clinical_rag.process_query(query, patient_id, filters)
         
         # Check if we got a valid result
         if not result or "response" not in result:
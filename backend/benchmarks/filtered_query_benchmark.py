@@ -0,0 +1,125 @@
+"""
+Time the filtered queries the portal runs (patients and exercises by condition, patients by name,
+exercise assignments by patient) with and without the secondary indexes from the migrations.
+Synthetic rows are inserted first so the tables are large enough for the indexes to matter, and
+removed afterwards. Needs a running IRIS instance configured as for the app.
+
+Run from the backend directory: python benchmarks/filtered_query_benchmark.py --patients 20000 --repeat 50
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clinical_rag import ClinicalRAG
+from migrations import execute_ddl
+
+SYNTHETIC_PREFIX = "Benchmark Patient"
+
+
+def seed(rag, conn, cursor, patients, conditions):
+    patient_ids = rag.id_allocator.allocate(rag.PATIENT_TABLE, patients)
+    assignment_ids = rag.id_allocator.allocate(rag.PATIENT_EXERCISES_TABLE, patients * 3)
+    for offset, patient_id in enumerate(patient_ids):
+        cursor.execute(
+            f"INSERT INTO {rag.PATIENT_TABLE} (id, name, condition) VALUES (?, ?, ?)",
+            (patient_id, f"{SYNTHETIC_PREFIX} {patient_id}", conditions[offset % len(conditions)])
+        )
+    for offset, assignment_id in enumerate(assignment_ids):
+        cursor.execute(
+            f"INSERT INTO {rag.PATIENT_EXERCISES_TABLE} (id, patient_id, exercise_id, status) VALUES (?, ?, ?, ?)",
+            (assignment_id, patient_ids[offset // 3], random.randint(1, 200), "Assigned")
+        )
+    conn.commit()
+    return patient_ids
+
+
+def cleanup(rag, conn, cursor, patient_ids):
+    cursor.execute(f"DELETE FROM {rag.PATIENT_TABLE} WHERE name LIKE ?", (f"{SYNTHETIC_PREFIX} %",))
+    for start in range(0, len(patient_ids), 500):
+        chunk = patient_ids[start:start + 500]
+        cursor.execute(
+            f"DELETE FROM {rag.PATIENT_EXERCISES_TABLE} WHERE patient_id IN ({', '.join('?' for _ in chunk)})",
+            chunk
+        )
+    conn.commit()
+
+
+def time_queries(rag, cursor, patient_ids, conditions, repeat):
+    queries = {
+        "patients by condition": (
+            f"SELECT id, name FROM {rag.PATIENT_TABLE} WHERE condition = ?",
+            lambda: (random.choice(conditions),)
+        ),
+        "patient by name": (
+            f"SELECT id, condition FROM {rag.PATIENT_TABLE} WHERE name = ?",
+            lambda: (f"{SYNTHETIC_PREFIX} {random.choice(patient_ids)}",)
+        ),
+        "exercises by condition": (
+            f"SELECT id, exercise_name FROM {rag.EXERCISES_TABLE} WHERE condition = ?",
+            lambda: (random.choice(conditions),)
+        ),
+        "assignments by patient": (
+            f"SELECT id, exercise_id, status FROM {rag.PATIENT_EXERCISES_TABLE} WHERE patient_id = ?",
+            lambda: (random.choice(patient_ids),)
+        )
+    }
+    medians = {}
+    for name, (sql, params) in queries.items():
+        durations = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            cursor.execute(sql, params())
+            cursor.fetchall()
+            durations.append(time.perf_counter() - started)
+        medians[name] = statistics.median(durations) * 1000
+    return medians
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--patients", type=int, default=20000)
+    parser.add_argument("--conditions", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rag = ClinicalRAG()
+    rag.run_migrations()
+    conditions = [f"Benchmark Condition {n}" for n in range(args.conditions)]
+
+    with rag.db_connection() as conn:
+        cursor = conn.cursor()
+        patient_ids = seed(rag, conn, cursor, args.patients, conditions)
+        try:
+            indexes = rag.migrations.secondary_indexes()
+            for index_name, table, _ in indexes:
+                try:
+                    cursor.execute(f"DROP INDEX {index_name} ON TABLE {table}")
+                except Exception:
+                    # Index was never created
+                    pass
+            conn.commit()
+            without_indexes = time_queries(rag, cursor, patient_ids, conditions, args.repeat)
+
+            for index_name, table, column in indexes:
+                execute_ddl(cursor, f"CREATE INDEX {index_name} ON TABLE {table} ({column})")
+            conn.commit()
+            with_indexes = time_queries(rag, cursor, patient_ids, conditions, args.repeat)
+        finally:
+            cleanup(rag, conn, cursor, patient_ids)
+            cursor.close()
+
+    print(f"{'query':<24} {'no index':>10} {'indexed':>10} {'speedup':>8}   (median of {args.repeat}, {args.patients} patients)")
+    for name, baseline in without_indexes.items():
+        indexed = with_indexes[name]
+        print(f"{name:<24} {baseline:8.2f}ms {indexed:8.2f}ms {baseline / indexed:7.1f}x")
+
+    rag.cleanup()
+
+
+if __name__ == "__main__":
+    main()
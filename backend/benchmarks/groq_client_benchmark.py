@@ -0,0 +1,82 @@
+"""
+Compare a new Groq client per call (the old behaviour) with the shared keep-alive client in
+direct_groq, against the local fake endpoint. Reports latency and TCP connections opened.
+
+Run from the backend directory: python benchmarks/groq_client_benchmark.py --calls 200 --threads 8
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_groq import FakeGroqServer
+
+
+def per_call_client(system_prompt, user_prompt):
+    from groq import Groq
+
+    client = Groq(api_key=os.environ["GROQ_API_KEY"], base_url=os.environ["GROQ_BASE_URL"])
+    try:
+        response = client.chat.completions.create(
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            model="llama-3.3-70b-versatile",
+            temperature=0.5
+        )
+        return response.choices[0].message.content
+    finally:
+        client.close()
+
+
+def run(name, call, server, calls, threads):
+    server.reset_counters()
+    durations = []
+
+    def timed(_):
+        started = time.perf_counter()
+        call("You are a test assistant.", "Say something.")
+        durations.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(timed, range(calls)))
+    wall = time.perf_counter() - started
+
+    durations.sort()
+    print(
+        f"{name:<18} calls={calls:<5} wall={wall:6.2f}s  "
+        f"p50={statistics.median(durations) * 1000:7.1f}ms  "
+        f"p95={durations[int(0.95 * (len(durations) - 1))] * 1000:7.1f}ms  "
+        f"connections={server.connections}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    server = FakeGroqServer(latency_ms=args.latency_ms).start()
+    os.environ["GROQ_API_KEY"] = "benchmark-key"
+    os.environ["GROQ_BASE_URL"] = server.base_url
+
+    import direct_groq
+
+    run("client per call", per_call_client, server, args.calls, args.threads)
+    run("shared client", direct_groq.generate_llm_response, server, args.calls, args.threads)
+    print(f"shared client stats: {direct_groq.llm_stats()}")
+
+    direct_groq.close_groq_client()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Measure the retrieval latency the intent-aware retrieval plans save: every intent's sample query
+is retrieved for the same patient with the planner disabled (every stage runs, as before) and
+enabled, and the median latencies are compared. The LLM is not called. Needs a running IRIS
+instance with seeded data and the embedding model, configured as for the app.
+
+Run from the backend directory: python benchmarks/retrieval_plan_benchmark.py --repeat 20
+Pass --no-semantic-cache to also see the saving from skipping the query embedding.
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clinical_rag import ClinicalRAG
+
+SAMPLE_QUERIES = {
+    "INFORMATION": "Tell me about this patient's current status",
+    "GENERAL": "How is the patient doing overall?",
+    "RECOMMENDATION": "What should we recommend next for this patient?",
+    "EXERCISE": "Which exercise fits this patient's balance problems?",
+    "GUIDELINE": "Which guideline applies to this patient?",
+}
+
+
+def median_latency(rag, query, patient_id, repeat):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        # The retrieval path logs every stage; keep the benchmark output readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            rag._retrieve_context(query, patient_id)
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--patient-id", type=int)
+    parser.add_argument("--no-semantic-cache", action="store_true")
+    args = parser.parse_args()
+
+    rag = ClinicalRAG()
+    rag.load_vector_indexes()
+    rag.load_lexical_indexes()
+    if args.no_semantic_cache:
+        rag.semantic_cache.max_entries = 0
+
+    patient_id = args.patient_id
+    if patient_id is None:
+        with rag.db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"SELECT TOP 1 id FROM {rag.PATIENT_TABLE} ORDER BY id")
+                row = cursor.fetchone()
+            finally:
+                cursor.close()
+        if not row:
+            sys.exit("No patients found; seed the database first")
+        patient_id = row[0]
+
+    # Warm the model, the pool and the caches before timing
+    rag.embed_text("warm up")
+    for query in SAMPLE_QUERIES.values():
+        median_latency(rag, query, patient_id, 1)
+
+    print(f"{'intent':<16} {'all stages':>11} {'planned':>10} {'saved':>9}   stages run   (median of {args.repeat}, patient {patient_id})")
+    for intent, query in SAMPLE_QUERIES.items():
+        rag.retrieval_planner.enabled = False
+        baseline = median_latency(rag, query, patient_id, args.repeat)
+        rag.retrieval_planner.enabled = True
+        planned = median_latency(rag, query, patient_id, args.repeat)
+        stages = rag.retrieval_planner.plan(
+            intent, rag.query_matcher.match(query).labels, True,
+            semantic_cache=rag.semantic_cache.max_entries > 0
+        ).stages
+        print(f"{intent:<16} {baseline:9.1f}ms {planned:8.1f}ms {baseline - planned:7.1f}ms   {', '.join(sorted(stages))}")
+
+    rag.cleanup()
+
+
+if __name__ == "__main__":
+    main()
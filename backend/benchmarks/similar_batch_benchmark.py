@@ -0,0 +1,67 @@
+"""
+Compare one-patient-at-a-time similar-patient ranking (a matrix-vector product per patient, as
+GET /api/patient/:id/similar does against the in-memory index) with the batched ranking behind
+POST /api/patients/similar:batch (matrix-matrix products over blocks of patients), reported in
+patients per second. Synthetic composite vectors; needs only NumPy.
+
+Run from the backend directory: python benchmarks/similar_batch_benchmark.py --corpus 20000 --batch 1000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from patient_vectors import SIMILARITY_WEIGHTS, COMPOSITE_DIMENSION, EMBEDDING_DIMENSION, compose_patient_vector
+from vector_index import VectorIndex
+
+
+def synthetic_composites(rng, count):
+    composites = []
+    for _ in range(count):
+        facets = {}
+        for facet, _ in SIMILARITY_WEIGHTS:
+            vector = rng.standard_normal(EMBEDDING_DIMENSION)
+            facets[facet] = vector / np.linalg.norm(vector)
+        composites.append(compose_patient_vector(facets))
+    return composites
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=3)
+    parser.add_argument("--block-size", type=int, default=256)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    index = VectorIndex("patients", COMPOSITE_DIMENSION)
+    index.load((row_id, vector, None) for row_id, vector in enumerate(synthetic_composites(rng, args.corpus), start=1))
+    patient_ids = [int(row_id) for row_id in rng.choice(index.ids(), size=min(args.batch, args.corpus), replace=False)]
+    queries = [index.get(patient_id) for patient_id in patient_ids]
+
+    started = time.perf_counter()
+    single = [index.search(query, args.limit, exclude_ids=[patient_id]) for patient_id, query in zip(patient_ids, queries)]
+    single_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batched = index.search_many(queries, args.limit, exclude_ids=patient_ids, block_size=args.block_size)
+    batch_seconds = time.perf_counter() - started
+
+    agreement = np.mean([
+        [row_id for row_id, _ in one] == [row_id for row_id, _ in many]
+        for one, many in zip(single, batched)
+    ])
+    print(f"{len(patient_ids)} patients against {args.corpus}, top {args.limit}")
+    print(f"one at a time  {len(patient_ids) / single_seconds:10.0f} patients/s  ({single_seconds * 1000:8.1f}ms)")
+    print(f"batched        {len(patient_ids) / batch_seconds:10.0f} patients/s  ({batch_seconds * 1000:8.1f}ms)"
+          f"  {single_seconds / batch_seconds:4.1f}x")
+    print(f"identical top-{args.limit}: {agreement:.1%}")
+
+
+if __name__ == "__main__":
+    main()
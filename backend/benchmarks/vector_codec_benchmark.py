@@ -0,0 +1,74 @@
+"""
+Compare the old str(vector.tolist()) serialization of TO_VECTOR(?) parameters with vector_codec,
+per query vector (384-d), per patient insert (five 384-d facets plus the 1536-d composite),
+and for parsing vectors read back from IRIS. Needs only NumPy.
+
+Run from the backend directory: python benchmarks/vector_codec_benchmark.py --repeat 2000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_codec import parse_vector, to_vector_param
+
+
+def legacy_param(vector):
+    return str(vector.tolist())
+
+
+def legacy_parse(value):
+    return np.array([float(x) for x in value.strip("[]").split(",") if x.strip()], dtype=np.float64)
+
+
+def unit_vector(rng, dimension):
+    vector = rng.standard_normal(dimension)
+    return vector / np.linalg.norm(vector)
+
+
+def report(name, legacy_fn, codec_fn, repeat, legacy_bytes=None, codec_bytes=None):
+    legacy = timeit.timeit(legacy_fn, number=repeat) / repeat * 1e6
+    codec = timeit.timeit(codec_fn, number=repeat) / repeat * 1e6
+    sizes = f"  {legacy_bytes:>6}B -> {codec_bytes:>6}B" if legacy_bytes is not None else ""
+    print(f"{name:<22} {legacy:8.1f}us -> {codec:8.1f}us  ({legacy / codec:4.1f}x){sizes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    query = unit_vector(rng, 384)
+    patient_vectors = [unit_vector(rng, 384) for _ in range(5)] + [unit_vector(rng, 1536)]
+
+    report(
+        "query vector (384-d)",
+        lambda: legacy_param(query),
+        lambda: to_vector_param(query),
+        args.repeat,
+        len(legacy_param(query)),
+        len(to_vector_param(query))
+    )
+    report(
+        "patient insert (6 vec)",
+        lambda: [legacy_param(vector) for vector in patient_vectors],
+        lambda: [to_vector_param(vector) for vector in patient_vectors],
+        args.repeat,
+        sum(len(legacy_param(vector)) for vector in patient_vectors),
+        sum(len(to_vector_param(vector)) for vector in patient_vectors)
+    )
+
+    stored = to_vector_param(query)
+    report("parse (384-d)", lambda: legacy_parse(stored), lambda: parse_vector(stored), args.repeat)
+
+    error = np.max(np.abs(parse_vector(stored) - query))
+    print(f"max round-trip error: {error:.2e}")
+
+
+if __name__ == "__main__":
+    main()
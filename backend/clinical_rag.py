@@ -1,11 +1,52 @@
 import os
+import time
 import iris
-from sentence_transformers import SentenceTransformer
 import numpy as np
 from dotenv import load_dotenv
-from direct_groq import generate_llm_response
+from direct_groq import generate_llm_response, stream_llm_response, close_groq_client
+from db_pool import ConnectionPool
+from vector_index import VectorIndex
+from embedding_cache import EmbeddingCache
+from retrieval_executor import RetrievalExecutor
+from retrieval_plan import RetrievalPlanner
+from query_matcher import INTENT_PRIORITY, PHRASE_TABLE, QueryMatcher, load_phrase_table
+from answer_cache import AnswerCache, answer_cache_key, context_tags, evidence_key
+from semantic_cache import SemanticAnswerCache
+from patient_context import PATIENT_LIST_COLUMNS, PatientContextLoader
+from id_allocator import IdAllocator
+from migrations import MigrationRunner
+from patient_neighbors import PatientNeighborGraph
+from patient_vectors import (
+    SIMILARITY_WEIGHTS,
+    FACET_COLUMNS,
+    PATIENT_EMBEDDING_COLUMNS,
+    EMBEDDING_DIMENSION,
+    COMPOSITE_DIMENSION,
+    patient_embedding_texts,
+    facets_affected_by,
+    compose_patient_vector,
+    composite_facet_scores
+)
+from lexical_index import LexicalIndex, is_exact_term_query, reciprocal_rank_fusion
+from retrieval_filters import (
+    FILTERABLE_COLUMNS,
+    build_where_clause,
+    encode_similarity_cursor,
+    filters_for,
+    index_filters,
+    normalize_filters,
+    normalize_similarity_constraints
+)
+from vector_codec import parse_vector, to_vector_param, vector_to_base64
+from embeddings import (
+    model_registry,
+    encode_texts,
+    embedding_fingerprint,
+    content_hash,
+    exercise_embedding_text,
+    guideline_embedding_text
+)
 import atexit
-import torch
 
 # Load environment variables if not already loaded
 env_file_path = '.env.local'
@@ -15,7 +56,8 @@ else:
     # Try loading from .env if .env.local doesn't exist
     load_dotenv()
 
-_model = None
+# Similar patients cited in answers must share the patient's condition and score at least this much
+SIMILAR_PATIENT_MIN_SCORE = 0.6
 
 class ClinicalRAG:
     def __init__(self):
@@ -27,14 +69,108 @@ class ClinicalRAG:
         self.namespace = 'USER'
         self.CONNECTION_STRING = f"{self.hostname}:{self.port}/{self.namespace}"
         
-        # Initialize the embedding model
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        # Pool of IRIS connections shared by all requests
+        self.pool = ConnectionPool(
+            self.get_db_connection,
+            max_size=int(os.getenv('IRIS_POOL_SIZE', '10')),
+            max_idle_seconds=float(os.getenv('IRIS_POOL_MAX_IDLE_SECONDS', '300')),
+            health_check_after_seconds=float(os.getenv('IRIS_POOL_HEALTH_CHECK_SECONDS', '30')),
+            checkout_timeout=float(os.getenv('IRIS_POOL_CHECKOUT_TIMEOUT', '10'))
+        )
+        
+        # The embedding model is shared process-wide and loaded on first use (see the model property)
+        self.model_registry = model_registry
+        
+        # Content-addressed cache in front of every model call; set EMBEDDING_CACHE_DIR to persist it
+        self.embedding_cache = EmbeddingCache(
+            embedding_fingerprint(),
+            EMBEDDING_DIMENSION,
+            max_entries=int(os.getenv('EMBEDDING_CACHE_SIZE', '10000')),
+            disk_dir=os.getenv('EMBEDDING_CACHE_DIR') or None,
+            disk_capacity=int(os.getenv('EMBEDDING_CACHE_DISK_CAPACITY', '100000'))
+        )
+        
+        # Thread pool that runs the independent retrieval stages of a query concurrently
+        self.retrieval_executor = RetrievalExecutor(
+            max_workers=int(os.getenv('RETRIEVAL_WORKERS', '8')),
+            default_timeout=float(os.getenv('RETRIEVAL_STAGE_TIMEOUT_SECONDS', '5'))
+        )
+        
+        # Intent, routing triggers and patient name of a query, found in one pass over its text;
+        # QUERY_PHRASES_FILE adds phrases (or whole intents) to the built-in phrase table
+        phrases_file = os.getenv('QUERY_PHRASES_FILE')
+        phrase_table, intents = load_phrase_table(phrases_file) if phrases_file else (PHRASE_TABLE, INTENT_PRIORITY)
+        self.query_matcher = QueryMatcher(phrase_table, intents)
+        
+        # Decides per intent which retrieval stages a general query runs
+        self.retrieval_planner = RetrievalPlanner(
+            enabled=os.getenv('RETRIEVAL_PLANNER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        )
+        
+        # LLM answers keyed on the prompt fingerprint; writes invalidate the answers built from the rows they touch
+        self.answer_cache = AnswerCache(
+            max_entries=int(os.getenv('ANSWER_CACHE_SIZE', '500')),
+            ttl_seconds=float(os.getenv('ANSWER_CACHE_TTL_SECONDS', '600'))
+        )
+        
+        # Answers reused across paraphrased queries about the same patient with the same intent
+        self.semantic_cache = SemanticAnswerCache(
+            threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.9')),
+            max_entries=int(os.getenv('SEMANTIC_CACHE_SIZE', '500')),
+            ttl_seconds=float(os.getenv('ANSWER_CACHE_TTL_SECONDS', '600'))
+        )
         
         # Table settings
         self.SCHEMA_NAME = "Rehab"
         self.PATIENT_TABLE = f"{self.SCHEMA_NAME}.PatientData"
         self.GUIDELINES_TABLE = f"{self.SCHEMA_NAME}.ClinicalGuidelines"
         self.EXERCISES_TABLE = f"{self.SCHEMA_NAME}.ExerciseRecommendations"
+        self.PATIENT_EXERCISES_TABLE = f"{self.SCHEMA_NAME}.PatientExercises"
+        self.PATIENT_NEIGHBORS_TABLE = f"{self.SCHEMA_NAME}.PatientNeighbors"
+        
+        # Primary keys come from blocks reserved in a sequences table instead of SELECT MAX(id)
+        self.id_allocator = IdAllocator(
+            self.db_connection,
+            f"{self.SCHEMA_NAME}.IdSequences",
+            block_size=int(os.getenv('ID_BLOCK_SIZE', '50'))
+        )
+        
+        # Materialized top-K similar patients, maintained on every patient write
+        self.patient_neighbors = PatientNeighborGraph(
+            self,
+            self.PATIENT_NEIGHBORS_TABLE,
+            k=int(os.getenv('PATIENT_NEIGHBORS_K', '10'))
+        )
+        
+        # Versioned schema migrations, run at startup and by /api/initialize
+        self.migrations = MigrationRunner(self)
+        
+        # Loads a patient together with the exercises and guidelines for their condition
+        self.patient_contexts = PatientContextLoader(self.PATIENT_TABLE, self.EXERCISES_TABLE, self.GUIDELINES_TABLE)
+        
+        # Optional in-memory mirrors of the embedding columns; IRIS vector search is the fallback
+        self.vector_index_enabled = os.getenv('VECTOR_INDEX_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        self.vector_indexes = {
+            "patients": VectorIndex("patients", COMPOSITE_DIMENSION, ("condition", "age", "gender")),
+            "guidelines": VectorIndex("guidelines", EMBEDDING_DIMENSION, ("condition",)),
+            "exercises": VectorIndex("exercises", EMBEDDING_DIMENSION, ("condition",))
+        }
+        self.VECTOR_INDEX_SOURCES = {
+            "patients": (self.PATIENT_TABLE, "embedded_composite"),
+            "guidelines": (self.GUIDELINES_TABLE, "embedded_text"),
+            "exercises": (self.EXERCISES_TABLE, "embedded_text")
+        }
+        
+        # BM25 indexes over the catalog text, fused with the vector results by reciprocal rank
+        self.hybrid_retrieval = os.getenv('HYBRID_RETRIEVAL', 'true').lower() in ('1', 'true', 'yes')
+        self.hybrid_candidates = int(os.getenv('HYBRID_CANDIDATES', '10'))
+        self.lexical_indexes = {
+            kind: LexicalIndex(kind, FILTERABLE_COLUMNS[kind]) for kind in ("guidelines", "exercises")
+        }
+        self.LEXICAL_INDEX_SOURCES = {
+            "guidelines": (self.GUIDELINES_TABLE, ("guideline_text",)),
+            "exercises": (self.EXERCISES_TABLE, ("exercise_name", "description", "benefits"))
+        }
 
         self.system_prompt = """
         You are Iris, a clinical assistant for rehabilitation professionals. Provide concise, practical information about patients, treatments, and exercises.
@@ -52,160 +188,32 @@ class ClinicalRAG:
         Your responses should be direct, factual, and to-the-point. Avoid phrases like "we don't have information on" or "I think" or "it's recommended that".
         """
 
-        try:
-            self.model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
-        except Exception as e:
-            print(f"Error initializing SentenceTransformer: {e}")
-            self.model = None
-        
-        # Use the global model instance or create it if it doesn't exist
-        global _model
-        if _model is None:
-            print("Initializing SentenceTransformer model...")
-            _model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.model = _model
-
         # Register cleanup method
         atexit.register(self.cleanup)
 
-    def _cleanup_resources(self):
-        """Clean up resources when the application exits"""
-        global _model
-        if _model is not None:
-            # Clear CUDA cache if using GPU
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-            
-            # Delete model reference
-            _model = None
-            print("Cleaned up SentenceTransformer resources")
-    
+    @property
+    def model(self):
+        """The shared SentenceTransformer, loaded lazily on first use"""
+        return self.model_registry.get()
+
     def get_db_connection(self):
-        """Create and return a connection to the IRIS database"""
+        """Open a new, unpooled connection to the IRIS database (used by the pool to create connections)"""
         return iris.connect(self.CONNECTION_STRING, self.username, self.password)
+
+    def db_connection(self):
+        """Check out a pooled connection for the duration of a with-block"""
+        return self.pool.connection()
   
     def _get_patient_info(self, cursor, patient_id):
         """Retrieve comprehensive information about a specific patient"""
         try:
-            cursor.execute(
-                f"""
-                SELECT id, patient_id as external_id, name, age, gender, condition, medical_history, 
-                    current_treatment, progress_notes, assessment, treatment_outcomes 
-                FROM {self.PATIENT_TABLE} 
-                WHERE id = ?
-                """,
-                (patient_id,)
-            )
-            
-            row = cursor.fetchone()
-            if not row:
+            context = self.patient_contexts.load_one(cursor, patient_id)
+            if not context:
                 print(f"No patient found with ID: {patient_id}")
                 return None
             
-            # Extract data safely
-            try:
-                p_id = row[0]
-                external_id = row[1]
-                name = row[2]
-                age = row[3]
-                gender = row[4]
-                condition = row[5]
-                medical_history = row[6]
-                current_treatment = row[7]
-                progress_notes = row[8]
-                assessment = row[9]
-                treatment_outcomes = row[10] if len(row) > 10 else None
-            except Exception as e:
-                print(f"Error extracting row data: {e}")
-                # Try with dictionary-like access
-                try:
-                    p_id = row["id"]
-                    external_id = row["external_id"]
-                    name = row["name"]
-                    age = row["age"]
-                    gender = row["gender"]
-                    condition = row["condition"]
-                    medical_history = row["medical_history"]
-                    current_treatment = row["current_treatment"]
-                    progress_notes = row["progress_notes"]
-                    assessment = row["assessment"]
-                    treatment_outcomes = row.get("treatment_outcomes", None)
-                except Exception as e2:
-                    print(f"Error extracting row data as dict: {e2}")
-                    return None
-            
-            # Get relevant exercises for this patient's condition - without vector search
-            try:
-                cursor.execute(
-                    f"""
-                    SELECT TOP 5 exercise_name, description, benefits, contraindications, severity
-                    FROM {self.EXERCISES_TABLE}
-                    WHERE condition = ?
-                    """,
-                    (condition,)
-                )
-                
-                exercises = []
-                for ex_row in cursor.fetchall():
-                    try:
-                        exercises.append({
-                            "name": ex_row[0] if isinstance(ex_row, (list, tuple)) else ex_row["exercise_name"],
-                            "description": ex_row[1] if isinstance(ex_row, (list, tuple)) else ex_row["description"],
-                            "benefits": ex_row[2] if isinstance(ex_row, (list, tuple)) else ex_row["benefits"],
-                            "contraindications": ex_row[3] if isinstance(ex_row, (list, tuple)) else ex_row["contraindications"],
-                            "severity": ex_row[4] if isinstance(ex_row, (list, tuple)) else ex_row["severity"]
-                        })
-                    except Exception as e:
-                        print(f"Error processing exercise row: {e}")
-                
-                print(f"Retrieved {len(exercises)} exercises for {name}'s condition")
-            except Exception as e:
-                print(f"Error retrieving exercises: {e}")
-                exercises = []
-            
-            # Get relevant guidelines for this patient's condition - without vector search
-            try:
-                cursor.execute(
-                    f"""
-                    SELECT TOP 3 guideline_text, source
-                    FROM {self.GUIDELINES_TABLE}
-                    WHERE condition = ?
-                    """,
-                    (condition,)
-                )
-                
-                guidelines = []
-                for guide_row in cursor.fetchall():
-                    try:
-                        guidelines.append({
-                            "text": guide_row[0] if isinstance(guide_row, (list, tuple)) else guide_row["guideline_text"],
-                            "source": guide_row[1] if isinstance(guide_row, (list, tuple)) else guide_row["source"],
-                            "condition": condition
-                        })
-                    except Exception as e:
-                        print(f"Error processing guideline row: {e}")
-                
-                print(f"Retrieved {len(guidelines)} guidelines for {name}'s condition")
-            except Exception as e:
-                print(f"Error retrieving guidelines: {e}")
-                guidelines = []
-            
-            # Create the final patient info dictionary with all available fields
-            return {
-                "id": p_id,
-                "patient_id": external_id,
-                "name": name,
-                "age": age,  # Make sure age is included
-                "gender": gender,  # Make sure gender is included
-                "condition": condition,
-                "medical_history": medical_history,
-                "current_treatment": current_treatment,
-                "progress_notes": progress_notes,
-                "assessment": assessment,
-                "treatment_outcomes": treatment_outcomes,
-                "recommended_exercises": exercises,
-                "relevant_guidelines": guidelines
-            }
+            print(f"Retrieved {len(context.recommended_exercises)} exercises and {len(context.relevant_guidelines)} guidelines for {context.name}'s condition")
+            return context.to_dict()
         except Exception as e:
             print(f"Error in _get_patient_info: {e}")
             import traceback
@@ -216,294 +224,287 @@ class ClinicalRAG:
         """Find a patient by name (full or partial match)"""
         try:
             print(f"Searching for patient with name like '%{patient_name}%'")
-            cursor.execute(
-                f"""
-                SELECT TOP 1 id, patient_id, name, condition, medical_history, 
-                    current_treatment, progress_notes, assessment 
-                FROM {self.PATIENT_TABLE} 
-                WHERE name LIKE ?
-                """,
-                (f"%{patient_name}%",)
-            )
-            
-            row = cursor.fetchone()
-            if not row:
+            context = self.patient_contexts.load_by_name(cursor, patient_name)
+            if not context:
                 print(f"No patient found with name like '%{patient_name}%'")
                 return None
             
-            try:
-                patient_id = row["id"] if "id" in row else row[0]
-                external_id = row["patient_id"] if "patient_id" in row else row[1]
-                name = row["name"] if "name" in row else row[2]
-                condition = row["condition"] if "condition" in row else row[3]
-                medical_history = row["medical_history"] if "medical_history" in row else row[4]
-                current_treatment = row["current_treatment"] if "current_treatment" in row else row[5]
-                progress_notes = row["progress_notes"] if "progress_notes" in row else row[6]
-                assessment = row["assessment"] if "assessment" in row else row[7]
-            except Exception as e:
-                print(f"Error accessing row data: {e}")
-                try:
-                    row_dict = dict(zip(["id", "patient_id", "name", "condition", "medical_history", 
-                                "current_treatment", "progress_notes", "assessment"], row))
-                    patient_id = row_dict["id"]
-                    external_id = row_dict["patient_id"]
-                    name = row_dict["name"]
-                    condition = row_dict["condition"]
-                    medical_history = row_dict["medical_history"]
-                    current_treatment = row_dict["current_treatment"]
-                    progress_notes = row_dict["progress_notes"]
-                    assessment = row_dict["assessment"]
-                except Exception as nested_e:
-                    print(f"Error converting row to dict: {nested_e}")
-                    return None
-            
-            print(f"Found patient: {name} with condition: {condition}")
-            
-            # Get relevant exercises for this patient's condition - without vector search
-            try:
-                cursor.execute(
-                    f"""
-                    SELECT TOP 5 exercise_name, description, benefits, contraindications, severity
-                    FROM {self.EXERCISES_TABLE}
-                    WHERE condition = ?
-                    """,  
-                    (condition,)
-                )
-                
-                exercises = []
-                for ex_row in cursor.fetchall():
-                    try:
-                        exercises.append({
-                            "name": ex_row[0] if isinstance(ex_row, (list, tuple)) else ex_row["exercise_name"],
-                            "description": ex_row[1] if isinstance(ex_row, (list, tuple)) else ex_row["description"],
-                            "benefits": ex_row[2] if isinstance(ex_row, (list, tuple)) else ex_row["benefits"],
-                            "contraindications": ex_row[3] if isinstance(ex_row, (list, tuple)) else ex_row["contraindications"],
-                            "severity": ex_row[4] if isinstance(ex_row, (list, tuple)) else ex_row["severity"]
-                        })
-                    except Exception as e:
-                        print(f"Error processing exercise row: {e}")
-                print(f"Retrieved {len(exercises)} exercises for condition: {condition}")
-            except Exception as e:
-                print(f"Error retrieving exercises: {str(e)}")
-                exercises = []
-            
-            # Get relevant guidelines for this patient's condition - without vector search
-            try:
-                cursor.execute(
-                    f"""
-                    SELECT TOP 3 guideline_text, source
-                    FROM {self.GUIDELINES_TABLE}
-                    WHERE condition = ?
-                    """,  
-                    (condition,)
-                )
-                
-                guidelines = []
-                for guide_row in cursor.fetchall():
-                    try:
-                        guidelines.append({
-                            "text": guide_row[0] if isinstance(guide_row, (list, tuple)) else guide_row["guideline_text"],
-                            "source": guide_row[1] if isinstance(guide_row, (list, tuple)) else guide_row["source"],
-                            "condition": condition
-                        })
-                    except Exception as e:
-                        print(f"Error processing guideline row: {e}")
-                print(f"Retrieved {len(guidelines)} guidelines for condition: {condition}")
-            except Exception as e:
-                print(f"Error retrieving guidelines: {str(e)}")
-                guidelines = []
-            
-            return {
-                "id": patient_id,
-                "patient_id": external_id,
-                "name": name,
-                "condition": condition,
-                "medical_history": medical_history,
-                "current_treatment": current_treatment,
-                "progress_notes": progress_notes,
-                "assessment": assessment,
-                "recommended_exercises": exercises,
-                "relevant_guidelines": guidelines
-            }
+            print(f"Found patient: {context.name} with condition: {context.condition}")
+            return context.to_dict()
         except Exception as e:
             print(f"Error in find_patient_by_name: {str(e)}")
             import traceback
             traceback.print_exc()
             return None
 
-    def process_query(self, query_text, patient_id=None, condition_filter=None):
+    def load_patient_contexts(self, patient_ids):
+        """Load the contexts of many patients at once; returns a dict of id -> PatientContext"""
+        with self.db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                return self.patient_contexts.load(cursor, patient_ids)
+            finally:
+                cursor.close()
+
+    def iter_patients(self, fields=None, after_id=None, limit=None, condition=None,
+                      min_adherence=None, max_adherence=None, include_embeddings=False, page_size=500):
         """
-        Process a clinical query using intent-based RAG retrieval with specialized handlers
+        Yield patients as dicts in id order, starting after after_id. The table is read in keyset
+        pages (WHERE id > last id ORDER BY id) of page_size rows, each on a briefly checked-out
+        connection, so memory use and time to the first row do not grow with the table.
+        With include_embeddings, each dict also carries the vector columns as base64 float32
         """
-        # Check explicitly for similar patients queries
-        if any(phrase in query_text.lower() for phrase in [
-            "similar patient", "similar patients", "patients like", "patient like", 
-            "patients similar", "who are similar", "which patients"
-        ]) and not "based on" in query_text.lower():
-            print("Detected direct query about similar patients, using specialized handler")
-            # Use our specialized handler for similar patient queries
-            result = self.handle_similar_patients_query(query_text, patient_id)
-            
-            # If the patient is found by name but not ID
-            if not patient_id:
-                import re
-                patient_name_match = re.search(r"(?:patient|about|to|for|like)\s+([A-Za-z]+(?:\s+[A-Za-z]+)?)", query_text, re.IGNORECASE)
-                if patient_name_match:
-                    patient_name = patient_name_match.group(1)
-                    print(f"Extracted patient name for similar patients query: {patient_name}")
-                    
-                    conn = self.get_db_connection()
-                    cursor = conn.cursor()
-                    try:
-                        patient_info = self.find_patient_by_name(cursor, patient_name)
-                        if patient_info and 'id' in patient_info:
-                            print(f"Found patient by name: {patient_info['name']} with ID: {patient_info['id']}")
-                            result = self.handle_similar_patients_query(query_text, patient_info['id'])
-                    finally:
-                        cursor.close()
-                        conn.close()
-            
-            return result
+        columns = ["id"] + [field for field in (fields or PATIENT_LIST_COLUMNS) if field != "id"]
+        unknown = set(columns) - set(PATIENT_LIST_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown patient fields: {', '.join(sorted(unknown))}")
+        
+        filters = []
+        params = []
+        if condition:
+            filters.append("condition = ?")
+            params.append(condition)
+        if min_adherence is not None:
+            filters.append("adherence_rate >= ?")
+            params.append(min_adherence)
+        if max_adherence is not None:
+            filters.append("adherence_rate <= ?")
+            params.append(max_adherence)
+        
+        embedding_columns = list(PATIENT_EMBEDDING_COLUMNS) if include_embeddings else []
+        
+        remaining = limit
+        while remaining is None or remaining > 0:
+            batch_size = page_size if remaining is None else min(page_size, remaining)
+            page_filters = filters + (["id > ?"] if after_id is not None else [])
+            page_params = params + ([after_id] if after_id is not None else [])
+            where_clause = f"WHERE {' AND '.join(page_filters)}" if page_filters else ""
+            
+            with self.db_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(
+                        f"SELECT TOP {int(batch_size)} {', '.join(columns + embedding_columns)} FROM {self.PATIENT_TABLE} {where_clause} ORDER BY id",
+                        page_params
+                    )
+                    rows = cursor.fetchall()
+                finally:
+                    cursor.close()
             
-        # Check for treatment recommendations based on similar patients
-        if any(phrase in query_text.lower() for phrase in [
-            "based on similar patient", "based on similar patients", 
-            "from similar patient", "from similar patients",
-            "like other patient", "like other patients"
-        ]):
+            for row in rows:
+                patient = dict(zip(columns, row))
+                if include_embeddings:
+                    patient["embeddings"] = {
+                        column: vector_to_base64(value)
+                        for column, value in zip(embedding_columns, row[len(columns):])
+                    }
+                yield patient
+            if len(rows) < batch_size:
+                return
+            after_id = rows[-1][0]
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def _route_query(self, query_text, match=None):
+        """Pick the handler for a query: similar_patients, treatment_recommendation or general"""
+        route = (match or self.query_matcher.match(query_text)).route
+        if route == "similar_patients":
+            print("Detected direct query about similar patients, using specialized handler")
+        elif route == "treatment_recommendation":
             print("Detected query about treatments based on similar patients")
-            result = self.handle_treatment_recommendation_query(query_text, patient_id)
-            
-            # If the patient is found by name but not ID
-            if not patient_id:
-                import re
-                patient_name_match = re.search(r"(?:patient|about|to|for|like)\s+([A-Za-z]+(?:\s+[A-Za-z]+)?)", query_text, re.IGNORECASE)
-                if patient_name_match:
-                    patient_name = patient_name_match.group(1)
-                    print(f"Extracted patient name for recommendation query: {patient_name}")
-                    
-                    conn = self.get_db_connection()
-                    cursor = conn.cursor()
-                    try:
-                        patient_info = self.find_patient_by_name(cursor, patient_name)
-                        if patient_info and 'id' in patient_info:
-                            print(f"Found patient by name: {patient_info['name']} with ID: {patient_info['id']}")
-                            result = self.handle_treatment_recommendation_query(query_text, patient_info['id'])
-                    finally:
-                        cursor.close()
-                        conn.close()
-            
-            return result
+        return route
+
+    def _patient_name_from_query(self, query_text, match=None):
+        """Extract a candidate patient name from the query text, or None"""
+        patient_name = (match or self.query_matcher.match(query_text)).patient_name
+        if patient_name:
+            print(f"Extracted patient name from query: {patient_name}")
+        return patient_name
+
+    def _patient_id_from_query(self, query_text, match=None):
+        """Find the patient named in the query text; returns their id or None"""
+        patient_name = self._patient_name_from_query(query_text, match)
+        if not patient_name:
+            return None
         
-        # For all other queries, continue with normal processing
+        patient_info = self._run_with_cursor(self.find_patient_by_name, patient_name)
+        if patient_info and 'id' in patient_info:
+            print(f"Found patient by name: {patient_info['name']} with ID: {patient_info['id']}")
+            return patient_info['id']
+        return None
+
+    def _run_with_cursor(self, fn, *args, **kwargs):
+        """Call fn(cursor, *args, **kwargs) on a pooled connection of its own"""
+        with self.db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                return fn(cursor, *args, **kwargs)
+            finally:
+                cursor.close()
+
+    def _retrieve_context(self, query_text, patient_id=None, filters=None, match=None):
+        """
+        Gather the context for a general query: patient info, similar patients, guidelines and exercises.
+        The retrieval plan for the query's intent decides which stages run at all. Independent stages
+        run concurrently, each on its own pooled connection, in two waves: the patient, their similar
+        patients and the query embedding first, then guidelines and exercises (which need the
+        embedding and possibly the patient's condition).
+        filters is a condition name or a dict of retrieval filters (condition, severity, source).
+        match is the query's QueryMatch when the caller already has it.
+        Returns (intent, context, supporting_evidence, query_embedding)
+        """
+        filters = normalize_filters(filters)
+        match = match or self.query_matcher.match(query_text)
         # Classify the intent
-        intent = self._classify_query_intent(query_text)
+        intent = self._classify_query_intent(query_text, match)
         print(f"Query intent classified as: {intent}")
         
         # Initialize context and supporting evidence containers
         context = {}
         supporting_evidence = {}
+        timings = {}
+        
+        # Short lookups of catalog terms are answered lexically, without embedding the query
+        lexical_only = self._is_exact_term_query(query_text)
+        patient_name = None if patient_id else self._patient_name_from_query(query_text, match)
+        plan = self.retrieval_planner.plan(
+            intent, match.labels,
+            has_patient=bool(patient_id or patient_name),
+            lexical_only=lexical_only,
+            semantic_cache=self.semantic_cache.max_entries > 0
+        )
         
-        # Get DB connection
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
+        # First wave: everything that only depends on the request itself
+        first_wave = {}
+        if plan.runs("embedding"):
+            first_wave["embedding"] = lambda: self.embed_text(query_text)
+        if patient_id:
+            print(f"Retrieving patient info for ID: {patient_id}")
+            first_wave["patient"] = lambda: self._run_with_cursor(self._get_patient_info, patient_id)
+            if plan.runs("neighbors"):
+                first_wave["neighbors"] = lambda: self.find_similar_patients_iris_vector(patient_id, limit=3)
+        elif patient_name:
+            first_wave["patient"] = lambda: self._run_with_cursor(self.find_patient_by_name, patient_name)
+        
+        results, wave_timings = self.retrieval_executor.run(first_wave)
+        timings.update(wave_timings)
+        
+        patient_info = results.get("patient")
+        if patient_id:
+            context["patient"] = patient_info
+            supporting_evidence["patient_info"] = patient_info
+        
+        # Fall back to a name in the query if the ID did not match a patient
+        if patient_id and not patient_info:
+            patient_name = self._patient_name_from_query(query_text, match)
+            if patient_name:
+                patient_info = self._run_with_cursor(self.find_patient_by_name, patient_name)
+        
+        # Second wave: retrieval that depends on the first
+        second_wave = {}
+        if patient_name and patient_info:
+            context["patient"] = patient_info
+            supporting_evidence["patient_info"] = patient_info
+            print(f"Found patient by name: {patient_info['name']}")
+        
+            # Now that we found a patient, get their condition
+            if patient_info.get('condition'):
+                filters["condition"] = patient_info['condition']
+        
+            # Also get similar patients for patient identified by name
+            if 'id' in patient_info and plan.runs("neighbors"):
+                results.pop("neighbors", None)
+                second_wave["neighbors"] = lambda: self.find_similar_patients_iris_vector(patient_info['id'], limit=3)
+        
+        # Guidelines and exercises need the embedding, except for lexical-only queries
+        query_embedding = results.get("embedding")
+        if query_embedding is not None or lexical_only:
+            if plan.runs("guidelines"):
+                second_wave["guidelines"] = lambda: self._run_with_cursor(self._get_relevant_guidelines, query_embedding, filters, query_text)
+            if plan.runs("exercises"):
+                second_wave["exercises"] = lambda: self._run_with_cursor(self._get_relevant_exercises, query_embedding, filters, query_text)
+        
+        if second_wave:
+            second_results, wave_timings = self.retrieval_executor.run(second_wave)
+            timings.update(wave_timings)
+            results.update(second_results)
+        
+        similar_patients_result = results.get("neighbors")
+        if isinstance(similar_patients_result, dict) and "similar_patients" in similar_patients_result:
+            similar_patients = similar_patients_result["similar_patients"]
+            context["similar_patients"] = similar_patients
+            supporting_evidence["similar_patients"] = similar_patients
+            print(f"Found {len(similar_patients)} similar patients")
+        
+        guidelines = results.get("guidelines")
+        if guidelines:
+            context["guidelines"] = guidelines
+            supporting_evidence["guidelines"] = guidelines
+            print(f"Retrieved {len(guidelines)} relevant guidelines")
+        
+        exercises = results.get("exercises")
+        if exercises:
+            context["exercises"] = exercises
+            supporting_evidence["exercises"] = exercises
+            print(f"Retrieved {len(exercises)} relevant exercises")
+        
+        # IMPORTANT: If we have patient info with recommended_exercises, include these in the context
+        if patient_info and 'recommended_exercises' in patient_info and patient_info['recommended_exercises']:
+            # If exercises aren't already in context, add them
+            if 'exercises' not in context:
+                context['exercises'] = []
+        
+            # Add the patient's recommended exercises to the context
+            if isinstance(patient_info['recommended_exercises'], list):
+                context['exercises'].extend(patient_info['recommended_exercises'])
+        
+        # IMPORTANT: If we have patient info with relevant_guidelines, include these in the context
+        if patient_info and 'relevant_guidelines' in patient_info and patient_info['relevant_guidelines']:
+            # If guidelines aren't already in context, add them
+            if 'guidelines' not in context:
+                context['guidelines'] = []
+        
+            # Add the patient's relevant guidelines to the context
+            if isinstance(patient_info['relevant_guidelines'], list):
+                context['guidelines'].extend(patient_info['relevant_guidelines'])
+        
+        # Debug output to see what's in the context
+        print(f"Retrieval plan {plan.describe(timings)}")
+        print(f"Final context keys: {list(context.keys())}")
+        
+        return intent, context, supporting_evidence, query_embedding
+
+    def process_query(self, query_text, patient_id=None, filters=None):
+        """
+        Process a clinical query using intent-based RAG retrieval with specialized handlers
+        """
+        match = self.query_matcher.match(query_text)
+        route = self._route_query(query_text, match)
+        if route != "general":
+            # If the patient is named in the query but no ID was given
+            if not patient_id:
+                patient_id = self._patient_id_from_query(query_text, match)
+            
+            if route == "similar_patients":
+                return self.handle_similar_patients_query(query_text, patient_id)
+            return self.handle_treatment_recommendation_query(query_text, patient_id)
         
+        # For all other queries, continue with normal processing
         try:
-            # Always retrieve basic patient info if patient_id provided
-            patient_info = None
-            if patient_id:
-                print(f"Retrieving patient info for ID: {patient_id}")
-                patient_info = self._get_patient_info(cursor, patient_id)
-                context["patient"] = patient_info
-                supporting_evidence["patient_info"] = patient_info
-                
-                # Get similar patients for context enrichment
-                similar_patients_result = self.find_similar_patients_iris_vector(patient_id, limit=3)
-                if isinstance(similar_patients_result, dict) and "similar_patients" in similar_patients_result:
-                    similar_patients = similar_patients_result["similar_patients"]
-                    context["similar_patients"] = similar_patients
-                    supporting_evidence["similar_patients"] = similar_patients
-                    print(f"Found {len(similar_patients)} similar patients")
-            
-            # Try to extract patient name if no ID provided
-            if not patient_info:
-                import re
-                patient_name_match = re.search(r"(?:patient|about|to|for|like)\s+([A-Za-z]+(?:\s+[A-Za-z]+)?)", query_text, re.IGNORECASE)
-                if patient_name_match:
-                    patient_name = patient_name_match.group(1)
-                    print(f"Extracted patient name: {patient_name}")
-                    patient_info = self.find_patient_by_name(cursor, patient_name)
-                    if patient_info:
-                        context["patient"] = patient_info
-                        supporting_evidence["patient_info"] = patient_info
-                        print(f"Found patient by name: {patient_info['name']}")
-                        
-                        # Now that we found a patient, get their condition
-                        if 'condition' in patient_info:
-                            condition_filter = patient_info['condition']
-                        
-                        # Also get similar patients for patient identified by name
-                        if 'id' in patient_info:
-                            similar_patients_result = self.find_similar_patients_iris_vector(patient_info['id'], limit=3)
-                            if isinstance(similar_patients_result, dict) and "similar_patients" in similar_patients_result:
-                                similar_patients = similar_patients_result["similar_patients"]
-                                context["similar_patients"] = similar_patients
-                                supporting_evidence["similar_patients"] = similar_patients
-                                print(f"Found {len(similar_patients)} similar patients for {patient_info['name']}")
-            
-            # Create embeddings for semantic search
-            query_embedding = self.model.encode(query_text, normalize_embeddings=True).tolist()
-            
-            # Only retrieve guidelines and exercises for relevant intents or when explicitly asked
-            if intent in ["RECOMMENDATION", "EXERCISE", "GUIDELINE"] or "guideline" in query_text.lower():
-                guidelines = self._get_relevant_guidelines(cursor, query_embedding, condition_filter)
-                if guidelines:
-                    context["guidelines"] = guidelines
-                    supporting_evidence["guidelines"] = guidelines
-                    print(f"Retrieved {len(guidelines)} relevant guidelines")
-            
-            if intent in ["RECOMMENDATION", "EXERCISE"] or "exercise" in query_text.lower():
-                exercises = self._get_relevant_exercises(cursor, query_embedding, condition_filter)
-                if exercises:
-                    context["exercises"] = exercises
-                    supporting_evidence["exercises"] = exercises
-                    print(f"Retrieved {len(exercises)} relevant exercises")
-            
-            # IMPORTANT: If we have patient info with recommended_exercises, include these in the context
-            if patient_info and 'recommended_exercises' in patient_info and patient_info['recommended_exercises']:
-                # If exercises aren't already in context, add them
-                if 'exercises' not in context:
-                    context['exercises'] = []
-                
-                # Add the patient's recommended exercises to the context
-                if isinstance(patient_info['recommended_exercises'], list):
-                    context['exercises'].extend(patient_info['recommended_exercises'])
-                
-            # IMPORTANT: If we have patient info with relevant_guidelines, include these in the context
-            if patient_info and 'relevant_guidelines' in patient_info and patient_info['relevant_guidelines']:
-                # If guidelines aren't already in context, add them
-                if 'guidelines' not in context:
-                    context['guidelines'] = []
-                
-                # Add the patient's relevant guidelines to the context
-                if isinstance(patient_info['relevant_guidelines'], list):
-                    context['guidelines'].extend(patient_info['relevant_guidelines'])
-            
-            # Debug output to see what's in the context
-            print(f"Final context keys: {list(context.keys())}")
-            
+            intent, context, supporting_evidence, query_embedding = self._retrieve_context(query_text, patient_id, filters, match)
+        
             # Generate response with intent-specific instructions
-            response = self._generate_response_with_llm(query_text, context, intent)
-            
+            response = self._generate_response_with_llm(query_text, context, intent, query_embedding)
+        
             # Debug the response before returning
             print(f"Response content (first 100 chars): {response[:100] if response else 'None'}...")
-            
+        
             # Return in the expected format the API endpoint expects
             result = {
                 "response": response,
                 "supporting_evidence": supporting_evidence
             }
-            
+        
             print(f"Returning response object: {str(result)[:200]}...")
             return result
         
@@ -512,27 +513,125 @@ class ClinicalRAG:
             import traceback
             traceback.print_exc()
             return {
-                "response": f"I apologize, but I encountered an error while processing your query. Please try again or rephrase your question. Technical details: {str(e)}",
+                "response": self._error_response_text(e),
                 "supporting_evidence": {}
             }
+
+    def _error_response_text(self, error):
+        """Apology shown to the user when a query fails"""
+        return f"I apologize, but I encountered an error while processing your query. Please try again or rephrase your question. Technical details: {str(error)}"
+
+    def process_query_stream(self, query_text, patient_id=None, filters=None):
+        """
+        Streaming variant of process_query. Yields (event, data) pairs: "evidence" with the supporting
+        evidence as soon as retrieval finishes, "token" for each piece of the answer as the LLM produces
+        it, then "done" with the complete response. Failures are reported as an "error" event.
+        """
+        try:
+            match = self.query_matcher.match(query_text)
+            route = self._route_query(query_text, match)
+            if route != "general" and not patient_id:
+                patient_id = self._patient_id_from_query(query_text, match)
+            
+            if route == "similar_patients":
+                # Answered from the database alone, so there is nothing to stream token by token
+                result = self.handle_similar_patients_query(query_text, patient_id)
+                yield "evidence", result["supporting_evidence"]
+                yield "token", {"text": result["response"]}
+                yield "done", {"response": result["response"]}
+                return
+            
+            if route == "treatment_recommendation":
+                result, prompts = self._prepare_treatment_recommendation(query_text, patient_id)
+                if result is not None:
+                    yield "evidence", result["supporting_evidence"]
+                    yield "token", {"text": result["response"]}
+                    yield "done", {"response": result["response"]}
+                    return
+                system_prompt, user_prompt, supporting_evidence, cache_key, cache_tags = prompts
+                semantic_key = None
+            else:
+                intent, context, supporting_evidence, query_embedding = self._retrieve_context(query_text, patient_id, filters, match)
+                system_prompt = self.system_prompt
+                user_prompt, cache_key = self._build_llm_prompt(query_text, context, intent)
+                cache_tags = context_tags(context)
+                semantic_key = self._semantic_key(query_embedding, intent, context)
+            
+            yield "evidence", supporting_evidence
+            
+            tokens = []
+            for token in self._stream_cached_llm_response(system_prompt, user_prompt, cache_key, cache_tags, semantic_key):
+                tokens.append(token)
+                yield "token", {"text": token}
+            response = "".join(tokens) or None
+            
+            if route == "treatment_recommendation":
+                # Falls back to a template answer and fixes list formatting on the complete text
+                response = self._finish_treatment_recommendation(response, supporting_evidence)["response"]
+                if not tokens:
+                    yield "token", {"text": response}
+            
+            yield "done", {"response": response}
         
-        finally:
-            cursor.close()
-            conn.close()
-
-    def _get_relevant_guidelines(self, cursor, query_embedding, filter_condition=""):
-        """Retrieve relevant clinical guidelines using vector search"""
-        sql = f"""
-            SELECT TOP 3 condition, guideline_text, source
-            FROM {self.GUIDELINES_TABLE}
-            {filter_condition}
-            ORDER BY VECTOR_DOT_PRODUCT(embedded_text, TO_VECTOR(?)) DESC
+        except Exception as e:
+            print(f"Error in process_query_stream: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            yield "error", {"response": self._error_response_text(e), "error": str(e)}
+
+    def _search_catalog(self, cursor, kind, table, columns, query_embedding, filters, k=3, query_text=None):
         """
+        Top-k rows of a guideline or exercise table for the query, restricted to the rows matching
+        the filters before ranking. The vector ranking runs through the in-memory index when it
+        carries every filtered column, otherwise with a parameterized WHERE clause in IRIS; with
+        query_text and hybrid retrieval on, it is fused with the BM25 ranking by reciprocal rank.
+        query_embedding may be None for a lexical-only search
+        """
+        filters = filters_for(kind, normalize_filters(filters))
+        lexical = self._lexical_index(kind) if query_text else None
+        depth = max(k, self.hybrid_candidates) if lexical is not None else k
+        
+        rankings = []
+        if query_embedding is not None:
+            index = self._vector_index(kind)
+            search_filters = index_filters(filters, index.attribute_names) if index is not None else None
+            if search_filters is not None:
+                hits = index.search(query_embedding, depth, filters=search_filters)
+                rankings.append([row_id for row_id, _ in hits])
+            else:
+                where_clause, params = build_where_clause(filters)
+                cursor.execute(
+                    f"""
+                    SELECT TOP {int(depth)} id, {', '.join(columns)}
+                    FROM {table}
+                    {where_clause}
+                    ORDER BY VECTOR_DOT_PRODUCT(embedded_text, TO_VECTOR(?)) DESC
+                    """,
+                    params + [to_vector_param(query_embedding)]
+                )
+                rows = cursor.fetchall()
+                if lexical is None:
+                    return [tuple(row[1:]) for row in rows]
+                rankings.append([row[0] for row in rows])
         
-        cursor.execute(sql, (str(query_embedding),))
+        if lexical is not None:
+            rankings.append([row_id for row_id, _ in lexical.search(query_text, depth, filters)])
+        
+        if len(rankings) > 1:
+            ids = [row_id for row_id, _ in reciprocal_rank_fusion(rankings, limit=k)]
+        else:
+            ids = rankings[0][:k] if rankings else []
+        return self._fetch_rows_by_ids(cursor, table, columns, ids)
+
+    def _get_relevant_guidelines(self, cursor, query_embedding, filters=None, query_text=None):
+        """Retrieve relevant clinical guidelines using vector (and lexical) search, optionally filtered by condition or source"""
+        rows = self._search_catalog(
+            cursor, "guidelines", self.GUIDELINES_TABLE, ["condition", "guideline_text", "source"],
+            query_embedding, filters, query_text=query_text
+        )
         
         guidelines = []
-        for row in cursor.fetchall():
+        for row in rows:
             guidelines.append({
                 "condition": row[0],
                 "text": row[1],
@@ -541,19 +640,16 @@ class ClinicalRAG:
         
         return guidelines
     
-    def _get_relevant_exercises(self, cursor, query_embedding, filter_condition=""):
-        """Retrieve relevant exercise recommendations using vector search"""
-        sql = f"""
-            SELECT TOP 3 condition, severity, exercise_name, description, benefits, contraindications
-            FROM {self.EXERCISES_TABLE}
-            {filter_condition}
-            ORDER BY VECTOR_DOT_PRODUCT(embedded_text, TO_VECTOR(?)) DESC
-        """
-        
-        cursor.execute(sql, (str(query_embedding),))
+    def _get_relevant_exercises(self, cursor, query_embedding, filters=None, query_text=None):
+        """Retrieve relevant exercise recommendations using vector (and lexical) search, optionally filtered by condition or severity"""
+        rows = self._search_catalog(
+            cursor, "exercises", self.EXERCISES_TABLE,
+            ["condition", "severity", "exercise_name", "description", "benefits", "contraindications"],
+            query_embedding, filters, query_text=query_text
+        )
         
         exercises = []
-        for row in cursor.fetchall():
+        for row in rows:
             exercises.append({
                 "condition": row[0],
                 "severity": row[1],
@@ -565,25 +661,201 @@ class ClinicalRAG:
         
         return exercises
 
-    def _classify_query_intent(self, query_text):
-        """Classify the intent of the user query"""
-        
-        # Check for similar patients query first
-        if any(x in query_text.lower() for x in ["similar patient", "similar patients", "patients like", "patient like"]):
-            return "SIMILAR_PATIENTS"
-        
-        # Simple rule-based classification
-        query_lower = query_text.lower()
-        if any(x in query_lower for x in ["what is", "who is", "tell me about", "information"]):
-            return "INFORMATION"
-        elif any(x in query_lower for x in ["recommend", "suggestion", "what should", "treatment"]):
-            return "RECOMMENDATION"
-        elif "exercise" in query_lower:
-            return "EXERCISE"
-        elif "guideline" in query_lower:
-            return "GUIDELINE"
-        else:
-            return "GENERAL"    
+    def _fetch_rows_by_ids(self, cursor, table, columns, ids):
+        """Fetch the given columns for a list of ids, returned in the same order as the ids"""
+        if not ids:
+            return []
+        
+        placeholders = ", ".join("?" for _ in ids)
+        cursor.execute(
+            f"SELECT id, {', '.join(columns)} FROM {table} WHERE id IN ({placeholders})",
+            list(ids)
+        )
+        rows_by_id = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+        return [rows_by_id[row_id] for row_id in ids if row_id in rows_by_id]
+
+    def clear_answer_caches(self):
+        """Drop every cached LLM answer, exact and semantic"""
+        self.answer_cache.clear()
+        self.semantic_cache.clear()
+
+    def invalidate_answers(self, kind, row_id=None):
+        """
+        Drop cached LLM answers built from a table (patients, guidelines or exercises).
+        Called after every write; row_id narrows patient answers to the patient that changed,
+        while rankings and retrieved lists are invalidated for any write to their table
+        """
+        tags = [kind]
+        if row_id is not None:
+            tags.append(f"{kind}:{row_id}")
+        dropped = self.answer_cache.invalidate(*tags) + self.semantic_cache.invalidate(*tags)
+        if dropped:
+            print(f"Invalidated {dropped} cached answers after a write to {kind}")
+
+    def _vector_index(self, kind):
+        """Return the in-memory index for a table if it is enabled and loaded, otherwise None"""
+        if not self.vector_index_enabled:
+            return None
+        index = self.vector_indexes[kind]
+        return index if index.loaded else None
+
+    def run_migrations(self, reset=False):
+        """Bring the schema up to date in place; with reset, drop every table first"""
+        with self.db_connection() as conn:
+            if reset:
+                self.migrations.drop_all(conn)
+            return self.migrations.migrate(conn)
+
+    def load_vector_indexes(self):
+        """Load the in-memory vector indexes from IRIS; on failure searches fall back to IRIS"""
+        if not self.vector_index_enabled:
+            return {}
+        
+        counts = {}
+        try:
+            with self.db_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    for kind, (table, column) in self.VECTOR_INDEX_SOURCES.items():
+                        attribute_names = self.vector_indexes[kind].attribute_names
+                        try:
+                            cursor.execute(f"SELECT id, {', '.join(attribute_names)}, {column} FROM {table}")
+                            self.vector_indexes[kind].load(
+                                (row[0], parse_vector(row[-1]), dict(zip(attribute_names, row[1:-1])))
+                                for row in cursor.fetchall()
+                            )
+                            counts[kind] = len(self.vector_indexes[kind])
+                        except Exception as e:
+                            self.vector_indexes[kind].loaded = False
+                            print(f"Could not load the {kind} vector index, using IRIS vector search: {e}")
+                finally:
+                    cursor.close()
+            print(f"Loaded in-memory vector indexes: {counts}")
+        except Exception as e:
+            print(f"Could not load in-memory vector indexes, using IRIS vector search: {e}")
+        return counts
+
+    def update_vector_index(self, kind, row_id, vector, attributes):
+        """Insert or replace one row of a loaded in-memory index; attributes holds its filterable columns"""
+        index = self._vector_index(kind)
+        if index is not None and vector is not None:
+            index.upsert(row_id, vector, attributes)
+
+    def remove_from_vector_index(self, kind, row_id):
+        """Remove one row from a loaded in-memory index"""
+        index = self._vector_index(kind)
+        if index is not None:
+            index.remove(row_id)
+
+    def _lexical_index(self, kind):
+        """Return the BM25 index for a catalog if hybrid retrieval is on and it is loaded, otherwise None"""
+        if not self.hybrid_retrieval:
+            return None
+        index = self.lexical_indexes[kind]
+        return index if index.loaded else None
+
+    def _is_exact_term_query(self, query_text):
+        """Whether the query only names catalog terms, so retrieval can skip the embedding"""
+        if not self.hybrid_retrieval:
+            return False
+        return is_exact_term_query(query_text, self.lexical_indexes.values())
+
+    def load_lexical_indexes(self):
+        """Build the BM25 indexes from IRIS; on failure retrieval is vector-only"""
+        if not self.hybrid_retrieval:
+            return {}
+        
+        counts = {}
+        try:
+            with self.db_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    for kind, (table, text_columns) in self.LEXICAL_INDEX_SOURCES.items():
+                        attribute_names = self.lexical_indexes[kind].attribute_names
+                        try:
+                            cursor.execute(f"SELECT id, {', '.join(attribute_names)}, {', '.join(text_columns)} FROM {table}")
+                            self.lexical_indexes[kind].load(
+                                (
+                                    row[0],
+                                    " ".join(str(value) for value in row[1 + len(attribute_names):] if value),
+                                    dict(zip(attribute_names, row[1:1 + len(attribute_names)]))
+                                )
+                                for row in cursor.fetchall()
+                            )
+                            counts[kind] = len(self.lexical_indexes[kind])
+                        except Exception as e:
+                            self.lexical_indexes[kind].loaded = False
+                            print(f"Could not load the {kind} lexical index, using vector retrieval only: {e}")
+                finally:
+                    cursor.close()
+            print(f"Loaded lexical indexes: {counts}")
+        except Exception as e:
+            print(f"Could not load lexical indexes, using vector retrieval only: {e}")
+        return counts
+
+    def update_lexical_index(self, kind, row_id, row):
+        """Index one guideline or exercise from a dict holding its text and filterable columns"""
+        index = self._lexical_index(kind)
+        if index is not None:
+            text_columns = self.LEXICAL_INDEX_SOURCES[kind][1]
+            index.upsert(row_id, " ".join(str(row[column]) for column in text_columns if row.get(column)), row)
+
+    def remove_from_lexical_index(self, kind, row_id):
+        """Remove one row from a loaded BM25 index"""
+        index = self._lexical_index(kind)
+        if index is not None:
+            index.remove(row_id)
+
+    def check_vector_index_consistency(self, sample_size=3, k=3):
+        """
+        Compare each in-memory index with IRIS: ids present on only one side, and whether
+        top-k results agree for a sample of stored vectors used as queries
+        """
+        report = {}
+        with self.db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                for kind, (table, column) in self.VECTOR_INDEX_SOURCES.items():
+                    index = self._vector_index(kind)
+                    if index is None:
+                        report[kind] = {"loaded": False}
+                        continue
+                    
+                    cursor.execute(f"SELECT id FROM {table} WHERE {column} IS NOT NULL")
+                    db_ids = {row[0] for row in cursor.fetchall()}
+                    index_ids = {int(row_id) for row_id in index.ids()}
+                    
+                    mismatched_queries = []
+                    for row_id in sorted(db_ids & index_ids)[:sample_size]:
+                        query = index.get(row_id)
+                        index_top = [hit_id for hit_id, _ in index.search(query, k)]
+                        cursor.execute(
+                            f"""
+                            SELECT TOP {int(k)} id FROM {table}
+                            ORDER BY VECTOR_DOT_PRODUCT({column}, TO_VECTOR(?)) DESC
+                            """,
+                            (to_vector_param(query),)
+                        )
+                        db_top = [row[0] for row in cursor.fetchall()]
+                        if index_top != db_top:
+                            mismatched_queries.append({"query_id": row_id, "index": index_top, "iris": db_top})
+                    
+                    report[kind] = {
+                        "loaded": True,
+                        "index_rows": len(index_ids),
+                        "iris_rows": len(db_ids),
+                        "missing_from_index": sorted(db_ids - index_ids),
+                        "stale_in_index": sorted(index_ids - db_ids),
+                        "mismatched_queries": mismatched_queries,
+                        "consistent": db_ids == index_ids and not mismatched_queries
+                    }
+            finally:
+                cursor.close()
+        return report
+
+    def _classify_query_intent(self, query_text, match=None):
+        """Classify the intent of the user query from the phrase table (GENERAL when no phrase matches)"""
+        return (match or self.query_matcher.match(query_text)).intent
 
     def _format_context(self, context):
         """Format the context dictionary into a string for the LLM prompt"""
@@ -691,10 +963,96 @@ class ClinicalRAG:
         return "\n\n".join(formatted_parts)
     
 
-    def _generate_response_with_llm(self, query, context, intent):
+    def _generate_response_with_llm(self, query, context, intent, query_embedding=None):
         """
         Generate a response using the LLM with context and intent-specific instructions.
         """
+        user_prompt, cache_key = self._build_llm_prompt(query, context, intent)
+        semantic_key = self._semantic_key(query_embedding, intent, context)
+        
+        # Then call the LLM (unless the same or a paraphrased query was answered recently)
+        response = self._cached_llm_response(self.system_prompt, user_prompt, cache_key, context_tags(context), semantic_key)
+        
+        # Make sure to return the response
+        return response
+
+    def _context_patient_id(self, context):
+        """Id of the patient a query's context is about, or None"""
+        patient = context.get("patient")
+        return patient.get("id") if patient else None
+
+    def _semantic_key(self, query_embedding, intent, context):
+        """
+        Semantic cache key of a general query: its embedding, intent, patient and a fingerprint of
+        the formatted context, so a paraphrase under other filters (or for no patient) never reuses
+        an answer built from different guidelines and exercises
+        """
+        return (query_embedding, intent, self._context_patient_id(context), evidence_key(self._format_context(context)))
+
+    def _cached_answer(self, cache_key, semantic_key):
+        """Look up an answer by exact prompt fingerprint, then by query similarity"""
+        response = self.answer_cache.get(cache_key)
+        if response is not None:
+            print("✅ Answer cache hit")
+            return response
+        
+        if semantic_key is not None:
+            hit = self.semantic_cache.lookup(*semantic_key)
+            if hit is not None:
+                response, similarity = hit
+                print(f"✅ Semantic answer cache hit (similarity {similarity:.3f})")
+                return response
+        return None
+
+    def _remember_answer(self, response, cache_key, tags, semantic_key, llm_seconds):
+        self.answer_cache.put(cache_key, response, tags)
+        if semantic_key is not None:
+            query_embedding, intent, patient_id, context_key = semantic_key
+            self.semantic_cache.put(query_embedding, intent, patient_id, context_key, response, tags, llm_seconds)
+
+    def _cached_llm_response(self, system_prompt, user_prompt, cache_key, tags, semantic_key=None):
+        """
+        Return a cached answer for the prompt, or generate one with the LLM and cache it.
+        semantic_key is (query_embedding, intent, patient_id, evidence key) for queries that may reuse paraphrases' answers
+        """
+        response = self._cached_answer(cache_key, semantic_key)
+        if response is not None:
+            return response
+        
+        started = time.perf_counter()
+        response = generate_llm_response(system_prompt, user_prompt)
+        if response:
+            self._remember_answer(response, cache_key, tags, semantic_key, time.perf_counter() - started)
+        return response
+
+    def _stream_cached_llm_response(self, system_prompt, user_prompt, cache_key, tags, semantic_key=None):
+        """Streaming counterpart of _cached_llm_response; a cached answer is yielded in one piece"""
+        response = self._cached_answer(cache_key, semantic_key)
+        if response is not None:
+            yield response
+            return
+        
+        # Only cache answers that streamed to completion
+        tokens = []
+        started = time.perf_counter()
+        stream = stream_llm_response(system_prompt, user_prompt)
+        while True:
+            try:
+                token = next(stream)
+            except StopIteration as finished:
+                completed = bool(finished.value)
+                break
+            tokens.append(token)
+            yield token
+        
+        if completed and tokens:
+            self._remember_answer("".join(tokens), cache_key, tags, semantic_key, time.perf_counter() - started)
+
+    def _build_llm_prompt(self, query, context, intent):
+        """
+        Build the user prompt for a general query from its context and intent-specific instructions.
+        Returns (user_prompt, cache_key)
+        """
         # Format the context for insertion into the prompt
         formatted_context = self._format_context(context)
         
@@ -773,11 +1131,7 @@ class ClinicalRAG:
         print(f"Similar patients in context: {bool('similar_patients' in context)}")
         print(f"Formatted context (first 200 chars): {formatted_context[:200]}...")
 
-        # Then call the LLM
-        response = generate_llm_response(self.system_prompt, user_prompt)
-        
-        # Make sure to return the response
-        return response
+        return user_prompt, answer_cache_key(self.system_prompt, formatted_context, query, intent)
 
     def handle_similar_patients_query(self, query_text, patient_id):
         """Directly handle queries about similar patients"""
@@ -788,52 +1142,36 @@ class ClinicalRAG:
             }
             
         # Get patient information first
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        patient_info = None
+        with self.db_connection() as conn:
+            cursor = conn.cursor()
+            patient_info = None
         
-        try:
-            patient_info = self._get_patient_info(cursor, patient_id)
-            if not patient_info:
-                return {
-                    "response": "Patient information not found. Please check the patient ID.",
-                    "supporting_evidence": {}
-                }
-        finally:
-            cursor.close()
-            conn.close()
+            try:
+                patient_info = self._get_patient_info(cursor, patient_id)
+                if not patient_info:
+                    return {
+                        "response": "Patient information not found. Please check the patient ID.",
+                        "supporting_evidence": {}
+                    }
+            finally:
+                cursor.close()
             
-        # Get similar patients using our vector search
-        similar_patients_result = self.find_similar_patients_iris_vector(patient_id, limit=10)
+        # Only high and medium matches with the same condition qualify; the search applies
+        # both constraints before ranking, so the top 3 are all usable
+        patient_condition = patient_info.get('condition')
+        similar_patients_result = self.find_similar_patients_iris_vector(
+            patient_id,
+            limit=3,
+            constraints={"condition": patient_condition, "min_score": SIMILAR_PATIENT_MIN_SCORE}
+        )
         
-        if (not isinstance(similar_patients_result, dict) or 
-            "similar_patients" not in similar_patients_result or
-            not similar_patients_result["similar_patients"]):
+        if not isinstance(similar_patients_result, dict) or "error" in similar_patients_result:
             return {
                 "response": "No similar patients found in the database for this patient.",
                 "supporting_evidence": {"patient_info": patient_info}
             }
         
-        all_similar_patients = similar_patients_result["similar_patients"]
-        patient_condition = patient_info.get('condition')
-        
-        # Filter only high and medium matches with same condition
-        filtered_patients = []
-        for patient in all_similar_patients:
-            # Only include patients with the same condition
-            if patient_condition and patient.get('condition') != patient_condition:
-                continue
-                
-            # Only include high and medium similarity scores
-            similarity = patient.get('similarity_score', '')
-            raw_score = patient.get('raw_score', 0)
-            
-            if (similarity == 'High' or similarity == 'Medium' or 
-                (isinstance(raw_score, (int, float)) and raw_score >= 0.6)):
-                filtered_patients.append(patient)
-        
-        # Limit to top 3 most similar
-        similar_patients = filtered_patients[:3]
+        similar_patients = similar_patients_result.get("similar_patients", [])
         
         supporting_evidence = {
             "patient_info": patient_info,
@@ -868,50 +1206,59 @@ class ClinicalRAG:
 
     def handle_treatment_recommendation_query(self, query_text, patient_id):
         """Handle queries about treatment recommendations based on similar patients with improved formatting"""
-        if not patient_id:
-            return {
+        result, prompts = self._prepare_treatment_recommendation(query_text, patient_id)
+        if result is not None:
+            return result
+        
+        system_prompt, user_prompt, supporting_evidence, cache_key, cache_tags = prompts
+        
+        # Generate the response
+        raw_response = self._cached_llm_response(system_prompt, user_prompt, cache_key, cache_tags)
+        return self._finish_treatment_recommendation(raw_response, supporting_evidence)
+
+    def _prepare_treatment_recommendation(self, query_text, patient_id):
+        """
+        Retrieve the patient and similar patients for a treatment recommendation query.
+        Returns (result, None) when the query can be answered without the LLM,
+        otherwise (None, (system_prompt, user_prompt, supporting_evidence, cache_key, cache_tags))
+        """
+        if not patient_id:
+            return {
                 "response": "To provide treatment recommendations based on similar patients, please first focus on a specific patient.",
                 "supporting_evidence": {}
-            }
+            }, None
         
         # Get the patient's information
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        patient_info = None
-        similar_patients = []
+        with self.db_connection() as conn:
+            cursor = conn.cursor()
+            patient_info = None
+            similar_patients = []
         
-        try:
-            patient_info = self._get_patient_info(cursor, patient_id)
-            if not patient_info:
-                return {
-                    "response": "Patient information not found. Please check the patient ID.",
-                    "supporting_evidence": {}
-                }
-            
-            # Find similar patients
-            similar_patients_result = self.find_similar_patients_iris_vector(patient_id, limit=5)
-            if isinstance(similar_patients_result, dict) and "similar_patients" in similar_patients_result:
-                all_similar = similar_patients_result["similar_patients"]
-                
-                # Filter to get only patients with same condition and high/medium similarity
-                for patient in all_similar:
-                    if (patient.get('condition') == patient_info.get('condition') and 
-                        (patient.get('similarity_score') in ['High', 'Medium'] or
-                        patient.get('raw_score', 0) >= 0.6)):
-                        similar_patients.append(patient)
-                
-                # Limit to top 3
-                similar_patients = similar_patients[:3]
+            try:
+                patient_info = self._get_patient_info(cursor, patient_id)
+                if not patient_info:
+                    return {
+                        "response": "Patient information not found. Please check the patient ID.",
+                        "supporting_evidence": {}
+                    }, None
+            
+                # Find similar patients with the same condition and high/medium similarity
+                similar_patients_result = self.find_similar_patients_iris_vector(
+                    patient_id,
+                    limit=3,
+                    cursor=cursor,
+                    constraints={"condition": patient_info.get('condition'), "min_score": SIMILAR_PATIENT_MIN_SCORE}
+                )
+                similar_patients = similar_patients_result.get("similar_patients", [])
         
-        finally:
-            cursor.close()
-            conn.close()
+            finally:
+                cursor.close()
         
         if not similar_patients:
             return {
                 "response": "No similar patients found with matching conditions to base recommendations on.",
                 "supporting_evidence": {"patient_info": patient_info}
-            }
+            }, None
         
         # Create context for LLM with patient info and similar patients
         context = {
@@ -974,8 +1321,12 @@ class ClinicalRAG:
         Provide concise, practical treatment recommendations based on what worked for similar patients.
         """
         
-        # Generate the response
-        raw_response = generate_llm_response(system_prompt, user_prompt)
+        cache_key = answer_cache_key(system_prompt, formatted_context, query_text, "treatment_recommendation")
+        return None, (system_prompt, user_prompt, supporting_evidence, cache_key, context_tags(context))
+
+    def _finish_treatment_recommendation(self, raw_response, supporting_evidence):
+        """Turn the LLM output into the final recommendation, falling back to a template without it"""
+        similar_patients = supporting_evidence["similar_patients"]
         
         # If no response was generated, create a fallback
         if not raw_response:
@@ -1058,299 +1409,586 @@ class ClinicalRAG:
         return "".join(response_parts)
 
 
+    def embed_batch(self, texts, batch_size=64):
+        """
+        Encode a list of texts; returns one normalized vector per text, in order.
+        Cached texts are served from the embedding cache and only the rest reach the model
+        """
+        return self.embedding_cache.get_or_compute(
+            texts,
+            lambda missing: encode_texts(self.model, missing, batch_size=batch_size)
+        )
+
+    def embed_text(self, text):
+        """Encode a single text through the embedding cache"""
+        return self.embed_batch([text])[0]
+
+    def embed_patient_facets(self, patients):
+        """Embed every facet text of several patients in one batch; returns a facet -> vector dict per patient"""
+        texts_per_patient = [patient_embedding_texts(patient) for patient in patients]
+        flat_texts = [text for texts in texts_per_patient for text in texts.values()]
+        vectors = iter(self.embed_batch(flat_texts))
+        return [
+            {facet: next(vectors) for facet in texts}
+            for texts in texts_per_patient
+        ]
+
     def add_patient(self, patient_data):
         """Add a new patient to the database with multiple vector embeddings"""
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
+        # Create separate embeddings for different aspects, plus the combined notes
+        # embedding kept for backward compatibility
+        facet_vectors = self.embed_patient_facets([patient_data])[0]
         
-        try:
-            # Create separate embeddings for different aspects
-            history_embedding = self.model.encode(patient_data['medical_history'], normalize_embeddings=True).tolist()
-            treatment_embedding = self.model.encode(patient_data['current_treatment'], normalize_embeddings=True).tolist()
-            
-            # Create demographics embedding
-            demographics_text = f"Age {patient_data['age']} {patient_data.get('gender', 'Unknown')} {patient_data['condition']}"
-            demographics_embedding = self.model.encode(demographics_text, normalize_embeddings=True).tolist()
-            
-            # Create outcomes embedding if available, otherwise use assessment
-            outcomes_text = patient_data.get('treatment_outcomes', patient_data['assessment'])
-            outcomes_embedding = self.model.encode(outcomes_text, normalize_embeddings=True).tolist()
-            
-            # Create combined embedding for backward compatibility
-            combined_text = f"{patient_data['medical_history']} {patient_data['current_treatment']} {patient_data['progress_notes']} {patient_data['assessment']}"
-            combined_embedding = self.model.encode(combined_text, normalize_embeddings=True).tolist()
-            
-            # Get the next available ID
-            cursor.execute(f"SELECT MAX(id) FROM {self.PATIENT_TABLE}")
-            max_id = cursor.fetchone()[0]
-            new_id = 1 if max_id is None else max_id + 1
-            
-            # Insert into database with all embeddings
-            cursor.execute(
-                f"""
-                INSERT INTO {self.PATIENT_TABLE} 
-                (id, patient_id, name, age, gender, condition, medical_history, current_treatment, 
-                progress_notes, assessment, adherence_rate, treatment_outcomes, 
-                embedded_notes, embedded_history, embedded_treatment, embedded_demographics, embedded_outcomes)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, TO_VECTOR(?), TO_VECTOR(?), TO_VECTOR(?), TO_VECTOR(?), TO_VECTOR(?))
-                """,
-                (
-                    new_id, 
-                    patient_data["patient_id"], 
-                    patient_data["name"], 
-                    patient_data["age"],
-                    patient_data.get("gender", "Unknown"),
-                    patient_data["condition"], 
-                    patient_data["medical_history"], 
-                    patient_data["current_treatment"], 
-                    patient_data["progress_notes"], 
-                    patient_data["assessment"],
-                    patient_data.get("adherence_rate", 0),
-                    patient_data.get("treatment_outcomes", ""),
-                    str(combined_embedding),
-                    str(history_embedding),
-                    str(treatment_embedding),
-                    str(demographics_embedding),
-                    str(outcomes_embedding)
+        # Weighted composite used to rank similar patients with a single dot product
+        composite_embedding = compose_patient_vector(facet_vectors)
+        
+        # Take the next id from this process's reserved block before checking out a connection:
+        # reserving a new block checks out one of its own
+        new_id = self.id_allocator.next_id(self.PATIENT_TABLE)
+        
+        with self.db_connection() as conn:
+            cursor = conn.cursor()
+        
+            try:
+                # Insert into database with all embeddings
+                cursor.execute(
+                    f"""
+                    INSERT INTO {self.PATIENT_TABLE} 
+                    (id, patient_id, name, age, gender, condition, medical_history, current_treatment, 
+                    progress_notes, assessment, adherence_rate, treatment_outcomes, 
+                    embedded_notes, embedded_history, embedded_treatment, embedded_demographics, embedded_outcomes,
+                    embedded_composite)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, TO_VECTOR(?), TO_VECTOR(?), TO_VECTOR(?), TO_VECTOR(?), TO_VECTOR(?), TO_VECTOR(?))
+                    """,
+                    (
+                        new_id, 
+                        patient_data["patient_id"], 
+                        patient_data["name"], 
+                        patient_data["age"],
+                        patient_data.get("gender", "Unknown"),
+                        patient_data["condition"], 
+                        patient_data["medical_history"], 
+                        patient_data["current_treatment"], 
+                        patient_data["progress_notes"], 
+                        patient_data["assessment"],
+                        patient_data.get("adherence_rate", 0),
+                        patient_data.get("treatment_outcomes", ""),
+                        to_vector_param(facet_vectors["notes"]),
+                        to_vector_param(facet_vectors["history"]),
+                        to_vector_param(facet_vectors["treatment"]),
+                        to_vector_param(facet_vectors["demographics"]),
+                        to_vector_param(facet_vectors["outcomes"]),
+                        to_vector_param(composite_embedding)
+                    )
                 )
-            )
             
-            conn.commit()
-            return {"id": new_id, "status": "success"}
+                conn.commit()
+                self.update_vector_index("patients", new_id, composite_embedding, {
+                    "condition": patient_data["condition"],
+                    "age": patient_data["age"],
+                    "gender": patient_data.get("gender", "Unknown")
+                })
+        
+            finally:
+                cursor.close()
         
-        finally:
-            cursor.close()
-            conn.close()
+        # The neighbor refresh checks out a connection of its own, so it runs once ours is returned
+        self.refresh_patient_neighbors(new_id)
+        self.invalidate_answers("patients", new_id)
+        return {"id": new_id, "status": "success"}
 
     def delete_patient(self, patient_id):
         """Delete a patient from the database"""
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
+        with self.db_connection() as conn:
+            cursor = conn.cursor()
         
-        try:
-            cursor.execute(f"DELETE FROM {self.PATIENT_TABLE} WHERE id = ?", (patient_id,))
-            conn.commit()
-            return {"status": "success"}
+            try:
+                cursor.execute(f"DELETE FROM {self.PATIENT_TABLE} WHERE id = ?", (patient_id,))
+                conn.commit()
+                self.remove_from_vector_index("patients", patient_id)
         
-        finally:
-            cursor.close()
-            conn.close()
+            finally:
+                cursor.close()
+        
+        self._maintain_patient_neighbors("remove", patient_id)
+        self.invalidate_answers("patients", patient_id)
+        return {"status": "success"}
 
     def update_progress_notes(self, patient_id, new_notes, new_assessment):
         """Update a patient's progress notes and assessment, with updated embeddings"""
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
+        with self.db_connection() as conn:
+            cursor = conn.cursor()
         
-        try:
-            # First get current patient data
-            cursor.execute(
-                f"SELECT medical_history, current_treatment FROM {self.PATIENT_TABLE} WHERE id = ?",
-                (patient_id,)
-            )
-            
-            row = cursor.fetchone()
-            if not row:
-                return {"status": "error", "message": "Patient not found"}
-            
-            medical_history = row[0]
-            current_treatment = row[1]
-            
-            # Create new embedding
-            combined_text = f"{medical_history} {current_treatment} {new_notes} {new_assessment}"
-            embedding = self.model.encode(combined_text, normalize_embeddings=True).tolist()
+            try:
+                cursor.execute(
+                    f"SELECT id FROM {self.PATIENT_TABLE} WHERE id = ?",
+                    (patient_id,)
+                )
+                if not cursor.fetchone():
+                    return {"status": "error", "message": "Patient not found"}
             
-            # Update the database
-            cursor.execute(
-                f"UPDATE {self.PATIENT_TABLE} SET progress_notes = ?, assessment = ?, embedded_notes = TO_VECTOR(?) WHERE id = ?",
-                (new_notes, new_assessment, str(embedding), patient_id)
-            )
+                # Update the database
+                cursor.execute(
+                    f"UPDATE {self.PATIENT_TABLE} SET progress_notes = ?, assessment = ? WHERE id = ?",
+                    (new_notes, new_assessment, patient_id)
+                )
+                
+                # Re-embed the facets that depend on the notes and assessment
+                refreshed_facets = self.refresh_patient_embeddings(cursor, patient_id, ["progress_notes", "assessment"])
             
-            conn.commit()
-            return {"status": "success"}
+                conn.commit()
         
-        finally:
-            cursor.close()
-            conn.close()
-    
+            finally:
+                cursor.close()
+        
+        if refreshed_facets:
+            self.refresh_patient_neighbors(patient_id)
+        self.invalidate_answers("patients", patient_id)
+        return {"status": "success"}
+
+    def refresh_patient_embeddings(self, cursor, patient_id, changed_fields):
+        """
+        Re-embed the facets that depend on the changed patient fields and rewrite the
+        weighted composite vector. The caller is responsible for committing.
+        """
+        facets_to_update = facets_affected_by(changed_fields)
+        if not facets_to_update:
+            return []
+        
+        cursor.execute(
+            f"""
+            SELECT age, gender, condition, medical_history, current_treatment, treatment_outcomes,
+                progress_notes, assessment, embedded_demographics, embedded_history,
+                embedded_treatment, embedded_outcomes
+            FROM {self.PATIENT_TABLE}
+            WHERE id = ?
+            """,
+            (patient_id,)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return []
+        
+        patient = dict(zip(
+            ["age", "gender", "condition", "medical_history", "current_treatment",
+             "treatment_outcomes", "progress_notes", "assessment"],
+            row[:8]
+        ))
+        facet_vectors = {
+            facet: parse_vector(value)
+            for (facet, _), value in zip(SIMILARITY_WEIGHTS, row[8:12])
+        }
+        
+        texts = patient_embedding_texts(patient)
+        new_vectors = self.embed_batch([texts[facet] for facet in facets_to_update])
+        assignments = []
+        params = []
+        for facet, vector in zip(facets_to_update, new_vectors):
+            facet_vectors[facet] = vector
+            assignments.append(f"{FACET_COLUMNS[facet]} = TO_VECTOR(?)")
+            params.append(to_vector_param(facet_vectors[facet]))
+        
+        composite_embedding = None
+        if all(facet_vectors[facet] is not None for facet, _ in SIMILARITY_WEIGHTS):
+            composite_embedding = compose_patient_vector(facet_vectors)
+            assignments.append("embedded_composite = TO_VECTOR(?)")
+            params.append(to_vector_param(composite_embedding))
+        
+        params.append(patient_id)
+        cursor.execute(
+            f"UPDATE {self.PATIENT_TABLE} SET {', '.join(assignments)} WHERE id = ?",
+            params
+        )
+        self.update_vector_index("patients", patient_id, composite_embedding, {
+            "condition": patient["condition"],
+            "age": patient["age"],
+            "gender": patient["gender"]
+        })
+        return facets_to_update
+
     def add_clinical_guideline(self, guideline_data):
         """Add a new clinical guideline with vector embedding"""
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
+        # Create embedding
+        embedding_text = guideline_embedding_text(guideline_data)
+        embedding = self.embed_text(embedding_text)
         
-        try:
-            # Create embedding
-            embedding = self.model.encode(guideline_data["guideline_text"], normalize_embeddings=True).tolist()
-            
-            # Get the next available ID
-            cursor.execute(f"SELECT MAX(id) FROM {self.GUIDELINES_TABLE}")
-            max_id = cursor.fetchone()[0]
-            new_id = 1 if max_id is None else max_id + 1
-            
-            # Insert into database
-            cursor.execute(
-                f"INSERT INTO {self.GUIDELINES_TABLE} VALUES (?, ?, ?, ?, TO_VECTOR(?))",
-                (
-                    new_id,
-                    guideline_data["condition"],
-                    guideline_data["guideline_text"],
-                    guideline_data["source"],
-                    str(embedding)
+        # Take the next id from this process's reserved block before checking out a connection
+        new_id = self.id_allocator.next_id(self.GUIDELINES_TABLE)
+        
+        with self.db_connection() as conn:
+            cursor = conn.cursor()
+        
+            try:
+                # Insert into database
+                cursor.execute(
+                    f"""
+                    INSERT INTO {self.GUIDELINES_TABLE}
+                    (id, condition, guideline_text, source, embedded_text, embedding_model, content_hash)
+                    VALUES (?, ?, ?, ?, TO_VECTOR(?), ?, ?)
+                    """,
+                    (
+                        new_id,
+                        guideline_data["condition"],
+                        guideline_data["guideline_text"],
+                        guideline_data["source"],
+                        to_vector_param(embedding),
+                        embedding_fingerprint(),
+                        content_hash(embedding_text)
+                    )
                 )
-            )
             
-            conn.commit()
-            return {"id": new_id, "status": "success"}
+                conn.commit()
+                self.update_vector_index("guidelines", new_id, embedding, {"condition": guideline_data["condition"]})
+                self.update_lexical_index("guidelines", new_id, guideline_data)
+                self.invalidate_answers("guidelines", new_id)
+                return {"id": new_id, "status": "success"}
         
-        finally:
-            cursor.close()
-            conn.close()
+            finally:
+                cursor.close()
     
     def add_exercise(self, exercise_data):
         """Add a new exercise recommendation with vector embedding"""
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
+        # Create embedding
+        combined_text = exercise_embedding_text(exercise_data)
+        embedding = self.embed_text(combined_text)
         
-        try:
-            # Create embedding
-            combined_text = f"{exercise_data['exercise_name']} {exercise_data['description']} {exercise_data['benefits']}"
-            embedding = self.model.encode(combined_text, normalize_embeddings=True).tolist()
-            
-            # Get the next available ID
-            cursor.execute(f"SELECT MAX(id) FROM {self.EXERCISES_TABLE}")
-            max_id = cursor.fetchone()[0]
-            new_id = 1 if max_id is None else max_id + 1
-            
-            # Insert into database
-            cursor.execute(
-                f"INSERT INTO {self.EXERCISES_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, TO_VECTOR(?))",
-                (
-                    new_id,
-                    exercise_data["condition"],
-                    exercise_data["severity"],
-                    exercise_data["exercise_name"],
-                    exercise_data["description"],
-                    exercise_data["benefits"],
-                    exercise_data["contraindications"],
-                    str(embedding)
+        # Take the next id from this process's reserved block before checking out a connection
+        new_id = self.id_allocator.next_id(self.EXERCISES_TABLE)
+        
+        with self.db_connection() as conn:
+            cursor = conn.cursor()
+        
+            try:
+                # Insert into database
+                cursor.execute(
+                    f"""
+                    INSERT INTO {self.EXERCISES_TABLE}
+                    (id, condition, severity, exercise_name, description, benefits, contraindications,
+                    embedded_text, embedding_model, content_hash)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, TO_VECTOR(?), ?, ?)
+                    """,
+                    (
+                        new_id,
+                        exercise_data["condition"],
+                        exercise_data["severity"],
+                        exercise_data["exercise_name"],
+                        exercise_data["description"],
+                        exercise_data["benefits"],
+                        exercise_data["contraindications"],
+                        to_vector_param(embedding),
+                        embedding_fingerprint(),
+                        content_hash(combined_text)
+                    )
                 )
-            )
             
-            conn.commit()
-            return {"id": new_id, "status": "success"}
+                conn.commit()
+                self.update_vector_index("exercises", new_id, embedding, {"condition": exercise_data["condition"]})
+                self.update_lexical_index("exercises", new_id, exercise_data)
+                self.invalidate_answers("exercises", new_id)
+                return {"id": new_id, "status": "success"}
         
-        finally:
-            cursor.close()
-            conn.close()
+            finally:
+                cursor.close()
 
-    def find_similar_patients_iris_vector(self, patient_id, limit=3):
+    def find_similar_patients_iris_vector(self, patient_id, limit=3, cursor=None, constraints=None, after=None):
         """
         Use IRIS's native vector search capabilities to find similar patients
-        without causing segmentation faults
+        without causing segmentation faults. Pass a cursor to reuse the caller's connection.
+        constraints (condition, same_condition, gender, min_age, max_age, min_score) are applied
+        before ranking, so up to limit qualifying patients come back; after is the next_cursor
+        of a previous page
         """
-        conn = None
-        cursor = None
-        
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
+            if cursor is not None:
+                return self._find_similar_patients(cursor, patient_id, limit, constraints, after)
             
-            # First get the target patient's data and embeddings
+            with self.db_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    return self._find_similar_patients(cursor, patient_id, limit, constraints, after)
+                finally:
+                    cursor.close()
+        
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return {"error": str(e), "similar_patients": []}
+
+    def _rank_similar_patients(self, cursor, patient_id, limit, constraints=None, after=None):
+        """
+        Return (id, composite score) pairs for the patients most similar to the target that satisfy
+        the constraints, ordered by score then id, starting after the (id, score) pair in after
+        """
+        constraints = normalize_similarity_constraints(constraints)
+        
+        index = self._vector_index("patients")
+        if index is not None:
+            target = index.get(patient_id)
+            if target is not None:
+                filters = {name: constraints[name] for name in ("condition", "gender") if name in constraints}
+                if constraints.get("same_condition") and "condition" not in filters:
+                    filters["condition"] = index.get_attributes(patient_id)["condition"]
+                ranges = None
+                if "min_age" in constraints or "max_age" in constraints:
+                    ranges = {"age": (constraints.get("min_age"), constraints.get("max_age"))}
+                return index.search(
+                    target, limit,
+                    exclude_ids=[patient_id],
+                    filters=filters,
+                    ranges=ranges,
+                    min_score=constraints.get("min_score"),
+                    after=after
+                )
+        
+        # Rank the matching patients with one dot product against the target's composite
+        # vector, which is referenced server-side by id rather than sent back as text
+        score_sql = "VECTOR_DOT_PRODUCT(p.embedded_composite, t.embedded_composite)"
+        clauses = ["t.id = ?", "p.id != t.id", "p.embedded_composite IS NOT NULL"]
+        params = [patient_id]
+        if "condition" in constraints:
+            clauses.append("p.condition = ?")
+            params.append(constraints["condition"])
+        elif constraints.get("same_condition"):
+            clauses.append("p.condition = t.condition")
+        if "gender" in constraints:
+            clauses.append("p.gender = ?")
+            params.append(constraints["gender"])
+        if "min_age" in constraints:
+            clauses.append("p.age >= ?")
+            params.append(constraints["min_age"])
+        if "max_age" in constraints:
+            clauses.append("p.age <= ?")
+            params.append(constraints["max_age"])
+        if "min_score" in constraints:
+            clauses.append(f"{score_sql} >= ?")
+            params.append(constraints["min_score"])
+        if after is not None:
+            after_id, after_score = after
+            clauses.append(f"({score_sql} < ? OR ({score_sql} = ? AND p.id > ?))")
+            params.extend([after_score, after_score, after_id])
+        
+        cursor.execute(
+            f"""
+            SELECT TOP {int(limit)} p.id, {score_sql} AS score
+            FROM {self.PATIENT_TABLE} p, {self.PATIENT_TABLE} t
+            WHERE {' AND '.join(clauses)}
+            ORDER BY score DESC, p.id
+            """,
+            params
+        )
+        return [(row[0], float(row[1]) if row[1] is not None else 0.0) for row in cursor.fetchall()]
+
+    def _facet_scores(self, cursor, patient_id, ids):
+        """Per-facet similarity of the given patients to the target: id -> {facet: score}"""
+        if not ids:
+            return {}
+        facet_columns = ",\n                ".join(
+            f"VECTOR_DOT_PRODUCT(p.{FACET_COLUMNS[facet]}, t.{FACET_COLUMNS[facet]}) AS {facet}_sim"
+            for facet, _ in SIMILARITY_WEIGHTS
+        )
+        ids = list(ids)
+        scores = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
             cursor.execute(
                 f"""
-                SELECT id, embedded_demographics, embedded_history, embedded_treatment, embedded_outcomes 
-                FROM {self.PATIENT_TABLE} 
-                WHERE id = ?
+                SELECT p.id,
+                    {facet_columns}
+                FROM {self.PATIENT_TABLE} p, {self.PATIENT_TABLE} t
+                WHERE t.id = ? AND p.id IN ({', '.join('?' for _ in chunk)})
                 """,
-                (patient_id,)
+                [patient_id] + chunk
             )
-            
-            target = cursor.fetchone()
-            if not target:
+            for row in cursor.fetchall():
+                scores[row[0]] = {
+                    facet: round(float(value), 4) if value is not None else 0.0
+                    for (facet, _), value in zip(SIMILARITY_WEIGHTS, row[1:])
+                }
+        return scores
+
+    def _find_similar_patients(self, cursor, patient_id, limit, constraints=None, after=None):
+        """
+        Run the weighted multi-vector similarity search for a patient on the given cursor, reading
+        the materialized neighbor lists when they can answer and ranking live otherwise.
+        The result carries next_cursor when more qualifying patients follow
+        """
+        limit = max(1, int(limit))
+        
+        # One extra row tells whether another page follows
+        neighbors = self.patient_neighbors.lookup(cursor, patient_id, limit + 1, constraints, after)
+        if neighbors is not None:
+            ranked = [(row_id, score) for row_id, score, _ in neighbors]
+            facet_scores = {row_id: facets for row_id, _, facets in neighbors}
+        else:
+            ranked = self._rank_similar_patients(cursor, patient_id, limit + 1, constraints, after)
+            facet_scores = None
+        next_cursor = encode_similarity_cursor(*ranked[limit - 1]) if len(ranked) > limit else None
+        ranked = ranked[:limit]
+        
+        if not ranked:
+            cursor.execute(f"SELECT id FROM {self.PATIENT_TABLE} WHERE id = ?", (patient_id,))
+            if not cursor.fetchone():
                 return {"error": "Patient not found", "similar_patients": []}
-            
-            # Use SQL to find similar patients based on vector dot product
-            # IRIS's native vector functions handle the similarity calculation
-            query = f"""
-                SELECT TOP {limit} id, name, condition, age, gender, medical_history, 
-                    current_treatment, assessment, treatment_outcomes,
-                    VECTOR_DOT_PRODUCT(embedded_demographics, TO_VECTOR(?)) AS demographics_sim,
-                    VECTOR_DOT_PRODUCT(embedded_history, TO_VECTOR(?)) AS history_sim,
-                    VECTOR_DOT_PRODUCT(embedded_treatment, TO_VECTOR(?)) AS treatment_sim,
-                    VECTOR_DOT_PRODUCT(embedded_outcomes, TO_VECTOR(?)) AS outcomes_sim
+            return {"similar_patients": [], "next_cursor": None}
+        
+        # Fetch details (and, for live rankings, per-facet scores) for the top-k only
+        ids = [row_id for row_id, _ in ranked]
+        if facet_scores is None:
+            facet_scores = self._facet_scores(cursor, patient_id, ids)
+        details = self._similar_patient_details(cursor, ids)
+        
+        similar_patients = [
+            self._similar_patient_entry(details[row_id], combined_score, facet_scores.get(row_id))
+            for row_id, combined_score in ranked
+            if row_id in details
+        ]
+        
+        return {"similar_patients": similar_patients, "next_cursor": next_cursor}
+
+    def _similar_patient_entry(self, row, combined_score, facet_scores=None):
+        """
+        Format one similar patient from an (id, name, condition, age, gender, medical_history,
+        current_treatment, assessment, treatment_outcomes) row and its scores
+        """
+        # Map combined score to category
+        if combined_score > 0.8:
+            category = "High"
+        elif combined_score > 0.6:
+            category = "Medium"
+        else:
+            category = "Low"
+        
+        return {
+            "id": row[0],
+            "name": row[1],
+            "condition": row[2],
+            "age": row[3],
+            "gender": row[4],
+            "medical_history": row[5],
+            "current_treatment": row[6],
+            "assessment": row[7],
+            "treatment_outcomes": row[8],
+            "similarity_score": category,
+            "raw_score": round(combined_score, 2),
+            "facet_scores": facet_scores or {facet: 0.0 for facet, _ in SIMILARITY_WEIGHTS}
+        }
+
+    def _similar_patient_details(self, cursor, ids):
+        """id -> detail row for the given patients, read in chunks of one query each"""
+        ids = list(ids)
+        details = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            cursor.execute(
+                f"""
+                SELECT id, name, condition, age, gender, medical_history,
+                    current_treatment, assessment, treatment_outcomes
                 FROM {self.PATIENT_TABLE}
-                WHERE id != ?
-                ORDER BY (
-                    VECTOR_DOT_PRODUCT(embedded_demographics, TO_VECTOR(?)) * 0.3 +
-                    VECTOR_DOT_PRODUCT(embedded_history, TO_VECTOR(?)) * 0.3 +
-                    VECTOR_DOT_PRODUCT(embedded_treatment, TO_VECTOR(?)) * 0.2 +
-                    VECTOR_DOT_PRODUCT(embedded_outcomes, TO_VECTOR(?)) * 0.2
-                ) DESC
-            """
-            
-            # Execute the query with the patient's embeddings as parameters
-            # Pass each embedding twice due to the ORDER BY clause
-            cursor.execute(query, [
-                str(target[1]), str(target[2]), str(target[3]), str(target[4]), 
-                patient_id,
-                str(target[1]), str(target[2]), str(target[3]), str(target[4])
-            ])
-            
-            # Process results
-            similar_patients = []
-            for row in cursor.fetchall():
-                # Calculate combined similarity score
-                demographics_sim = float(row[9]) if row[9] is not None else 0.0
-                history_sim = float(row[10]) if row[10] is not None else 0.0
-                treatment_sim = float(row[11]) if row[11] is not None else 0.0
-                outcomes_sim = float(row[12]) if row[12] is not None else 0.0
-                
-                combined_score = (
-                    demographics_sim * 0.3 + 
-                    history_sim * 0.3 + 
-                    treatment_sim * 0.2 + 
-                    outcomes_sim * 0.2
-                )
-                
-                # Map combined score to category
-                if combined_score > 0.8:
-                    category = "High"
-                elif combined_score > 0.6:
-                    category = "Medium"
+                WHERE id IN ({', '.join('?' for _ in chunk)})
+                """,
+                chunk
+            )
+            details.update((row[0], row) for row in cursor.fetchall())
+        return details
+
+    def find_similar_patients_batch(self, patient_ids, limit=3, min_score=None):
+        """
+        Top-limit similar patients for many patients at once: the targets' composite vectors are
+        scored against every patient with matrix-matrix products, and the matches' details are read
+        in one query. Returns {"results": {id: [similar patients]}, "missing": [ids without vectors]}
+        """
+        patient_ids = list(dict.fromkeys(int(patient_id) for patient_id in patient_ids))
+        limit = max(1, int(limit))
+        
+        with self.db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                index = self._vector_index("patients")
+                if index is not None:
+                    targets = {patient_id: index.get(patient_id) for patient_id in patient_ids}
+                    targets = {patient_id: vector for patient_id, vector in targets.items() if vector is not None}
                 else:
-                    category = "Low"
+                    # Without the in-memory index, read the targets' vectors in one query and
+                    # score against a transient index of the whole table
+                    targets = {}
+                    for start in range(0, len(patient_ids), 500):
+                        chunk = patient_ids[start:start + 500]
+                        cursor.execute(
+                            f"""
+                            SELECT id, embedded_composite FROM {self.PATIENT_TABLE}
+                            WHERE embedded_composite IS NOT NULL AND id IN ({', '.join('?' for _ in chunk)})
+                            """,
+                            chunk
+                        )
+                        targets.update((row[0], parse_vector(row[1])) for row in cursor.fetchall())
+                    cursor.execute(
+                        f"SELECT id, embedded_composite FROM {self.PATIENT_TABLE} WHERE embedded_composite IS NOT NULL"
+                    )
+                    index = VectorIndex("patients", COMPOSITE_DIMENSION)
+                    index.load((row[0], parse_vector(row[1]), None) for row in cursor.fetchall())
                 
-                similar_patients.append({
-                    "id": row[0],
-                    "name": row[1],
-                    "condition": row[2],
-                    "age": row[3],
-                    "gender": row[4],
-                    "medical_history": row[5],
-                    "current_treatment": row[6],
-                    "assessment": row[7],
-                    "treatment_outcomes": row[8],
-                    "similarity_score": category,
-                    "raw_score": round(combined_score, 2)
-                })
-            
-            return {"similar_patients": similar_patients}
+                found = [patient_id for patient_id in patient_ids if patient_id in targets]
+                ranked = index.search_many(
+                    [targets[patient_id] for patient_id in found], limit,
+                    exclude_ids=found, min_score=min_score
+                ) if found else []
+                
+                details = self._similar_patient_details(
+                    cursor, {row_id for neighbors in ranked for row_id, _ in neighbors}
+                )
+            finally:
+                cursor.close()
         
+        results = {}
+        for patient_id, neighbors in zip(found, ranked):
+            neighbor_vectors = [index.get(row_id) for row_id, _ in neighbors]
+            facets = composite_facet_scores(targets[patient_id], neighbor_vectors) if neighbors else {}
+            results[patient_id] = [
+                self._similar_patient_entry(details[row_id], score, {
+                    facet: round(float(values[position]), 4) for facet, values in facets.items()
+                })
+                for position, (row_id, score) in enumerate(neighbors)
+                if row_id in details
+            ]
+        return {
+            "results": results,
+            "missing": [patient_id for patient_id in patient_ids if patient_id not in targets]
+        }
+
+    def _maintain_patient_neighbors(self, action, patient_id=None):
+        """
+        Apply one neighbor graph update ("refresh", "remove" or "rebuild") on its own connection.
+        Failures are logged rather than raised: reads fall back to live ranking, and a rebuild repairs the graph
+        """
+        try:
+            with self.db_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    if action == "rebuild":
+                        result = self.patient_neighbors.rebuild(cursor)
+                    else:
+                        result = getattr(self.patient_neighbors, action)(cursor, patient_id)
+                    conn.commit()
+                    return result
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    cursor.close()
         except Exception as e:
             import traceback
             traceback.print_exc()
-            return {"error": str(e), "similar_patients": []}
-        
-        finally:
-            if cursor:
-                try:
-                    cursor.close()
-                except:
-                    pass
-            if conn:
-                try:
-                    conn.close()
-                except:
-                    pass
+            print(f"Could not {action} patient neighbors{'' if patient_id is None else f' for patient {patient_id}'}: {e}")
+            if action == "rebuild":
+                raise
+
+    def refresh_patient_neighbors(self, patient_id):
+        """Update the neighbor graph after a patient was added or its vectors changed"""
+        return self._maintain_patient_neighbors("refresh", patient_id)
+
+    def rebuild_patient_neighbors(self):
+        """Recompute the whole neighbor graph; returns the number of patient lists written"""
+        return self._maintain_patient_neighbors("rebuild")
 
     def _calculate_cosine_similarity(self, vec1, vec2):
         """Calculate cosine similarity between two vectors using numpy"""
@@ -1373,182 +2011,250 @@ class ClinicalRAG:
 
     def find_exercises_by_description(self, query_text, limit=5, condition=None):
         """
-        Find exercises that semantically match the query description using vector search
+        Find exercises that semantically match the query description using vector search.
+        This path is read-only: stale exercise embeddings are refreshed by reindex_stale_embeddings
         """
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
+        with self.db_connection() as conn:
+            cursor = conn.cursor()
         
-        try:
-            # Create embedding for the query text
-            query_embedding = self.model.encode(query_text, normalize_embeddings=True).tolist()
+            try:
+                # Create embedding for the query text
+                query_embedding = self.embed_text(query_text)
+            
+                # Build the SQL query with condition filter if provided
+                if condition:
+                    cursor.execute(f"""
+                        SELECT TOP ? id, exercise_name, description, benefits, contraindications, severity, condition,
+                            VECTOR_DOT_PRODUCT(embedded_text, TO_VECTOR(?)) as relevance
+                        FROM {self.EXERCISES_TABLE}
+                        WHERE condition = ?
+                        ORDER BY relevance DESC
+                    """, (limit, to_vector_param(query_embedding), condition))
+                else:
+                    cursor.execute(f"""
+                        SELECT TOP ? id, exercise_name, description, benefits, contraindications, severity, condition,
+                            VECTOR_DOT_PRODUCT(embedded_text, TO_VECTOR(?)) as relevance
+                        FROM {self.EXERCISES_TABLE}
+                        ORDER BY relevance DESC
+                    """, (limit, to_vector_param(query_embedding)))
             
-            # Update all exercise embeddings for consistency
-            cursor.execute(f"SELECT id, exercise_name, description, benefits FROM {self.EXERCISES_TABLE}")
-            all_exercises = cursor.fetchall()
+                exercises = []
+                for row in cursor.fetchall():
+                    relevance_score = float(row[7])  # Convert to float explicitly
+                    exercises.append({
+                        "id": row[0],
+                        "exercise_name": row[1],
+                        "description": row[2],
+                        "benefits": row[3],
+                        "contraindications": row[4],
+                        "severity": row[5],
+                        "condition": row[6],
+                        "relevance": relevance_score
+                    })
             
-            updated_count = 0
-            for ex in all_exercises:
-                ex_id = ex[0]
-                    
-                # Create consistent embeddings for each exercise
-                combined_text = f"{ex[1]} {ex[2]} {ex[3]}"
-                new_embedding = self.model.encode(combined_text, normalize_embeddings=True).tolist()
-                
-                # Update the embedding
+                return {"exercises": exercises}
+        
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                return {"error": str(e)}, 500
+        
+            finally:
+                cursor.close()
+
+    def _backfill_patient_composites(self, conn, cursor):
+        """Compute the weighted composite vector for patients stored before it existed"""
+        facet_columns = ", ".join(FACET_COLUMNS[facet] for facet, _ in SIMILARITY_WEIGHTS)
+        cursor.execute(
+            f"SELECT id, condition, age, gender, {facet_columns} FROM {self.PATIENT_TABLE} WHERE embedded_composite IS NULL"
+        )
+        rows = cursor.fetchall()
+        
+        composites = []
+        for row in rows:
+            facet_vectors = {
+                facet: parse_vector(value)
+                for (facet, _), value in zip(SIMILARITY_WEIGHTS, row[4:])
+            }
+            if any(vector is None for vector in facet_vectors.values()):
+                continue
+            composite_embedding = compose_patient_vector(facet_vectors)
+            cursor.execute(
+                f"UPDATE {self.PATIENT_TABLE} SET embedded_composite = TO_VECTOR(?) WHERE id = ?",
+                (to_vector_param(composite_embedding), row[0])
+            )
+            composites.append((row[0], composite_embedding, {"condition": row[1], "age": row[2], "gender": row[3]}))
+        
+        conn.commit()
+        for row_id, composite_embedding, attributes in composites:
+            self.update_vector_index("patients", row_id, composite_embedding, attributes)
+        return {"checked": len(rows), "reindexed": len(composites)}
+
+    def _reindex_table(self, conn, cursor, index_kind, text_columns, force=False, batch_size=32):
+        """Re-embed only the rows of a table whose fingerprint or content hash is out of date"""
+        table = self.VECTOR_INDEX_SOURCES[index_kind][0]
+        cursor.execute(
+            f"SELECT id, {', '.join(text_columns)}, embedding_model, content_hash, condition FROM {table}"
+        )
+        rows = cursor.fetchall()
+        fingerprint = embedding_fingerprint()
+        
+        stale = []
+        for row in rows:
+            text = " ".join(f"{value}" for value in row[1:1 + len(text_columns)])
+            text_hash = content_hash(text)
+            stored_model = row[-3]
+            stored_hash = row[-2]
+            if force or stored_model != fingerprint or stored_hash != text_hash:
+                stale.append((row[0], text, text_hash, row[-1]))
+        
+        for start in range(0, len(stale), batch_size):
+            batch = stale[start:start + batch_size]
+            embeddings = self.embed_batch([text for _, text, _, _ in batch], batch_size=batch_size)
+            for (row_id, _, text_hash, _), embedding in zip(batch, embeddings):
                 cursor.execute(
                     f"""
-                    UPDATE {self.EXERCISES_TABLE}
-                    SET embedded_text = TO_VECTOR(?)
+                    UPDATE {table}
+                    SET embedded_text = TO_VECTOR(?), embedding_model = ?, content_hash = ?
                     WHERE id = ?
                     """,
-                    (str(new_embedding), ex_id)
+                    (to_vector_param(embedding), fingerprint, text_hash, row_id)
                 )
-                updated_count += 1
-            
-            if updated_count > 0:
-                print(f"Updated embeddings for {updated_count} exercises to ensure consistent dimensions")
-                conn.commit()
-            
-            # Build the SQL query with condition filter if provided
-            if condition:
-                cursor.execute(f"""
-                    SELECT TOP ? id, exercise_name, description, benefits, contraindications, severity, condition,
-                        VECTOR_DOT_PRODUCT(embedded_text, TO_VECTOR(?)) as relevance
-                    FROM {self.EXERCISES_TABLE}
-                    WHERE condition = ?
-                    ORDER BY relevance DESC
-                """, (limit, str(query_embedding), condition))
-            else:
-                cursor.execute(f"""
-                    SELECT TOP ? id, exercise_name, description, benefits, contraindications, severity, condition,
-                        VECTOR_DOT_PRODUCT(embedded_text, TO_VECTOR(?)) as relevance
-                    FROM {self.EXERCISES_TABLE}
-                    ORDER BY relevance DESC
-                """, (limit, str(query_embedding)))
-            
-            exercises = []
-            for row in cursor.fetchall():
-                relevance_score = float(row[7])  # Convert to float explicitly
-                exercises.append({
-                    "id": row[0],
-                    "exercise_name": row[1],
-                    "description": row[2],
-                    "benefits": row[3],
-                    "contraindications": row[4],
-                    "severity": row[5],
-                    "condition": row[6],
-                    "relevance": relevance_score
-                })
-            
-            return {"exercises": exercises}
+            conn.commit()
+            for (row_id, _, _, condition), embedding in zip(batch, embeddings):
+                self.update_vector_index(index_kind, row_id, embedding, {"condition": condition})
         
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            return {"error": str(e)}, 500
+        return {"checked": len(rows), "reindexed": len(stale)}
+
+    def reindex_stale_embeddings(self, force=False, batch_size=32):
+        """
+        Refresh guideline and exercise embeddings whose stored model fingerprint or
+        content hash no longer matches, leaving up-to-date rows untouched, and backfill
+        missing patient composite vectors
+        """
+        with self.db_connection() as conn:
+            cursor = conn.cursor()
+        
+            try:
+                result = {
+                    "fingerprint": embedding_fingerprint(),
+                    "guidelines": self._reindex_table(
+                        conn, cursor, "guidelines", ["guideline_text"], force, batch_size
+                    ),
+                    "exercises": self._reindex_table(
+                        conn, cursor, "exercises", ["exercise_name", "description", "benefits"], force, batch_size
+                    ),
+                    "patient_composites": self._backfill_patient_composites(conn, cursor)
+                }
+                print(f"Re-indexed {result['guidelines']['reindexed']} guidelines and {result['exercises']['reindexed']} exercises")
+        
+            finally:
+                cursor.close()
         
-        finally:
-            cursor.close()
-            conn.close()
+        # Reloading the lexical indexes and rebuilding the graph check out connections of their own,
+        # so they run once ours is returned
+        if result["guidelines"]["reindexed"] or result["exercises"]["reindexed"]:
+            # Stale rows were edited outside the API, so their indexed text is stale too
+            self.load_lexical_indexes()
+        if result["patient_composites"]["reindexed"]:
+            self.rebuild_patient_neighbors()
+        
+        # New vectors can change what retrieval returns
+        self.clear_answer_caches()
+        return result
 
     def find_similar_patients_simple(self, patient_id, limit=3):
         """
         A simplified version of finding similar patients that doesn't use SentenceTransformer at runtime
         """
-        import numpy as np
-        
-        conn = None
-        cursor = None
-        
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            
-            # Get the patient's data
-            cursor.execute(
-                f"SELECT id, name, condition, age, gender, medical_history, current_treatment, assessment, treatment_outcomes FROM {self.PATIENT_TABLE} WHERE id = ?",
-                (patient_id,)
-            )
-            
-            patient_row = cursor.fetchone()
-            if not patient_row:
-                return {"error": "Patient not found", "similar_patients": []}
-                
-            # Get patient's condition for a simple match
-            patient_condition = patient_row[2]
-            
-            # Use f-string to insert the limit directly - not using parameter for TOP
-            cursor.execute(
-                f"""
-                SELECT TOP {limit} id, name, condition, age, gender, medical_history, current_treatment, assessment, treatment_outcomes
-                FROM {self.PATIENT_TABLE} 
-                WHERE id != ? AND condition LIKE ?
-                """,
-                (patient_id, f"%{patient_condition}%")
-            )
-            
-            similar_patients = []
-            
-            for row in cursor.fetchall():
+            with self.db_connection() as conn:
+                cursor = conn.cursor()
                 try:
-                    # Calculate a simple text similarity based on condition
-                    from difflib import SequenceMatcher
-                    
-                    def similarity(a, b):
-                        return SequenceMatcher(None, a, b).ratio()
-                    
-                    # Calculate similarity based on condition
-                    condition_similarity = similarity(patient_condition, row[2])
-                    
-                    # Map similarity score to category
-                    similarity_category = "High" if condition_similarity > 0.8 else "Medium" if condition_similarity > 0.5 else "Low"
-                    
-                    similar_patients.append({
-                        "id": row[0],
-                        "name": row[1],
-                        "condition": row[2],
-                        "age": row[3],
-                        "gender": row[4],
-                        "medical_history": row[5],
-                        "current_treatment": row[6],
-                        "assessment": row[7],
-                        "treatment_outcomes": row[8],
-                        "similarity_score": similarity_category,
-                        "raw_score": condition_similarity
-                    })
-                except Exception as e:
-                    print(f"Error processing similarity row: {e}")
-                    continue
-            
-            # Sort by similarity (highest first)
-            similar_patients.sort(key=lambda x: x["raw_score"], reverse=True)
-            
-            return {"similar_patients": similar_patients}
+                    return self._find_similar_patients_by_condition(cursor, patient_id, limit)
+                finally:
+                    cursor.close()
         
         except Exception as e:
             import traceback
             traceback.print_exc()
             return {"error": str(e), "similar_patients": []}
-        
-        finally:
-            # Make sure we clean up resources
-            if cursor:
-                cursor.close()
-            if conn:
-                conn.close()
+
+    def _find_similar_patients_by_condition(self, cursor, patient_id, limit):
+        """Rank patients sharing the target patient's condition by condition-name similarity"""
+        # Get the patient's data
+        cursor.execute(
+            f"SELECT id, name, condition, age, gender, medical_history, current_treatment, assessment, treatment_outcomes FROM {self.PATIENT_TABLE} WHERE id = ?",
+            (patient_id,)
+        )
+
+        patient_row = cursor.fetchone()
+        if not patient_row:
+            return {"error": "Patient not found", "similar_patients": []}
+
+        # Get patient's condition for a simple match
+        patient_condition = patient_row[2]
+
+        # Use f-string to insert the limit directly - not using parameter for TOP
+        cursor.execute(
+            f"""
+            SELECT TOP {limit} id, name, condition, age, gender, medical_history, current_treatment, assessment, treatment_outcomes
+            FROM {self.PATIENT_TABLE} 
+            WHERE id != ? AND condition LIKE ?
+            """,
+            (patient_id, f"%{patient_condition}%")
+        )
+
+        similar_patients = []
+
+        for row in cursor.fetchall():
+            try:
+                # Calculate a simple text similarity based on condition
+                from difflib import SequenceMatcher
+
+                def similarity(a, b):
+                    return SequenceMatcher(None, a, b).ratio()
+
+                # Calculate similarity based on condition
+                condition_similarity = similarity(patient_condition, row[2])
+
+                # Map similarity score to category
+                similarity_category = "High" if condition_similarity > 0.8 else "Medium" if condition_similarity > 0.5 else "Low"
+
+                similar_patients.append({
+                    "id": row[0],
+                    "name": row[1],
+                    "condition": row[2],
+                    "age": row[3],
+                    "gender": row[4],
+                    "medical_history": row[5],
+                    "current_treatment": row[6],
+                    "assessment": row[7],
+                    "treatment_outcomes": row[8],
+                    "similarity_score": similarity_category,
+                    "raw_score": condition_similarity
+                })
+            except Exception as e:
+                print(f"Error processing similarity row: {e}")
+                continue
+
+        # Sort by similarity (highest first)
+        similar_patients.sort(key=lambda x: x["raw_score"], reverse=True)
+
+        return {"similar_patients": similar_patients}
 
     def cleanup(self):
         """Clean up resources to prevent leaks"""
         try:
-            # Clear global model reference
-            global _model
-            if _model is not None:
-                # Clear CUDA cache if using GPU
-                if torch.cuda.is_available():
-                    torch.cuda.empty_cache()
-                
-                # Delete model reference
-                _model = None
-                print("Cleaned up SentenceTransformer resources")
+            # Stop the retrieval threads and close pooled database connections
+            self.retrieval_executor.shutdown()
+            self.pool.close_all()
+            
+            # Persist the on-disk embedding cache and release the shared embedding model
+            self.embedding_cache.flush()
+            self.model_registry.release()
+            
+            # Close the shared Groq client's keep-alive connections
+            close_groq_client()
         except Exception as e:
             print(f"Error during cleanup: {e}")
\ No newline at end of file
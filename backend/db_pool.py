@@ -0,0 +1,228 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available within the checkout timeout"""
+
+
+class PoolClosedError(Exception):
+    """Raised when a connection is requested from a pool that has been closed"""
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of database connections.
+    Idle connections are reused most-recently-used first, health checked before reuse
+    once they have been idle for a while, and closed after max_idle_seconds.
+    """
+
+    def __init__(self, connect_fn, max_size=10, max_idle_seconds=300,
+                 health_check_after_seconds=30, checkout_timeout=10):
+        self.connect_fn = connect_fn
+        self.max_size = max_size
+        self.max_idle_seconds = max_idle_seconds
+        self.health_check_after_seconds = health_check_after_seconds
+        self.checkout_timeout = checkout_timeout
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (connection, returned_at)
+        self._open_count = 0
+        self._in_use = 0
+        self._closed = False
+        self._metrics = {
+            "created": 0,
+            "reused": 0,
+            "closed": 0,
+            "evicted_idle": 0,
+            "failed_health_checks": 0,
+            "checkouts": 0,
+            "checkout_waits": 0,
+            "checkout_timeouts": 0,
+            "total_wait_seconds": 0.0
+        }
+
+        # A pre-fork server may create connections before forking; children must not share them
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        """Forget connections inherited from the parent process without closing the parent's sockets"""
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._open_count = 0
+        self._in_use = 0
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn):
+        """Run a trivial query to confirm the connection is still usable"""
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            return True
+        except Exception:
+            return False
+        finally:
+            if cursor:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+
+    def _evict_expired_locked(self, now):
+        """Close idle connections that have not been used for max_idle_seconds (caller holds the lock)"""
+        expired = []
+        # Oldest idle connections sit at the left of the deque
+        while self._idle and now - self._idle[0][1] > self.max_idle_seconds:
+            expired.append(self._idle.popleft()[0])
+        self._open_count -= len(expired)
+        self._metrics["evicted_idle"] += len(expired)
+        self._metrics["closed"] += len(expired)
+        return expired
+
+    def acquire(self):
+        """Check out a connection, creating one if the pool is below max_size"""
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+        waited = False
+
+        while True:
+            conn = None
+            idle_since = None
+            create = False
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolClosedError("The connection pool has been closed")
+                    expired = self._evict_expired_locked(time.time())
+                    for stale in expired:
+                        self._close_quietly(stale)
+
+                    if self._idle:
+                        conn, idle_since = self._idle.pop()
+                        break
+                    if self._open_count < self.max_size:
+                        self._open_count += 1
+                        create = True
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._metrics["checkout_timeouts"] += 1
+                        raise PoolTimeoutError(
+                            f"No database connection available within {self.checkout_timeout}s "
+                            f"(pool size {self.max_size})"
+                        )
+                    if not waited:
+                        waited = True
+                        self._metrics["checkout_waits"] += 1
+                    self._cond.wait(remaining)
+
+            if create:
+                try:
+                    conn = self.connect_fn()
+                except Exception:
+                    with self._cond:
+                        self._open_count -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._metrics["created"] += 1
+                    closed = self._closed
+                    if closed:
+                        self._open_count -= 1
+                        self._metrics["closed"] += 1
+                if closed:
+                    # The pool was closed while connecting; don't hand out a connection nobody will close
+                    self._close_quietly(conn)
+                    raise PoolClosedError("The connection pool has been closed")
+            elif time.time() - idle_since > self.health_check_after_seconds and not self._is_healthy(conn):
+                # Drop the dead connection and try again
+                self._close_quietly(conn)
+                with self._cond:
+                    self._open_count -= 1
+                    self._metrics["failed_health_checks"] += 1
+                    self._metrics["closed"] += 1
+                    self._cond.notify()
+                continue
+            else:
+                with self._cond:
+                    self._metrics["reused"] += 1
+
+            with self._cond:
+                self._in_use += 1
+                self._metrics["checkouts"] += 1
+                self._metrics["total_wait_seconds"] += time.monotonic() - started
+            return conn
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, or close it if it is no longer usable"""
+        with self._cond:
+            self._in_use -= 1
+            discard = discard or self._closed
+            if discard:
+                self._open_count -= 1
+                self._metrics["closed"] += 1
+            else:
+                self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+        if discard:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a with-block"""
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except Exception:
+            # Leave no half-finished transaction behind for the next user
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def close_all(self):
+        """
+        Close every idle connection and refuse further checkouts; checked-out connections are
+        closed when released
+        """
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._open_count -= len(idle)
+            self._metrics["closed"] += len(idle)
+            # Waiting checkouts fail instead of waiting for their timeout
+            self._cond.notify_all()
+
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def metrics(self):
+        with self._cond:
+            metrics = dict(self._metrics)
+            metrics.update({
+                "max_size": self.max_size,
+                "open": self._open_count,
+                "idle": len(self._idle),
+                "in_use": self._in_use
+            })
+        checkouts = metrics["checkouts"]
+        metrics["avg_wait_ms"] = round(metrics["total_wait_seconds"] * 1000 / checkouts, 3) if checkouts else 0.0
+        return metrics
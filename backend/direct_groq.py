@@ -1,4 +1,7 @@
 import os
+import threading
+import time
+from collections import deque
 from dotenv import load_dotenv
 
 # Load environment variables from .env.local file if it exists
@@ -11,27 +14,120 @@ else:
     print(".env.local file not found, trying .env")
     load_dotenv()
 
-def get_groq_client():
-    """Get a Groq client without using additional parameters that might cause issues"""
-    try:
-        # Import here to handle import errors gracefully
-        from groq import Groq
-        
-        # Check if GROQ_API_KEY is set
-        api_key = os.environ.get("GROQ_API_KEY")
-        if not api_key:
-            print("❌ GROQ_API_KEY environment variable is not set")
+# The Groq client (and its pool of keep-alive HTTP connections) is shared by every thread in the process
+_client = None
+_client_lock = threading.Lock()
+
+# Default Groq chat model
+GROQ_MODEL = "llama-3.3-70b-versatile"
+
+class LLMLatencyStats:
+    """Thread-safe latency counters for LLM calls, with percentiles over the most recent calls"""
+
+    def __init__(self, window=500):
+        self._lock = threading.Lock()
+        self._durations = deque(maxlen=window)
+        self._first_token = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+
+    def record(self, seconds, error=False, first_token_seconds=None):
+        with self._lock:
+            self.calls += 1
+            self.total_seconds += seconds
+            if error:
+                self.errors += 1
+            else:
+                self._durations.append(seconds)
+            if first_token_seconds is not None:
+                self._first_token.append(first_token_seconds)
+
+    def _percentile_ms(self, values, percentile):
+        if not values:
             return None
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+        return round(ordered[index] * 1000, 1)
+
+    def snapshot(self):
+        with self._lock:
+            durations = list(self._durations)
+            first_token = list(self._first_token)
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "avg_ms": round(self.total_seconds * 1000 / self.calls, 1) if self.calls else None,
+                "p50_ms": self._percentile_ms(durations, 50),
+                "p95_ms": self._percentile_ms(durations, 95),
+                "max_ms": round(max(durations) * 1000, 1) if durations else None,
+                "first_token_p50_ms": self._percentile_ms(first_token, 50),
+                "first_token_p95_ms": self._percentile_ms(first_token, 95)
+            }
+
+llm_latency = LLMLatencyStats()
+
+def _build_http_client():
+    """HTTP client with keep-alive connection pooling and explicit timeouts"""
+    import httpx
+    
+    timeout = httpx.Timeout(
+        float(os.environ.get("GROQ_TIMEOUT_SECONDS", "60")),
+        connect=float(os.environ.get("GROQ_CONNECT_TIMEOUT_SECONDS", "5"))
+    )
+    limits = httpx.Limits(
+        max_connections=int(os.environ.get("GROQ_MAX_CONNECTIONS", "20")),
+        max_keepalive_connections=int(os.environ.get("GROQ_MAX_KEEPALIVE_CONNECTIONS", "10")),
+        keepalive_expiry=float(os.environ.get("GROQ_KEEPALIVE_SECONDS", "60"))
+    )
+    return httpx.Client(timeout=timeout, limits=limits)
+
+def get_groq_client():
+    """Return the process-wide Groq client, creating it on first use"""
+    global _client
+    if _client is not None:
+        return _client
+    
+    with _client_lock:
+        if _client is not None:
+            return _client
+        try:
+            # Import here to handle import errors gracefully
+            from groq import Groq
             
-        # Create client with minimal parameters
-        client = Groq(api_key=api_key)
-        print("✅ Groq client initialized successfully!")
-        return client
-    except Exception as e:
-        print(f"❌ Error initializing Groq client: {e}")
-        import traceback
-        print(traceback.format_exc())
-        return None
+            # Check if GROQ_API_KEY is set
+            api_key = os.environ.get("GROQ_API_KEY")
+            if not api_key:
+                print("❌ GROQ_API_KEY environment variable is not set")
+                return None
+            
+            _client = Groq(
+                api_key=api_key,
+                base_url=os.environ.get("GROQ_BASE_URL") or None,
+                max_retries=int(os.environ.get("GROQ_MAX_RETRIES", "2")),
+                http_client=_build_http_client()
+            )
+            print("✅ Groq client initialized successfully!")
+            return _client
+        except Exception as e:
+            print(f"❌ Error initializing Groq client: {e}")
+            import traceback
+            print(traceback.format_exc())
+            return None
+
+def close_groq_client():
+    """Close the shared client and its pooled connections"""
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None:
+        try:
+            client.close()
+        except Exception as e:
+            print(f"Error closing Groq client: {e}")
+
+def llm_stats():
+    return llm_latency.snapshot()
 
 def generate_llm_response(system_prompt, user_prompt):
     """Generate a response using the Groq API with improved debugging"""
@@ -59,19 +155,23 @@ def generate_llm_response(system_prompt, user_prompt):
         print(f"📤 User prompt length: {len(user_prompt)} characters")
         
         # Use simpler parameters first to reduce potential errors
+        started = time.perf_counter()
         try:
             response = client.chat.completions.create(
                 messages=messages,
-                model="llama-3.3-70b-versatile",
+                model=GROQ_MODEL,
                 temperature=0.5
             )
                 
             # Extract the response content
             content = response.choices[0].message.content
-            print("✅ Successfully generated LLM response with model")
+            elapsed = time.perf_counter() - started
+            llm_latency.record(elapsed)
+            print(f"✅ Successfully generated LLM response with model in {elapsed * 1000:.0f} ms")
             print(f"Response content (first 100 chars): {content[:100]}...")
             return content
         except Exception as second_error:
+            llm_latency.record(time.perf_counter() - started, error=True)
             print(f"❌ Error with alternate model: {second_error}")
             raise second_error
         
@@ -79,4 +179,56 @@ def generate_llm_response(system_prompt, user_prompt):
         print(f"❌ Error generating LLM response: {e}")
         import traceback
         print(traceback.format_exc())
-        return None
\ No newline at end of file
+        return None
+
+def stream_llm_response(system_prompt, user_prompt):
+    """
+    Stream a response from the Groq API, yielding pieces of text as they arrive.
+    Yields nothing if no client is available or the request fails before any text arrives.
+    The generator returns True once the complete response has been streamed, False otherwise.
+    """
+    client = get_groq_client()
+    if not client:
+        print("⚠️ Falling back to template-based responses (no Groq client)")
+        return False
+    
+    messages = [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        {
+            "role": "user",
+            "content": user_prompt
+        }
+    ]
+    
+    started = time.perf_counter()
+    first_token_seconds = None
+    try:
+        print("🚀 Streaming response with Groq LLM...")
+        stream = client.chat.completions.create(
+            messages=messages,
+            model=GROQ_MODEL,
+            temperature=0.5,
+            stream=True
+        )
+        
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                if first_token_seconds is None:
+                    first_token_seconds = time.perf_counter() - started
+                yield content
+        elapsed = time.perf_counter() - started
+        llm_latency.record(elapsed, first_token_seconds=first_token_seconds)
+        print(f"✅ Finished streaming LLM response in {elapsed * 1000:.0f} ms")
+        return True
+    except Exception as e:
+        llm_latency.record(time.perf_counter() - started, error=True, first_token_seconds=first_token_seconds)
+        print(f"❌ Error streaming LLM response: {e}")
+        import traceback
+        print(traceback.format_exc())
+        return False
\ No newline at end of file
@@ -0,0 +1,225 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; the disk tier is then single-process only
+    fcntl = None
+
+
+def normalize_text(text):
+    """Collapse whitespace so trivially different strings share one cache entry"""
+    return " ".join(str(text or "").split())
+
+
+def cache_key(model_id, text):
+    """Content address of an embedding: model id plus the normalized text"""
+    return hashlib.sha256(f"{model_id}\0{normalize_text(text)}".encode("utf-8")).digest()
+
+
+class DiskEmbeddingStore:
+    """
+    Fixed-capacity ring of vectors in memory-mapped files, so cached embeddings survive restarts.
+    Each slot stores the 32-byte cache key and a used flag next to its vector; a lookup only counts
+    as a hit when the slot is in use and its key still matches. Processes sharing the directory
+    serialize on an flock of the header file: writers hold it exclusively while claiming a slot and
+    filling it (flag cleared first, key and flag written last), readers hold it shared while checking
+    the key and copying the vector, so a slot overwritten by another process reads as a miss.
+    """
+
+    def __init__(self, directory, model_id, dimension, capacity):
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]", "_", model_id))
+        self.dimension = dimension
+        self.capacity = capacity
+
+        # header[0] is the next slot to write, header[1] the number of writes so far
+        self._header = self._open(f"{prefix}.header", np.int64, (2,))
+        self._lock_fd = os.open(f"{prefix}.header", os.O_RDWR)
+        with self._file_lock(exclusive=True):
+            self._vectors = self._open(f"{prefix}.vectors", np.float32, (capacity, dimension))
+            self._keys = self._open(f"{prefix}.keys", np.uint8, (capacity, 32))
+            self._used = self._open(f"{prefix}.used", np.uint8, (capacity,))
+
+            self._slots = {}
+            for slot in np.flatnonzero(self._used):
+                self._slots[self._keys[slot].tobytes()] = int(slot)
+
+    def _open(self, path, dtype, shape):
+        expected = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        mode = "r+" if os.path.exists(path) and os.path.getsize(path) == expected else "w+"
+        return np.memmap(path, dtype=dtype, mode=mode, shape=shape)
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _holds_locked(self, slot, key):
+        return bool(self._used[slot]) and self._keys[slot].tobytes() == key
+
+    def __len__(self):
+        return len(self._slots)
+
+    def get(self, key):
+        slot = self._slots.get(key)
+        if slot is None:
+            return None
+        with self._file_lock(exclusive=False):
+            if self._holds_locked(slot, key):
+                return np.array(self._vectors[slot])
+        del self._slots[key]
+        return None
+
+    def put(self, key, vector):
+        """Store a vector in the next ring slot; returns True if an older entry was overwritten"""
+        with self._file_lock(exclusive=True):
+            slot = self._slots.get(key)
+            if slot is not None and self._holds_locked(slot, key):
+                return False
+
+            slot = int(self._header[0]) % self.capacity
+            overwritten = bool(self._used[slot])
+            if overwritten:
+                self._slots.pop(self._keys[slot].tobytes(), None)
+            self._header[0] = (slot + 1) % self.capacity
+            self._header[1] += 1
+
+            self._used[slot] = 0
+            self._vectors[slot] = vector
+            self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+            self._used[slot] = 1
+        self._slots[key] = slot
+        return overwritten
+
+    def flush(self):
+        for array in (self._vectors, self._keys, self._used, self._header):
+            array.flush()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of embeddings for one model: a bounded in-memory LRU, backed by an
+    optional memory-mapped store on disk. Entries are keyed by the model id and a hash of the
+    normalized text, so changing the model never returns a vector computed by another one.
+    """
+
+    def __init__(self, model_id, dimension, max_entries=10000, disk_dir=None, disk_capacity=100000):
+        self.model_id = model_id
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._disk = DiskEmbeddingStore(disk_dir, model_id, dimension, disk_capacity) if disk_dir else None
+        self._unflushed = 0
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "disk_overwrites": 0
+        }
+
+    def _remember_locked(self, key, vector):
+        """Add a vector to the LRU tier, evicting the least recently used entries (caller holds the lock)"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _lookup_locked(self, key):
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            return vector
+
+        if self._disk is not None:
+            vector = self._disk.get(key)
+            if vector is not None:
+                self._stats["disk_hits"] += 1
+                self._remember_locked(key, vector)
+                return vector
+
+        self._stats["misses"] += 1
+        return None
+
+    def get_or_compute(self, texts, compute_fn):
+        """
+        Return a float32 array with one vector per text. Only texts missing from both tiers
+        are passed (once each) to compute_fn, which must return their vectors in order.
+        """
+        texts = list(texts)
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        keys = [cache_key(self.model_id, text) for text in texts]
+
+        missing = OrderedDict()  # key -> positions in texts
+        with self._lock:
+            for position, key in enumerate(keys):
+                if key in missing:
+                    missing[key].append(position)
+                    continue
+                vector = self._lookup_locked(key)
+                if vector is None:
+                    missing[key] = [position]
+                else:
+                    vectors[position] = vector
+
+        if not missing:
+            return vectors
+
+        computed = compute_fn([texts[positions[0]] for positions in missing.values()])
+        computed = np.asarray(computed, dtype=np.float32)
+
+        with self._lock:
+            for (key, positions), vector in zip(missing.items(), computed):
+                vectors[positions] = vector
+                self._remember_locked(key, vector.copy())
+                if self._disk is not None:
+                    if self._disk.put(key, vector):
+                        self._stats["disk_overwrites"] += 1
+                    self._unflushed += 1
+            if self._disk is not None and self._unflushed >= 256:
+                self._disk.flush()
+                self._unflushed = 0
+
+        return vectors
+
+    def clear(self):
+        """Drop the in-memory tier (the disk tier is left as is)"""
+        with self._lock:
+            self._memory.clear()
+
+    def flush(self):
+        with self._lock:
+            if self._disk is not None:
+                self._disk.flush()
+                self._unflushed = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "model": self.model_id,
+                "memory_entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "disk_enabled": self._disk is not None,
+                "disk_entries": len(self._disk) if self._disk is not None else 0
+            })
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,188 @@
+import hashlib
+import os
+import threading
+import time
+import traceback
+
+import numpy as np
+
+# Name of the SentenceTransformer model used for every stored vector
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# Bump this whenever the text that gets embedded for a row changes shape,
+# so that every stored vector is treated as stale on the next re-index
+EMBEDDING_VERSION = 1
+
+
+class ModelRegistry:
+    """
+    Hold the process-wide SentenceTransformer. The model is loaded exactly once, either on
+    first use or by an explicit warm_up(); calling warm_up() before a pre-fork server forks
+    lets every worker share the weights copy-on-write instead of loading its own copy.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME, device=None):
+        self.model_name = model_name
+        self.device = device or os.getenv('EMBEDDING_DEVICE', 'cpu')
+        self._lock = threading.Lock()
+        self._model = None
+        self.load_seconds = None
+        self.loaded_in_pid = None
+
+    def is_loaded(self):
+        return self._model is not None
+
+    def get(self):
+        """Return the model, loading it on first use"""
+        model = self._model
+        if model is not None:
+            return model
+
+        with self._lock:
+            if self._model is None:
+                # Imported here so that importing the app does not pull in torch
+                from sentence_transformers import SentenceTransformer
+
+                print(f"Loading SentenceTransformer model {self.model_name} on {self.device}...")
+                started = time.perf_counter()
+                self._model = SentenceTransformer(self.model_name, device=self.device)
+                self.load_seconds = time.perf_counter() - started
+                self.loaded_in_pid = os.getpid()
+                print(f"Loaded {self.model_name} in {self.load_seconds:.2f}s")
+            return self._model
+
+    def warm_up(self):
+        """Load the model now (e.g. before forking workers) and return the load time in seconds"""
+        self.get()
+        return self.load_seconds
+
+    def release(self):
+        """Drop the model reference and free cached GPU memory"""
+        with self._lock:
+            if self._model is None:
+                return
+            self._model = None
+
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+        print("Cleaned up SentenceTransformer resources")
+
+    def stats(self):
+        return {
+            "model": self.model_name,
+            "device": self.device,
+            "loaded": self.is_loaded(),
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "loaded_in_pid": self.loaded_in_pid,
+            "current_pid": os.getpid()
+        }
+
+
+# Shared by every ClinicalRAG instance in the process
+model_registry = ModelRegistry()
+
+
+def embedding_fingerprint():
+    """Identify the model and text layout that produced a stored embedding"""
+    return f"{EMBEDDING_MODEL_NAME}:v{EMBEDDING_VERSION}"
+
+
+def content_hash(text):
+    """Hash the whitespace-normalized text that an embedding was computed from"""
+    normalized = " ".join(str(text or "").split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def exercise_embedding_text(exercise):
+    """Build the text that is embedded for an exercise recommendation"""
+    return f"{exercise['exercise_name']} {exercise['description']} {exercise['benefits']}"
+
+
+def guideline_embedding_text(guideline):
+    """Build the text that is embedded for a clinical guideline"""
+    return guideline["guideline_text"]
+
+
+def encode_texts(model, texts, batch_size=64):
+    """
+    Encode many texts with as few model calls as possible. Texts are sorted by length so
+    each padded batch holds similarly sized inputs, then the vectors are scattered back
+    into input order. Returns a float32 array with one normalized row per text.
+    """
+    texts = [str(text or "") for text in texts]
+    if not texts:
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    vectors = None
+    for start in range(0, len(order), batch_size):
+        positions = order[start:start + batch_size]
+        encoded = model.encode(
+            [texts[i] for i in positions],
+            batch_size=len(positions),
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        )
+        if vectors is None:
+            vectors = np.empty((len(texts), encoded.shape[1]), dtype=np.float32)
+        vectors[positions] = encoded
+    return vectors
+
+
+class ReindexJob:
+    """Run an embedding re-index on a background thread and keep track of its progress"""
+
+    def __init__(self, reindex_fn):
+        self.reindex_fn = reindex_fn
+        self._lock = threading.Lock()
+        self._thread = None
+        self._status = self._new_status("idle")
+
+    def _new_status(self, state):
+        return {
+            "state": state,
+            "started_at": time.time() if state == "running" else None,
+            "finished_at": None,
+            "result": None,
+            "error": None
+        }
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, **kwargs):
+        """Start the job in the background; returns False if a run is already in progress"""
+        with self._lock:
+            if self.is_running():
+                return False
+
+            self._status = self._new_status("running")
+            self._thread = threading.Thread(target=self._run, kwargs=kwargs, daemon=True)
+            self._thread.start()
+            return True
+
+    def run(self, **kwargs):
+        """Run the job in the calling thread and return its final status"""
+        self._status = self._new_status("running")
+        self._run(**kwargs)
+        return self.status()
+
+    def _run(self, **kwargs):
+        try:
+            result = self.reindex_fn(**kwargs)
+            self._status["result"] = result
+            self._status["state"] = "completed"
+        except Exception as e:
+            print(f"Error during embedding re-index: {e}")
+            traceback.print_exc()
+            self._status["error"] = str(e)
+            self._status["state"] = "failed"
+        finally:
+            self._status["finished_at"] = time.time()
+
+    def status(self):
+        return dict(self._status)
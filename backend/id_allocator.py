@@ -0,0 +1,111 @@
+import threading
+
+
+class IdAllocator:
+    """
+    Hand out primary keys from blocks reserved in a sequences table (created by the migrations).
+    Reserving a block reads the table's counter and advances it with a conditional UPDATE that
+    only succeeds if the counter is unchanged, retrying otherwise, so concurrent reservations
+    (across processes too) never overlap regardless of the connection's autocommit mode. It runs
+    on a connection of its own, so callers must not hold a pooled connection while asking for ids.
+    Ids within a block are then handed out from memory; ids of a block that is never fully used
+    are skipped, never reused.
+    """
+
+    def __init__(self, connection_factory, sequences_table, block_size=50, max_attempts=20):
+        self.connection_factory = connection_factory
+        self.sequences_table = sequences_table
+        self.block_size = block_size
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._table_locks = {}
+        self._blocks = {}  # table -> [next id, end (exclusive)]
+        self.reservations = 0
+
+    def _table_lock(self, table):
+        with self._lock:
+            return self._table_locks.setdefault(table, threading.Lock())
+
+    def _reserve(self, table, count):
+        """Reserve count consecutive ids for a table; returns (first, end)"""
+        with self.connection_factory() as conn:
+            cursor = conn.cursor()
+            try:
+                for _ in range(self.max_attempts):
+                    cursor.execute(f"SELECT next_id FROM {self.sequences_table} WHERE table_name = ?", (table,))
+                    row = cursor.fetchone()
+                    if row:
+                        # Claim [first, first + count) only if no other writer moved the counter since
+                        # the read; the conditional UPDATE is atomic whether or not autocommit is on
+                        first = int(row[0])
+                        cursor.execute(
+                            f"UPDATE {self.sequences_table} SET next_id = ? WHERE table_name = ? AND next_id = ?",
+                            (first + count, table, first)
+                        )
+                        if cursor.rowcount == 1:
+                            conn.commit()
+                            break
+                        conn.rollback()
+                        continue
+
+                    # First reservation for this table: continue after the highest existing id
+                    cursor.execute(f"SELECT MAX(id) FROM {table}")
+                    max_id = cursor.fetchone()[0]
+                    first = 1 if max_id is None else int(max_id) + 1
+                    try:
+                        cursor.execute(
+                            f"INSERT INTO {self.sequences_table} (table_name, next_id) VALUES (?, ?)",
+                            (table, first + count)
+                        )
+                        conn.commit()
+                        break
+                    except Exception:
+                        # Another writer created the row first; reserve through it instead
+                        conn.rollback()
+                else:
+                    raise RuntimeError(f"Could not reserve ids for {table}")
+            finally:
+                cursor.close()
+
+        with self._lock:
+            self.reservations += 1
+        return first, first + count
+
+    def allocate(self, table, count=1):
+        """Return a list of count unused ids for a table"""
+        ids = []
+        with self._table_lock(table):
+            block = self._blocks.get(table)
+            while len(ids) < count:
+                if block is None or block[0] >= block[1]:
+                    first, end = self._reserve(table, max(self.block_size, count - len(ids)))
+                    block = self._blocks[table] = [first, end]
+                take = min(count - len(ids), block[1] - block[0])
+                ids.extend(range(block[0], block[0] + take))
+                block[0] += take
+        return ids
+
+    def next_id(self, table):
+        return self.allocate(table, 1)[0]
+
+    def reset(self, cursor, tables=None):
+        """
+        Forget reserved blocks (e.g. after tables are recreated or seeded with explicit ids) so the
+        next reservation continues from the table's highest id. Other processes keep the blocks
+        they already hold until they are used up.
+        """
+        with self._lock:
+            self._blocks.clear()
+        if tables is None:
+            cursor.execute(f"DELETE FROM {self.sequences_table}")
+        else:
+            for table in tables:
+                cursor.execute(f"DELETE FROM {self.sequences_table} WHERE table_name = ?", (table,))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "block_size": self.block_size,
+                "reservations": self.reservations,
+                "remaining": {table: block[1] - block[0] for table, block in self._blocks.items()}
+            }
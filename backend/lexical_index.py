@@ -0,0 +1,167 @@
+import math
+import re
+import threading
+from collections import Counter
+
+# Words too common to say anything about which guideline or exercise a query is after
+STOPWORDS = frozenset("""
+a about an and are as at be by can could do does for from has have how i in is it its me my
+of on or should than that the their them there these this to was what when where which who
+why will with would you your patient patients please tell give show find any some
+""".split())
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lowercase alphanumeric terms of a text, without stopwords"""
+    if not text:
+        return []
+    return [token for token in _TOKEN_PATTERN.findall(str(text).lower()) if token not in STOPWORDS]
+
+
+def reciprocal_rank_fusion(rankings, k=60, limit=None):
+    """
+    Fuse ranked id lists: each id scores the sum of 1 / (k + rank) over the lists it appears in.
+    Returns (id, fused score) pairs best first, ties broken by first appearance
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, row_id in enumerate(ranking, start=1):
+            scores[row_id] = scores.get(row_id, 0.0) + 1.0 / (k + rank)
+    fused = sorted(scores.items(), key=lambda item: -item[1])
+    return fused[:limit] if limit is not None else fused
+
+
+class LexicalIndex:
+    """
+    In-process BM25 inverted index over one table's text columns. Rows can carry scalar
+    attributes (e.g. condition) that searches filter on, like VectorIndex.
+    """
+
+    def __init__(self, name, attribute_names=(), k1=1.5, b=0.75):
+        self.name = name
+        self.attribute_names = tuple(attribute_names)
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._postings = {}
+        self._lengths = {}
+        self._terms = {}
+        self._attributes = {}
+        self._total_length = 0
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def __contains__(self, row_id):
+        return row_id in self._lengths
+
+    def load(self, rows):
+        """Replace the contents with (id, text, attributes) rows"""
+        with self._lock:
+            self._postings = {}
+            self._lengths = {}
+            self._terms = {}
+            self._attributes = {}
+            self._total_length = 0
+            for row_id, text, attributes in rows:
+                self._put(row_id, text, attributes)
+            self.loaded = True
+
+    def _put(self, row_id, text, attributes):
+        self._drop(row_id)
+        counts = Counter(tokenize(text))
+        for term, frequency in counts.items():
+            self._postings.setdefault(term, {})[row_id] = frequency
+        length = sum(counts.values())
+        self._lengths[row_id] = length
+        self._terms[row_id] = tuple(counts)
+        self._total_length += length
+        self._attributes[row_id] = {name: (attributes or {}).get(name) for name in self.attribute_names}
+
+    def _drop(self, row_id):
+        length = self._lengths.pop(row_id, None)
+        if length is None:
+            return False
+        self._total_length -= length
+        self._attributes.pop(row_id, None)
+        for term in self._terms.pop(row_id, ()):
+            del self._postings[term][row_id]
+            if not self._postings[term]:
+                del self._postings[term]
+        return True
+
+    def upsert(self, row_id, text, attributes=None):
+        """Insert or replace the text (and attributes) indexed for a row"""
+        with self._lock:
+            self._put(row_id, text, attributes)
+
+    def remove(self, row_id):
+        with self._lock:
+            return self._drop(row_id)
+
+    def document_frequency(self, term):
+        with self._lock:
+            return len(self._postings.get(term, ()))
+
+    def _matches(self, row_id, filters):
+        attributes = self._attributes[row_id]
+        for name, value in filters.items():
+            if isinstance(value, tuple):
+                if attributes.get(name) not in value:
+                    return False
+            elif attributes.get(name) != value:
+                return False
+        return True
+
+    def search(self, query, k, filters=None):
+        """
+        Return up to k (id, BM25 score) pairs for the rows sharing terms with the query, best first
+        (ties by id). filters maps attribute names to a required value or a tuple of allowed values
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            count = len(self._lengths)
+            if not terms or count == 0 or k <= 0:
+                return []
+
+            average_length = self._total_length / count or 1.0
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1.0 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for row_id, frequency in postings.items():
+                    norm = self.k1 * (1.0 - self.b + self.b * self._lengths[row_id] / average_length)
+                    scores[row_id] = scores.get(row_id, 0.0) + idf * frequency * (self.k1 + 1.0) / (frequency + norm)
+
+            if filters:
+                scores = {row_id: score for row_id, score in scores.items() if self._matches(row_id, filters)}
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": self.loaded,
+                "documents": len(self._lengths),
+                "terms": len(self._postings),
+                "average_length": round(self._total_length / len(self._lengths), 1) if self._lengths else 0.0
+            }
+
+
+def is_exact_term_query(query, indexes, max_terms=3):
+    """
+    Whether a query is a short lookup of catalog terms (e.g. "LSVT BIG", "DBS", "methotrexate"):
+    at most max_terms terms after stopwords, every one of them indexed in at least one of the
+    loaded indexes. Such queries can be answered lexically without embedding them
+    """
+    terms = tokenize(query)
+    if not terms or len(terms) > max_terms:
+        return False
+    loaded = [index for index in indexes if index is not None and index.loaded]
+    if not loaded:
+        return False
+    return all(any(index.document_frequency(term) for index in loaded) for term in terms)
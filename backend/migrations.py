@@ -0,0 +1,266 @@
+import time
+
+from patient_vectors import COMPOSITE_DIMENSION, EMBEDDING_DIMENSION
+
+# SQLCODEs IRIS returns when a DDL statement's target already exists:
+# -201 table or view name not unique, -306 column name not unique, -324 index name not unique
+ALREADY_EXISTS_SQLCODES = ("-201", "-306", "-324")
+
+
+def _already_exists(error):
+    message = str(error)
+    return any(f"<{code}>" in message for code in ALREADY_EXISTS_SQLCODES) or "already exist" in message.lower()
+
+
+def execute_ddl(cursor, sql):
+    """Run a DDL statement, treating "already exists" errors as success; returns True if it changed the schema"""
+    try:
+        cursor.execute(sql)
+        return True
+    except Exception as e:
+        if _already_exists(e):
+            return False
+        raise
+
+
+class MigrationRunner:
+    """
+    Versioned, idempotent schema migrations. Each migration has a number and is recorded in the
+    SchemaVersion table once it has run, so existing databases are upgraded in place by running
+    only the migrations they have not seen. Every statement tolerates its target already
+    existing, so a migration interrupted halfway can simply be run again.
+    """
+
+    def __init__(self, rag):
+        self.rag = rag
+        self.version_table = f"{rag.SCHEMA_NAME}.SchemaVersion"
+        self.migrations = [
+            (1, "Create base tables", self._create_base_tables),
+            (2, "Add embedding metadata and composite vector columns", self._add_embedding_metadata_columns),
+            (3, "Create id sequences table", self._create_id_sequences_table),
+            (4, "Add secondary indexes on filter and join columns", self._create_secondary_indexes),
+            (5, "Add HNSW indexes on vector columns", self._create_vector_indexes),
+            (6, "Create and populate the patient neighbor graph", self._create_patient_neighbors_table),
+        ]
+
+    def _ensure_version_table(self, cursor):
+        try:
+            cursor.execute(f"CREATE SCHEMA {self.rag.SCHEMA_NAME}")
+        except Exception:
+            # Schema might already exist
+            pass
+        execute_ddl(cursor, f"""
+            CREATE TABLE {self.version_table} (
+                version INTEGER PRIMARY KEY,
+                description VARCHAR(200),
+                applied_at VARCHAR(50)
+            )
+        """)
+
+    def applied_versions(self, cursor):
+        self._ensure_version_table(cursor)
+        cursor.execute(f"SELECT version FROM {self.version_table}")
+        return {int(row[0]) for row in cursor.fetchall()}
+
+    def migrate(self, conn):
+        """Apply every pending migration in order; returns a list of per-migration results"""
+        cursor = conn.cursor()
+        try:
+            applied = self.applied_versions(cursor)
+            conn.commit()
+
+            results = []
+            for version, description, migration in self.migrations:
+                if version in applied:
+                    continue
+                started = time.perf_counter()
+                recorded = migration(conn, cursor) is not False
+                if recorded:
+                    cursor.execute(
+                        f"INSERT INTO {self.version_table} (version, description, applied_at) VALUES (?, ?, ?)",
+                        (version, description, time.strftime("%Y-%m-%d %H:%M:%S"))
+                    )
+                conn.commit()
+                results.append({
+                    "version": version,
+                    "description": description,
+                    "applied": recorded,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+                })
+                print(f"Migration {version} ({description}): {'applied' if recorded else 'skipped'}")
+            return results
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def drop_all(self, conn):
+        """Drop every table the migrations manage, including the version history"""
+        cursor = conn.cursor()
+        try:
+            for table in (
+                self.rag.PATIENT_TABLE,
+                self.rag.GUIDELINES_TABLE,
+                self.rag.EXERCISES_TABLE,
+                self.rag.PATIENT_EXERCISES_TABLE,
+                self.rag.PATIENT_NEIGHBORS_TABLE,
+                self.rag.id_allocator.sequences_table,
+                self.version_table
+            ):
+                try:
+                    cursor.execute(f"DROP TABLE {table}")
+                except Exception:
+                    # Table might not exist yet
+                    pass
+            conn.commit()
+        finally:
+            cursor.close()
+
+    def status(self, conn):
+        cursor = conn.cursor()
+        try:
+            applied = self.applied_versions(cursor)
+            conn.commit()
+        finally:
+            cursor.close()
+        return {
+            "current_version": max(applied) if applied else 0,
+            "pending": [version for version, _, _ in self.migrations if version not in applied]
+        }
+
+    def _create_base_tables(self, conn, cursor):
+        rag = self.rag
+        execute_ddl(cursor, f"""
+            CREATE TABLE {rag.PATIENT_TABLE} (
+                id INTEGER PRIMARY KEY,
+                patient_id VARCHAR(50),
+                name VARCHAR(100),
+                age INTEGER,
+                gender VARCHAR(20),
+                condition VARCHAR(100),
+                medical_history VARCHAR(1000),
+                current_treatment VARCHAR(1000),
+                treatment_outcomes VARCHAR(1000),
+                progress_notes VARCHAR(2000),
+                assessment VARCHAR(2000),
+                adherence_rate INTEGER,
+                embedded_notes VECTOR(DOUBLE, {EMBEDDING_DIMENSION}),
+                embedded_history VECTOR(DOUBLE, {EMBEDDING_DIMENSION}),
+                embedded_treatment VECTOR(DOUBLE, {EMBEDDING_DIMENSION}),
+                embedded_demographics VECTOR(DOUBLE, {EMBEDDING_DIMENSION}),
+                embedded_outcomes VECTOR(DOUBLE, {EMBEDDING_DIMENSION}),
+                embedded_composite VECTOR(DOUBLE, {COMPOSITE_DIMENSION})
+            )
+        """)
+        execute_ddl(cursor, f"""
+            CREATE TABLE {rag.GUIDELINES_TABLE} (
+                id INTEGER PRIMARY KEY,
+                condition VARCHAR(100),
+                guideline_text VARCHAR(2000),
+                source VARCHAR(200),
+                embedded_text VECTOR(DOUBLE, {EMBEDDING_DIMENSION}),
+                embedding_model VARCHAR(100),
+                content_hash VARCHAR(64)
+            )
+        """)
+        execute_ddl(cursor, f"""
+            CREATE TABLE {rag.EXERCISES_TABLE} (
+                id INTEGER PRIMARY KEY,
+                condition VARCHAR(100),
+                severity VARCHAR(50),
+                exercise_name VARCHAR(100),
+                description VARCHAR(1000),
+                benefits VARCHAR(1000),
+                contraindications VARCHAR(500),
+                embedded_text VECTOR(DOUBLE, {EMBEDDING_DIMENSION}),
+                embedding_model VARCHAR(100),
+                content_hash VARCHAR(64)
+            )
+        """)
+        execute_ddl(cursor, f"""
+            CREATE TABLE {rag.PATIENT_EXERCISES_TABLE} (
+                id INTEGER PRIMARY KEY,
+                patient_id INTEGER,
+                exercise_id INTEGER,
+                assigned_date VARCHAR(50),
+                status VARCHAR(50),
+                notes VARCHAR(1000)
+            )
+        """)
+
+    def _add_embedding_metadata_columns(self, conn, cursor):
+        """Columns added after the first deployments; tables created by migration 1 already have them"""
+        rag = self.rag
+        for table in (rag.GUIDELINES_TABLE, rag.EXERCISES_TABLE):
+            for column_sql in ("embedding_model VARCHAR(100)", "content_hash VARCHAR(64)"):
+                execute_ddl(cursor, f"ALTER TABLE {table} ADD {column_sql}")
+        if execute_ddl(cursor, f"ALTER TABLE {rag.PATIENT_TABLE} ADD embedded_composite VECTOR(DOUBLE, {COMPOSITE_DIMENSION})"):
+            # Existing patients need the composite vector the similarity ranking reads
+            conn.commit()
+            rag._backfill_patient_composites(conn, cursor)
+
+    def _create_id_sequences_table(self, conn, cursor):
+        execute_ddl(cursor, f"""
+            CREATE TABLE {self.rag.id_allocator.sequences_table} (
+                table_name VARCHAR(128) PRIMARY KEY,
+                next_id BIGINT
+            )
+        """)
+
+    def secondary_indexes(self):
+        """(index name, table, column) of the indexes on the columns queries filter and join on"""
+        rag = self.rag
+        return (
+            ("PatientConditionIdx", rag.PATIENT_TABLE, "condition"),
+            ("PatientNameIdx", rag.PATIENT_TABLE, "name"),
+            ("GuidelineConditionIdx", rag.GUIDELINES_TABLE, "condition"),
+            ("ExerciseConditionIdx", rag.EXERCISES_TABLE, "condition"),
+            ("PatientExercisePatientIdx", rag.PATIENT_EXERCISES_TABLE, "patient_id"),
+            ("PatientExerciseExerciseIdx", rag.PATIENT_EXERCISES_TABLE, "exercise_id"),
+        )
+
+    def _create_secondary_indexes(self, conn, cursor):
+        for index_name, table, column in self.secondary_indexes():
+            execute_ddl(cursor, f"CREATE INDEX {index_name} ON TABLE {table} ({column})")
+
+    def _create_vector_indexes(self, conn, cursor):
+        """
+        Approximate nearest-neighbour indexes for the IRIS vector search fallback. HNSW needs
+        IRIS 2024.3 or later; on older versions the migration is left unrecorded, so it is
+        attempted again after an upgrade.
+        """
+        rag = self.rag
+        try:
+            for index_name, table, column in (
+                ("PatientCompositeHNSW", rag.PATIENT_TABLE, "embedded_composite"),
+                ("GuidelineTextHNSW", rag.GUIDELINES_TABLE, "embedded_text"),
+                ("ExerciseTextHNSW", rag.EXERCISES_TABLE, "embedded_text"),
+            ):
+                execute_ddl(
+                    cursor,
+                    f"CREATE INDEX {index_name} ON TABLE {table} ({column}) AS HNSW(Distance='DotProduct')"
+                )
+        except Exception as e:
+            conn.rollback()
+            print(f"HNSW indexes not created (requires IRIS 2024.3+): {e}")
+            return False
+
+    def _create_patient_neighbors_table(self, conn, cursor):
+        """Top-K neighbor lists with per-facet scores, filled from the existing patients"""
+        rag = self.rag
+        execute_ddl(cursor, f"""
+            CREATE TABLE {rag.PATIENT_NEIGHBORS_TABLE} (
+                patient_id INTEGER NOT NULL,
+                neighbor_id INTEGER NOT NULL,
+                score DOUBLE,
+                demographics_sim DOUBLE,
+                history_sim DOUBLE,
+                treatment_sim DOUBLE,
+                outcomes_sim DOUBLE,
+                PRIMARY KEY (patient_id, neighbor_id)
+            )
+        """)
+        execute_ddl(cursor, f"CREATE INDEX PatientNeighborNeighborIdx ON TABLE {rag.PATIENT_NEIGHBORS_TABLE} (neighbor_id)")
+        conn.commit()
+        rag.patient_neighbors.rebuild(cursor)
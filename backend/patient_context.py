@@ -0,0 +1,145 @@
+from dataclasses import asdict, dataclass, field
+
+# Condition-scoped exercises and guidelines attached to each patient context
+EXERCISES_PER_CONDITION = 5
+GUIDELINES_PER_CONDITION = 3
+
+PATIENT_COLUMNS = (
+    "id", "patient_id", "name", "age", "gender", "condition", "medical_history",
+    "current_treatment", "progress_notes", "assessment", "treatment_outcomes"
+)
+
+# Columns the patient list endpoint can project (everything except the embedding vectors)
+PATIENT_LIST_COLUMNS = PATIENT_COLUMNS + ("adherence_rate",)
+
+# IRIS limits the number of parameters in one statement, so large id lists are split
+MAX_IDS_PER_QUERY = 500
+
+
+@dataclass
+class PatientContext:
+    """A patient row plus the exercises and guidelines for the patient's condition"""
+    id: int
+    patient_id: str
+    name: str
+    age: int
+    gender: str
+    condition: str
+    medical_history: str
+    current_treatment: str
+    progress_notes: str
+    assessment: str
+    treatment_outcomes: str
+    recommended_exercises: list = field(default_factory=list)
+    relevant_guidelines: list = field(default_factory=list)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class PatientContextLoader:
+    """
+    Load patient contexts with a fixed number of queries, however many patients are requested:
+    one for the patient rows, one for the exercises and one for the guidelines of all their conditions.
+    """
+
+    def __init__(self, patient_table, exercises_table, guidelines_table):
+        self.patient_table = patient_table
+        self.exercises_table = exercises_table
+        self.guidelines_table = guidelines_table
+
+    def _select_in(self, cursor, sql_template, values):
+        """Run a SELECT with an IN (...) list, splitting long lists into several statements"""
+        rows = []
+        values = list(values)
+        for start in range(0, len(values), MAX_IDS_PER_QUERY):
+            chunk = values[start:start + MAX_IDS_PER_QUERY]
+            placeholders = ", ".join("?" for _ in chunk)
+            cursor.execute(sql_template.format(placeholders=placeholders), chunk)
+            rows.extend(cursor.fetchall())
+        return rows
+
+    def load(self, cursor, patient_ids):
+        """Return a dict of patient id -> PatientContext for the ids that exist"""
+        patient_ids = list(dict.fromkeys(patient_ids))
+        if not patient_ids:
+            return {}
+
+        rows = self._select_in(
+            cursor,
+            f"SELECT {', '.join(PATIENT_COLUMNS)} FROM {self.patient_table} WHERE id IN ({{placeholders}})",
+            patient_ids
+        )
+        contexts = {row[0]: PatientContext(*tuple(row)) for row in rows}
+        self._attach_condition_data(cursor, contexts.values())
+        return contexts
+
+    def load_one(self, cursor, patient_id):
+        return self.load(cursor, [patient_id]).get(patient_id)
+
+    def load_by_name(self, cursor, patient_name):
+        """Return the context of the first patient whose name contains patient_name, or None"""
+        cursor.execute(
+            f"SELECT TOP 1 {', '.join(PATIENT_COLUMNS)} FROM {self.patient_table} WHERE name LIKE ?",
+            (f"%{patient_name}%",)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+
+        context = PatientContext(*tuple(row))
+        self._attach_condition_data(cursor, [context])
+        return context
+
+    def _attach_condition_data(self, cursor, contexts):
+        """Fill in the exercises and guidelines for every distinct condition in one query each"""
+        contexts = list(contexts)
+        conditions = list(dict.fromkeys(context.condition for context in contexts if context.condition))
+        if not conditions:
+            return
+
+        exercises_by_condition = {}
+        for row in self._select_in(
+            cursor,
+            f"""
+            SELECT id, condition, exercise_name, description, benefits, contraindications, severity
+            FROM {self.exercises_table}
+            WHERE condition IN ({{placeholders}})
+            ORDER BY condition, id
+            """,
+            conditions
+        ):
+            exercises = exercises_by_condition.setdefault(row[1], [])
+            if len(exercises) < EXERCISES_PER_CONDITION:
+                exercises.append({
+                    "id": row[0],
+                    "name": row[2],
+                    "description": row[3],
+                    "benefits": row[4],
+                    "contraindications": row[5],
+                    "severity": row[6]
+                })
+
+        guidelines_by_condition = {}
+        for row in self._select_in(
+            cursor,
+            f"""
+            SELECT id, condition, guideline_text, source
+            FROM {self.guidelines_table}
+            WHERE condition IN ({{placeholders}})
+            ORDER BY condition, id
+            """,
+            conditions
+        ):
+            guidelines = guidelines_by_condition.setdefault(row[1], [])
+            if len(guidelines) < GUIDELINES_PER_CONDITION:
+                guidelines.append({
+                    "id": row[0],
+                    "text": row[2],
+                    "source": row[3],
+                    "condition": row[1]
+                })
+
+        for context in contexts:
+            context.recommended_exercises = list(exercises_by_condition.get(context.condition, []))
+            context.relevant_guidelines = list(guidelines_by_condition.get(context.condition, []))
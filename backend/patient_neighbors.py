@@ -0,0 +1,274 @@
+import threading
+
+from patient_vectors import SIMILARITY_WEIGHTS
+from retrieval_filters import normalize_similarity_constraints
+
+FACETS = [facet for facet, _ in SIMILARITY_WEIGHTS]
+FACET_SCORE_COLUMNS = [f"{facet}_sim" for facet in FACETS]
+
+# IRIS limits the number of parameters in one statement, so long id lists are split
+MAX_IDS_PER_QUERY = 500
+
+
+class PatientNeighborGraph:
+    """
+    Materialized top-K most similar patients of every patient, with the composite and per-facet
+    scores, kept in the PatientNeighbors table so similar-patient reads are an indexed lookup.
+    Writes maintain it incrementally: the changed patient's own list is recomputed, and the
+    patient is inserted into, rescored in or removed from other patients' lists. Another list is
+    only recomputed from scratch when the patient drops to its bottom (or leaves it) and a patient
+    outside the list could take its place. Methods take a cursor; the caller commits.
+    """
+
+    def __init__(self, rag, table, k=10):
+        self.rag = rag
+        self.table = table
+        self.k = k
+        self._lock = threading.RLock()
+        self._stats = {
+            "lookups": 0,
+            "hits": 0,
+            "fallbacks": 0,
+            "refreshes": 0,
+            "removals": 0,
+            "lists_recomputed": 0,
+            "rebuilds": 0
+        }
+
+    @property
+    def enabled(self):
+        return self.k > 0
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _select_in(self, cursor, sql_template, values):
+        rows = []
+        values = list(values)
+        for start in range(0, len(values), MAX_IDS_PER_QUERY):
+            chunk = values[start:start + MAX_IDS_PER_QUERY]
+            cursor.execute(sql_template.format(placeholders=", ".join("?" for _ in chunk)), chunk)
+            rows.extend(cursor.fetchall())
+        return rows
+
+    def lookup(self, cursor, patient_id, count, constraints=None, after=None):
+        """
+        Return up to count (id, score, facet_scores) neighbors satisfying the constraints, in
+        ranking order after the (id, score) pair in after, or None when the stored list cannot
+        answer exactly (not built yet, or too few qualifying neighbors among the top K)
+        """
+        if not self.enabled:
+            return None
+        self._count("lookups")
+        constraints = normalize_similarity_constraints(constraints)
+
+        cursor.execute(
+            f"""
+            SELECT n.neighbor_id, n.score, {', '.join('n.' + column for column in FACET_SCORE_COLUMNS)},
+                p.condition, p.age, p.gender, t.condition
+            FROM {self.table} n
+            JOIN {self.rag.PATIENT_TABLE} p ON p.id = n.neighbor_id
+            JOIN {self.rag.PATIENT_TABLE} t ON t.id = n.patient_id
+            WHERE n.patient_id = ?
+            ORDER BY n.score DESC, n.neighbor_id
+            """,
+            (patient_id,)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            self._count("fallbacks")
+            return None
+
+        # A list shorter than K holds every other patient, so filtering it is always exact
+        complete = len(rows) < self.k
+        facet_end = 2 + len(FACETS)
+        condition = constraints.get("condition")
+        if condition is None and constraints.get("same_condition"):
+            condition = rows[0][facet_end + 3]
+
+        neighbors = []
+        for row in rows:
+            row_id, score = row[0], float(row[1])
+            neighbor_condition, age, gender = row[facet_end:facet_end + 3]
+            if after is not None and not (score < after[1] or (score == after[1] and row_id > after[0])):
+                continue
+            if condition is not None and neighbor_condition != condition:
+                continue
+            if "gender" in constraints and gender != constraints["gender"]:
+                continue
+            if "min_age" in constraints and (age is None or age < constraints["min_age"]):
+                continue
+            if "max_age" in constraints and (age is None or age > constraints["max_age"]):
+                continue
+            if "min_score" in constraints and score < constraints["min_score"]:
+                continue
+            facet_scores = {
+                facet: round(float(value), 4) if value is not None else 0.0
+                for facet, value in zip(FACETS, row[2:facet_end])
+            }
+            neighbors.append((row_id, score, facet_scores))
+            if len(neighbors) == count:
+                break
+
+        # Qualifying patients outside the top K all score below every stored neighbor,
+        # so a full page from the stored list is the exact answer
+        if len(neighbors) == count or complete:
+            self._count("hits")
+            return neighbors
+        self._count("fallbacks")
+        return None
+
+    def _all_scores(self, cursor, patient_id):
+        """Composite scores of every other patient against one patient, best first"""
+        cursor.execute(f"SELECT COUNT(*) FROM {self.rag.PATIENT_TABLE}")
+        total = int(cursor.fetchone()[0])
+        return self.rag._rank_similar_patients(cursor, patient_id, max(1, total))
+
+    def _insert_rows(self, cursor, patient_id, ranked, facet_scores):
+        for neighbor_id, score in ranked:
+            facets = facet_scores.get(neighbor_id, {})
+            cursor.execute(
+                f"""
+                INSERT INTO {self.table} (patient_id, neighbor_id, score, {', '.join(FACET_SCORE_COLUMNS)})
+                VALUES (?, ?, ?, {', '.join('?' for _ in FACETS)})
+                """,
+                [patient_id, neighbor_id, score] + [facets.get(facet, 0.0) for facet in FACETS]
+            )
+
+    def _recompute_list(self, cursor, patient_id):
+        """Replace a patient's stored list with its current top K"""
+        ranked = self.rag._rank_similar_patients(cursor, patient_id, self.k)
+        facet_scores = self.rag._facet_scores(cursor, patient_id, [row_id for row_id, _ in ranked])
+        cursor.execute(f"DELETE FROM {self.table} WHERE patient_id = ?", (patient_id,))
+        self._insert_rows(cursor, patient_id, ranked, facet_scores)
+        self._count("lists_recomputed")
+
+    def _stored_lists(self, cursor, patient_ids):
+        """patient id -> [(neighbor id, score)] of the stored lists of the given patients"""
+        lists = {patient_id: [] for patient_id in patient_ids}
+        for row in self._select_in(
+            cursor,
+            f"SELECT patient_id, neighbor_id, score FROM {self.table} WHERE patient_id IN ({{placeholders}})",
+            patient_ids
+        ):
+            lists[row[0]].append((row[1], float(row[2])))
+        return lists
+
+    def refresh(self, cursor, patient_id):
+        """Bring the graph up to date after a patient was added or its vectors changed"""
+        if not self.enabled:
+            return
+        with self._lock:
+            scores = self._all_scores(cursor, patient_id)
+            score_of = dict(scores)
+
+            # Patients whose lists hold this patient, and those whose lists it could enter:
+            # not yet full, or with a weakest neighbor scoring below this patient
+            cursor.execute(f"SELECT patient_id FROM {self.table} WHERE neighbor_id = ?", (patient_id,))
+            containing = {row[0] for row in cursor.fetchall()}
+            cursor.execute(
+                f"SELECT patient_id, COUNT(*), MIN(score) FROM {self.table} WHERE patient_id != ? GROUP BY patient_id",
+                (patient_id,)
+            )
+            listed = {row[0]: (int(row[1]), float(row[2])) for row in cursor.fetchall()}
+            candidates = set(containing)
+            for other_id, score in scores:
+                size, weakest = listed.get(other_id, (0, None))
+                if size < self.k or score > weakest:
+                    candidates.add(other_id)
+            lists = self._stored_lists(cursor, candidates)
+
+            to_recompute = []
+            to_update = []
+            to_insert = []
+            to_evict = []
+            for other_id in candidates:
+                score = score_of.get(other_id)
+                entries = [entry for entry in lists[other_id] if entry[0] != patient_id]
+                if score is None:
+                    # The other patient has no composite vector
+                    continue
+                if other_id not in listed:
+                    # No stored list yet (graph not built for it): adding just this patient
+                    # would look like a complete list, so compute the whole list instead
+                    to_recompute.append(other_id)
+                elif other_id in containing:
+                    # Still exact if the list had room, or this patient still beats every other
+                    # stored neighbor (and so every patient outside the list)
+                    if len(entries) + 1 < self.k or not entries or score >= min(s for _, s in entries):
+                        to_update.append((other_id, score))
+                    else:
+                        to_recompute.append(other_id)
+                elif len(entries) < self.k:
+                    to_insert.append((other_id, score))
+                else:
+                    weakest_id, weakest = min(entries, key=lambda entry: (entry[1], -entry[0]))
+                    if score > weakest:
+                        to_evict.append((other_id, weakest_id))
+                        to_insert.append((other_id, score))
+
+            own = scores[:self.k]
+            touched = {row_id for row_id, _ in own} | {other_id for other_id, _ in to_update + to_insert}
+            facet_scores = self.rag._facet_scores(cursor, patient_id, list(touched))
+
+            cursor.execute(f"DELETE FROM {self.table} WHERE patient_id = ?", (patient_id,))
+            self._insert_rows(cursor, patient_id, own, facet_scores)
+            for other_id, score in to_update:
+                facets = facet_scores.get(other_id, {})
+                cursor.execute(
+                    f"""
+                    UPDATE {self.table} SET score = ?, {', '.join(f'{column} = ?' for column in FACET_SCORE_COLUMNS)}
+                    WHERE patient_id = ? AND neighbor_id = ?
+                    """,
+                    [score] + [facets.get(facet, 0.0) for facet in FACETS] + [other_id, patient_id]
+                )
+            for other_id, weakest_id in to_evict:
+                cursor.execute(
+                    f"DELETE FROM {self.table} WHERE patient_id = ? AND neighbor_id = ?",
+                    (other_id, weakest_id)
+                )
+            for other_id, score in to_insert:
+                self._insert_rows(cursor, other_id, [(patient_id, score)], facet_scores)
+            for other_id in to_recompute:
+                self._recompute_list(cursor, other_id)
+            self._count("refreshes")
+
+    def remove(self, cursor, patient_id):
+        """Drop a deleted patient from the graph, refilling the full lists it leaves"""
+        if not self.enabled:
+            return
+        with self._lock:
+            cursor.execute(f"SELECT patient_id FROM {self.table} WHERE neighbor_id = ?", (patient_id,))
+            containing = [row[0] for row in cursor.fetchall()]
+            sizes = {other_id: len(entries) for other_id, entries in self._stored_lists(cursor, containing).items()}
+
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE patient_id = ? OR neighbor_id = ?",
+                (patient_id, patient_id)
+            )
+            # A full list had patients outside it, the best of which now moves in
+            for other_id in containing:
+                if sizes.get(other_id, 0) >= self.k:
+                    self._recompute_list(cursor, other_id)
+            self._count("removals")
+
+    def rebuild(self, cursor):
+        """Recompute every patient's list from scratch; returns the number of lists written"""
+        if not self.enabled:
+            return 0
+        with self._lock:
+            cursor.execute(f"SELECT id FROM {self.rag.PATIENT_TABLE} WHERE embedded_composite IS NOT NULL")
+            patient_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(f"DELETE FROM {self.table}")
+            for patient_id in patient_ids:
+                self._recompute_list(cursor, patient_id)
+            self._count("rebuilds")
+            return len(patient_ids)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["k"] = self.k
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else 0.0
+        return stats
@@ -0,0 +1,75 @@
+import numpy as np
+
+# Weights of each patient facet in the similar-patient score
+SIMILARITY_WEIGHTS = (
+    ("demographics", 0.3),
+    ("history", 0.3),
+    ("treatment", 0.2),
+    ("outcomes", 0.2)
+)
+
+# Column holding each facet's embedding
+FACET_COLUMNS = {
+    "demographics": "embedded_demographics",
+    "history": "embedded_history",
+    "treatment": "embedded_treatment",
+    "outcomes": "embedded_outcomes",
+    "notes": "embedded_notes"
+}
+
+# Patient fields each facet embedding is computed from
+FACET_SOURCE_FIELDS = {
+    "demographics": ("age", "gender", "condition"),
+    "history": ("medical_history",),
+    "treatment": ("current_treatment",),
+    "outcomes": ("treatment_outcomes", "assessment"),
+    "notes": ("medical_history", "current_treatment", "progress_notes", "assessment")
+}
+
+# Every vector column of the patient table
+PATIENT_EMBEDDING_COLUMNS = tuple(FACET_COLUMNS.values()) + ("embedded_composite",)
+
+EMBEDDING_DIMENSION = 384
+COMPOSITE_DIMENSION = EMBEDDING_DIMENSION * len(SIMILARITY_WEIGHTS)
+
+
+def patient_embedding_texts(patient):
+    """Build the text embedded for each patient facet"""
+    return {
+        "history": patient["medical_history"],
+        "treatment": patient["current_treatment"],
+        "demographics": f"Age {patient['age']} {patient.get('gender') or 'Unknown'} {patient['condition']}",
+        "outcomes": patient.get("treatment_outcomes") or patient["assessment"],
+        "notes": f"{patient['medical_history']} {patient['current_treatment']} {patient['progress_notes']} {patient['assessment']}"
+    }
+
+
+def facets_affected_by(changed_fields):
+    """Return the facets whose embedding text depends on any of the changed fields"""
+    changed = set(changed_fields)
+    return [facet for facet, fields in FACET_SOURCE_FIELDS.items() if changed.intersection(fields)]
+
+
+def compose_patient_vector(facet_vectors):
+    """
+    Concatenate the facet embeddings, each scaled by the square root of its weight, so that
+    the dot product of two composites equals the weighted sum of the per-facet dot products
+    """
+    parts = []
+    for facet, weight in SIMILARITY_WEIGHTS:
+        parts.append(np.sqrt(weight) * np.asarray(facet_vectors[facet], dtype=np.float64))
+    return np.concatenate(parts)
+
+
+def composite_facet_scores(target, neighbors):
+    """
+    Per-facet similarities recovered from composite vectors: each facet's segment dot product
+    divided by its weight. neighbors is one composite per row; returns {facet: array of scores}
+    """
+    target = np.asarray(target, dtype=np.float64).reshape(-1)
+    neighbors = np.asarray(neighbors, dtype=np.float64).reshape(-1, target.shape[0])
+    scores = {}
+    for position, (facet, weight) in enumerate(SIMILARITY_WEIGHTS):
+        segment = slice(position * EMBEDDING_DIMENSION, (position + 1) * EMBEDDING_DIMENSION)
+        scores[facet] = neighbors[:, segment] @ target[segment] / weight
+    return scores
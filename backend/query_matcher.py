@@ -0,0 +1,152 @@
+import json
+import re
+from dataclasses import dataclass, field
+
+# Phrases matched anywhere in a query (case-insensitive substrings), by label. Upper-case labels
+# are intents, picked in INTENT_PRIORITY order; the others are routing triggers
+PHRASE_TABLE = {
+    "SIMILAR_PATIENTS": ("similar patient", "similar patients", "patients like", "patient like"),
+    "INFORMATION": ("what is", "who is", "tell me about", "information"),
+    "RECOMMENDATION": ("recommend", "suggestion", "what should", "treatment"),
+    "EXERCISE": ("exercise",),
+    "GUIDELINE": ("guideline",),
+    "similar_patients_route": (
+        "similar patient", "similar patients", "patients like", "patient like",
+        "patients similar", "who are similar", "which patients"
+    ),
+    "based_on": ("based on",),
+    "treatment_recommendation_route": (
+        "based on similar patient", "based on similar patients",
+        "from similar patient", "from similar patients",
+        "like other patient", "like other patients"
+    ),
+}
+
+INTENT_PRIORITY = ("SIMILAR_PATIENTS", "INFORMATION", "RECOMMENDATION", "EXERCISE", "GUIDELINE")
+
+# A patient name is the one or two words after one of these words
+NAME_TRIGGERS = ("patient", "about", "to", "for", "like")
+_NAME_AFTER_TRIGGER = re.compile(r"\s+([A-Za-z]+(?:\s+[A-Za-z]+)?)", re.IGNORECASE)
+
+# Lowercases ASCII only, so positions in the lowered text are positions in the original
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+_NAME_LABEL = object()
+
+
+def _trie_pattern(words):
+    """
+    Regex alternation of the words factored into a prefix trie, so a position is rejected after
+    its first character; where one word extends another the longer match is tried first
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+@dataclass
+class QueryMatch:
+    """Everything the matcher found in one query"""
+    intent: str
+    labels: frozenset
+    name_spans: list = field(default_factory=list)
+
+    def has(self, label):
+        return label in self.labels
+
+    @property
+    def route(self):
+        """Handler for the query: similar_patients, treatment_recommendation or general"""
+        if self.has("similar_patients_route") and not self.has("based_on"):
+            return "similar_patients"
+        if self.has("treatment_recommendation_route"):
+            return "treatment_recommendation"
+        return "general"
+
+    @property
+    def patient_name(self):
+        """The first candidate patient name, or None"""
+        return self.name_spans[0][2] if self.name_spans else None
+
+
+class QueryMatcher:
+    """
+    Match every phrase of a phrase table, and the candidate patient names, in one regex pass over
+    the lowercased query. The phrases and name triggers form a single lookahead factored into a
+    prefix trie, so each position reports the longest phrase starting there; the labels of the
+    phrases that are its prefixes are merged into it up front, which keeps the result identical
+    to testing each phrase as a substring. Names are read from the original text after triggers.
+    """
+
+    def __init__(self, phrase_table=None, intent_priority=INTENT_PRIORITY):
+        self.phrase_table = {label: tuple(phrases) for label, phrases in (phrase_table or PHRASE_TABLE).items()}
+        self.intent_priority = tuple(intent_priority)
+
+        labels_by_phrase = {}
+        for label, phrases in self.phrase_table.items():
+            for phrase in phrases:
+                labels_by_phrase.setdefault(phrase.lower(), set()).add(label)
+        for trigger in NAME_TRIGGERS:
+            labels_by_phrase.setdefault(trigger, set()).add(_NAME_LABEL)
+
+        # Everything a match of each phrase implies: its prefixes' labels and the name trigger it starts with
+        self._labels = {}
+        self._trigger_length = {}
+        for phrase in labels_by_phrase:
+            labels = set()
+            for other, other_labels in labels_by_phrase.items():
+                if phrase.startswith(other):
+                    labels |= other_labels
+                    if _NAME_LABEL in other_labels:
+                        self._trigger_length[phrase] = len(other)
+            labels.discard(_NAME_LABEL)
+            self._labels[phrase] = frozenset(labels)
+
+        self._pattern = re.compile(f"(?=({_trie_pattern(labels_by_phrase)}))")
+
+    def match(self, query_text):
+        text = query_text or ""
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            lowered = text.translate(_ASCII_LOWER)
+
+        labels = set()
+        name_spans = []
+        for found in self._pattern.finditer(lowered):
+            phrase = found.group(1)
+            labels |= self._labels[phrase]
+            trigger_length = self._trigger_length.get(phrase)
+            if trigger_length is not None:
+                name = _NAME_AFTER_TRIGGER.match(text, found.start() + trigger_length)
+                if name:
+                    name_spans.append((name.start(1), name.end(1), name.group(1)))
+
+        intent = next((intent for intent in self.intent_priority if intent in labels), "GENERAL")
+        return QueryMatch(intent, frozenset(labels), name_spans)
+
+
+def load_phrase_table(path):
+    """
+    The default phrase table extended with a JSON file of {label: [phrases]}; phrases are added to
+    existing labels, and new upper-case labels become intents checked after the built-in ones
+    """
+    table = {label: list(phrases) for label, phrases in PHRASE_TABLE.items()}
+    with open(path) as f:
+        extra = json.load(f)
+    for label, phrases in extra.items():
+        table.setdefault(label, [])
+        table[label].extend(phrase for phrase in phrases if phrase not in table[label])
+    intents = INTENT_PRIORITY + tuple(label for label in extra if label.isupper() and label not in INTENT_PRIORITY)
+    return table, intents
@@ -0,0 +1,69 @@
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+
+class RetrievalExecutor:
+    """
+    Run independent retrieval stages concurrently on a shared thread pool.
+    Each stage gets a timeout measured from the start of the wave; a stage that times out or
+    fails is left out of the results so the answer can still be built from the others.
+    """
+
+    def __init__(self, max_workers=8, default_timeout=5.0):
+        self.default_timeout = default_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retrieval")
+        self._lock = threading.Lock()
+        self._stats = {"stages": 0, "timeouts": 0, "errors": 0}
+
+    def run(self, stages, timeouts=None):
+        """
+        Run a wave of stages, given as a dict of name -> zero-argument callable.
+        Returns (results, timings): results maps each successful stage to its return value,
+        timings maps every stage to its duration in milliseconds (None if it timed out)
+        """
+        timeouts = timeouts or {}
+        started = time.perf_counter()
+        durations = {}
+
+        def timed(name, fn):
+            stage_started = time.perf_counter()
+            try:
+                return fn()
+            finally:
+                durations[name] = round((time.perf_counter() - stage_started) * 1000, 1)
+
+        futures = {name: self._executor.submit(timed, name, fn) for name, fn in stages.items()}
+
+        results = {}
+        timings = {}
+        for name, future in futures.items():
+            deadline = started + timeouts.get(name, self.default_timeout)
+            try:
+                results[name] = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+                timings[name] = durations.get(name)
+            except FutureTimeoutError:
+                # The stage keeps running in the background; its result is discarded
+                print(f"Retrieval stage '{name}' timed out after {timeouts.get(name, self.default_timeout)}s")
+                timings[name] = None
+                self._count("timeouts")
+            except Exception as e:
+                print(f"Retrieval stage '{name}' failed: {e}")
+                traceback.print_exc()
+                timings[name] = durations.get(name)
+                self._count("errors")
+
+        self._count("stages", len(stages))
+        return results, timings
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,105 @@
+import base64
+
+# Columns each retrieval source can be filtered on
+FILTERABLE_COLUMNS = {
+    "guidelines": ("condition", "source"),
+    "exercises": ("condition", "severity"),
+}
+
+
+def normalize_filters(filters):
+    """
+    Turn retrieval filters given as a bare condition name or a dict into {column: value}, where a
+    value is a string or a tuple of strings (any of). Empty values are dropped
+    """
+    if not filters:
+        return {}
+    if isinstance(filters, str):
+        filters = {"condition": filters}
+
+    normalized = {}
+    for column, value in filters.items():
+        if isinstance(value, (list, tuple, set)):
+            values = tuple(dict.fromkeys(str(item) for item in value if item not in (None, "")))
+            if values:
+                normalized[column] = values[0] if len(values) == 1 else values
+        elif value not in (None, ""):
+            normalized[column] = str(value)
+    return normalized
+
+
+def filters_for(source, filters):
+    """The subset of normalized filters that apply to a retrieval source"""
+    allowed = FILTERABLE_COLUMNS[source]
+    return {column: value for column, value in filters.items() if column in allowed}
+
+
+def build_where_clause(filters):
+    """
+    Return (sql, params) for a parameterized WHERE clause matching every filter, or ("", [])
+    when there are none. Column names come from FILTERABLE_COLUMNS, never from the values
+    """
+    clauses = []
+    params = []
+    for column, value in filters.items():
+        if isinstance(value, tuple):
+            clauses.append(f"{column} IN ({', '.join('?' for _ in value)})")
+            params.extend(value)
+        else:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    if not clauses:
+        return "", []
+    return "WHERE " + " AND ".join(clauses), params
+
+
+def index_filters(filters, attribute_names):
+    """
+    The filters as equality filters for VectorIndex.search, or None when a filter needs SQL
+    (a column the index does not carry, or a list of values)
+    """
+    if any(column not in attribute_names or isinstance(value, tuple) for column, value in filters.items()):
+        return None
+    return dict(filters)
+
+
+# Constraints the similar-patient search can push down into SQL or the in-memory index
+SIMILAR_PATIENT_CONSTRAINTS = ("condition", "same_condition", "gender", "min_age", "max_age", "min_score")
+
+
+def normalize_similarity_constraints(constraints):
+    """
+    Validate similar-patient constraints: condition and gender as strings, same_condition as a flag
+    (match the target patient's condition), min_age/max_age as integers and min_score as a float.
+    Raises ValueError for unknown constraints or values of the wrong type
+    """
+    normalized = {}
+    for name, value in (constraints or {}).items():
+        if name not in SIMILAR_PATIENT_CONSTRAINTS:
+            raise ValueError(f"Unknown similarity constraint: {name}")
+        if value is None or value == "":
+            continue
+        if name in ("condition", "gender"):
+            normalized[name] = str(value)
+        elif name == "same_condition":
+            if value is True or str(value).lower() in ("1", "true", "yes"):
+                normalized[name] = True
+        elif name in ("min_age", "max_age"):
+            normalized[name] = int(value)
+        else:
+            normalized[name] = float(value)
+    return normalized
+
+
+def encode_similarity_cursor(row_id, score):
+    """Opaque cursor for resuming a similarity ranking after the (id, score) row"""
+    return base64.urlsafe_b64encode(f"{int(row_id)}:{float(score).hex()}".encode("ascii")).decode("ascii")
+
+
+def decode_similarity_cursor(cursor):
+    """Return the (id, score) pair encoded in a cursor; raises ValueError for malformed cursors"""
+    try:
+        row_id, score = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("ascii").split(":")
+        return int(row_id), float.fromhex(score)
+    except Exception:
+        raise ValueError("Invalid cursor")
@@ -0,0 +1,113 @@
+import threading
+from dataclasses import dataclass, field
+
+STAGES = ("patient", "neighbors", "embedding", "guidelines", "exercises")
+
+# Context each intent's prompt uses. The patient is looked up for every intent when one is given
+# or named; neighbors, guidelines and exercises only where the instructions draw on them
+INTENT_STAGES = {
+    "SIMILAR_PATIENTS": ("patient", "neighbors"),
+    "INFORMATION": ("patient",),
+    "RECOMMENDATION": ("patient", "neighbors", "guidelines", "exercises"),
+    "EXERCISE": ("patient", "guidelines", "exercises"),
+    "GUIDELINE": ("patient", "guidelines"),
+    "GENERAL": ("patient",),
+}
+
+
+@dataclass
+class RetrievalPlan:
+    """The retrieval stages one query runs, and why each of the others is skipped"""
+    intent: str
+    stages: frozenset
+    skipped: dict = field(default_factory=dict)
+
+    def runs(self, stage):
+        return stage in self.stages
+
+    def describe(self, timings=None):
+        """One log line: each stage with its duration in ms, or why it was skipped"""
+        timings = timings or {}
+        parts = []
+        for stage in STAGES:
+            if stage in self.stages:
+                duration = timings.get(stage)
+                parts.append(f"{stage}={duration}ms" if duration is not None else f"{stage}=not run")
+            else:
+                parts.append(f"{stage}=skipped ({self.skipped.get(stage, 'not needed')})")
+        return f"{self.intent}: " + ", ".join(parts)
+
+
+class RetrievalPlanner:
+    """
+    Decide which retrieval stages a general query needs from its intent, so stages whose results
+    the prompt would not use never run. With the planner disabled every stage runs as before
+    (neighbors whenever a patient is known, the embedding always), which the benchmark compares against.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def plan(self, intent, labels, has_patient, lexical_only=False, semantic_cache=False):
+        """
+        Build the plan for a query. labels are the phrase labels the query matched (see
+        query_matcher); has_patient says whether a patient id was given or a name found in the
+        query; lexical_only marks queries answered from the keyword indexes alone;
+        semantic_cache says whether answers are also looked up by query embedding
+        """
+        if self.enabled:
+            stages = set(INTENT_STAGES.get(intent, INTENT_STAGES["GENERAL"]))
+        else:
+            stages = {"patient", "neighbors", "embedding"}
+            if intent in ("RECOMMENDATION", "EXERCISE", "GUIDELINE"):
+                stages.add("guidelines")
+            if intent in ("RECOMMENDATION", "EXERCISE"):
+                stages.add("exercises")
+
+        # Asking for guidelines or exercises by name retrieves them whatever the intent
+        if "GUIDELINE" in labels:
+            stages.add("guidelines")
+        if "EXERCISE" in labels:
+            stages.add("exercises")
+        if lexical_only:
+            stages.update(("guidelines", "exercises"))
+
+        skipped = {}
+        if not has_patient:
+            stages -= {"patient", "neighbors"}
+            skipped["patient"] = skipped["neighbors"] = "no patient in the query"
+        if lexical_only:
+            stages.discard("embedding")
+            skipped["embedding"] = "exact-term query answered lexically"
+        elif stages & {"guidelines", "exercises"} or semantic_cache:
+            stages.add("embedding")
+        elif "embedding" not in stages:
+            skipped["embedding"] = "no vector retrieval or semantic cache"
+        for stage in STAGES:
+            if stage not in stages:
+                skipped.setdefault(stage, f"not used by {intent} prompts")
+
+        plan = RetrievalPlan(intent, frozenset(stages), skipped)
+        self._record(plan)
+        return plan
+
+    def _record(self, plan):
+        with self._lock:
+            stats = self._stats.setdefault(plan.intent, {"queries": 0, "skipped": dict.fromkeys(STAGES, 0)})
+            stats["queries"] += 1
+            for stage in STAGES:
+                if stage not in plan.stages:
+                    stats["skipped"][stage] += 1
+
+    def stats(self):
+        """Per intent: queries planned and how often each stage was skipped"""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "intents": {
+                    intent: {"queries": stats["queries"], "skipped": dict(stats["skipped"])}
+                    for intent, stats in self._stats.items()
+                }
+            }
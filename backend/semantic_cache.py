@@ -0,0 +1,135 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Cache of LLM answers looked up by query meaning rather than exact text. Entries are grouped
+    by (intent, patient id, evidence key), the evidence key being a fingerprint of the retrieved
+    context the answer was built from; a new query reuses the answer of the most similar cached
+    query in its group when the cosine similarity of their embeddings reaches the threshold, so a
+    paraphrase only ever gets an answer built from the same patient, guidelines and exercises.
+    Entries carry the same entity tags as the exact-match answer cache, for invalidation.
+    """
+
+    def __init__(self, threshold=0.9, max_entries=500, ttl_seconds=600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._entries = OrderedDict()  # entry id -> entry dict
+        self._groups = {}  # (intent, patient_id, evidence_key) -> [entry ids]
+        self._stats = {
+            "lookups": 0,
+            "hits": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "saved_llm_seconds": 0.0,
+            "hit_similarity_total": 0.0
+        }
+
+    def _drop_locked(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        group = self._groups.get(entry["group"])
+        if group is not None:
+            group.remove(entry_id)
+            if not group:
+                del self._groups[entry["group"]]
+
+    def lookup(self, query_embedding, intent, patient_id, evidence_key):
+        """Return (answer, similarity) for the closest cached query in the group, or None"""
+        if query_embedding is None or self.max_entries <= 0:
+            return None
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return None
+        query = query / norm
+
+        with self._lock:
+            self._stats["lookups"] += 1
+            now = time.monotonic()
+            group_ids = list(self._groups.get((intent, patient_id, evidence_key), ()))
+            live_ids = []
+            for entry_id in group_ids:
+                if self._entries[entry_id]["expires_at"] <= now:
+                    self._drop_locked(entry_id)
+                else:
+                    live_ids.append(entry_id)
+            if not live_ids:
+                return None
+
+            matrix = np.stack([self._entries[entry_id]["vector"] for entry_id in live_ids])
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                return None
+
+            entry_id = live_ids[best]
+            entry = self._entries[entry_id]
+            self._entries.move_to_end(entry_id)
+            self._stats["hits"] += 1
+            self._stats["saved_llm_seconds"] += entry["llm_seconds"]
+            self._stats["hit_similarity_total"] += similarity
+            return entry["answer"], similarity
+
+    def put(self, query_embedding, intent, patient_id, evidence_key, answer, tags=(), llm_seconds=0.0):
+        """Remember an answer together with the embedding of the query it answered and the LLM time it took"""
+        if query_embedding is None or self.max_entries <= 0:
+            return
+        vector = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return
+
+        with self._lock:
+            entry_id = next(self._ids)
+            group = (intent, patient_id, evidence_key)
+            self._entries[entry_id] = {
+                "vector": vector / norm,
+                "answer": answer,
+                "tags": frozenset(tags),
+                "group": group,
+                "llm_seconds": llm_seconds,
+                "expires_at": time.monotonic() + self.ttl_seconds
+            }
+            self._groups.setdefault(group, []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._drop_locked(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def invalidate(self, *tags):
+        """Drop every answer built from any of the tagged entities; returns how many were dropped"""
+        tags = set(tags)
+        with self._lock:
+            stale = [entry_id for entry_id, entry in self._entries.items() if entry["tags"] & tags]
+            for entry_id in stale:
+                self._drop_locked(entry_id)
+            self._stats["invalidations"] += len(stale)
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+            self._groups.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold
+            })
+        similarity_total = stats.pop("hit_similarity_total")
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else 0.0
+        stats["avg_hit_similarity"] = round(similarity_total / stats["hits"], 4) if stats["hits"] else None
+        stats["saved_llm_seconds"] = round(stats["saved_llm_seconds"], 3)
+        return stats
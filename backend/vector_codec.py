@@ -0,0 +1,46 @@
+import base64
+
+import numpy as np
+
+# Significant digits written per component: 9 is the fewest that round-trips every float32 exactly
+VECTOR_PRECISION = 9
+
+_formats = {}
+
+
+def _format_for(dimension):
+    fmt = _formats.get(dimension)
+    if fmt is None:
+        fmt = _formats[dimension] = ",".join([f"%.{VECTOR_PRECISION}g"] * dimension)
+    return fmt
+
+
+def to_vector_param(vector):
+    """
+    Serialize a vector for a TO_VECTOR(?) parameter. The IRIS driver only accepts vectors as
+    text, so this writes bare comma-separated components from one precompiled format string,
+    with enough digits that parsing them back gives the same float32 values; smaller than
+    str(list) and several times cheaper to produce
+    """
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    return _format_for(vector.shape[0]) % tuple(vector.tolist())
+
+
+def parse_vector(value):
+    """Convert a vector returned by the IRIS driver (string or sequence) into a float64 array"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        text = value.strip().strip("[]")
+        if not text.strip():
+            return np.empty(0, dtype=np.float64)
+        return np.array(text.split(","), dtype=np.float64)
+    return np.asarray(value, dtype=np.float64)
+
+
+def vector_to_base64(value):
+    """Encode a vector as base64 of its little-endian float32 bytes (4 bytes per dimension)"""
+    vector = parse_vector(value)
+    if vector is None:
+        return None
+    return base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
@@ -0,0 +1,207 @@
+import threading
+
+import numpy as np
+
+
+class VectorIndex:
+    """
+    In-memory mirror of one table's embedding column: a contiguous float32 matrix with
+    a parallel id array, searched with a single matrix-vector product.
+    Rows can carry scalar attributes (e.g. condition) that searches can filter on.
+    """
+
+    def __init__(self, name, dimension, attribute_names=(), initial_capacity=64):
+        self.name = name
+        self.dimension = dimension
+        self.attribute_names = tuple(attribute_names)
+        self._lock = threading.RLock()
+        self._size = 0
+        self._positions = {}
+        self._allocate(initial_capacity)
+        self.loaded = False
+
+    def _allocate(self, capacity):
+        self._matrix = np.zeros((capacity, self.dimension), dtype=np.float32)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._attributes = {name: np.empty(capacity, dtype=object) for name in self.attribute_names}
+
+    def _grow(self):
+        """Double the capacity, keeping existing rows (caller holds the lock)"""
+        old_matrix, old_ids, old_attributes = self._matrix, self._ids, self._attributes
+        self._allocate(max(1, len(old_ids)) * 2)
+        self._matrix[:self._size] = old_matrix[:self._size]
+        self._ids[:self._size] = old_ids[:self._size]
+        for name in self.attribute_names:
+            self._attributes[name][:self._size] = old_attributes[name][:self._size]
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, row_id):
+        return row_id in self._positions
+
+    def load(self, rows):
+        """Replace the contents with (id, vector, attributes) rows"""
+        rows = [row for row in rows if row[1] is not None]
+        with self._lock:
+            self._allocate(max(64, len(rows)))
+            self._positions = {}
+            self._size = 0
+            for row_id, vector, attributes in rows:
+                self._put(row_id, vector, attributes)
+            self.loaded = True
+
+    def _put(self, row_id, vector, attributes):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dimension:
+            raise ValueError(f"{self.name}: expected {self.dimension} dimensions, got {vector.shape[0]}")
+
+        position = self._positions.get(row_id)
+        if position is None:
+            if self._size == len(self._ids):
+                self._grow()
+            position = self._size
+            self._size += 1
+            self._positions[row_id] = position
+            self._ids[position] = row_id
+
+        self._matrix[position] = vector
+        for name in self.attribute_names:
+            if attributes and name in attributes:
+                self._attributes[name][position] = attributes[name]
+
+    def upsert(self, row_id, vector, attributes=None):
+        """Insert or replace the vector (and attributes) stored for a row"""
+        with self._lock:
+            self._put(row_id, vector, attributes)
+
+    def remove(self, row_id):
+        """Remove a row by moving the last row into its slot"""
+        with self._lock:
+            position = self._positions.pop(row_id, None)
+            if position is None:
+                return False
+
+            last = self._size - 1
+            if position != last:
+                moved_id = int(self._ids[last])
+                self._matrix[position] = self._matrix[last]
+                self._ids[position] = moved_id
+                for name in self.attribute_names:
+                    self._attributes[name][position] = self._attributes[name][last]
+                self._positions[moved_id] = position
+
+            for name in self.attribute_names:
+                self._attributes[name][last] = None
+            self._size = last
+            return True
+
+    def get(self, row_id):
+        """Return a copy of the stored vector for a row, or None"""
+        with self._lock:
+            position = self._positions.get(row_id)
+            if position is None:
+                return None
+            return self._matrix[position].copy()
+
+    def ids(self):
+        with self._lock:
+            return self._ids[:self._size].copy()
+
+    def get_attributes(self, row_id):
+        """Return the attributes stored for a row, or None"""
+        with self._lock:
+            position = self._positions.get(row_id)
+            if position is None:
+                return None
+            return {name: self._attributes[name][position] for name in self.attribute_names}
+
+    def search(self, query, k, exclude_ids=None, filters=None, ranges=None, min_score=None, after=None):
+        """
+        Return up to k (id, score) pairs ordered by descending dot product with the query, ties by id.
+        filters maps attribute names to required values, ranges maps numeric attribute names to
+        inclusive (low, high) bounds (None for open), min_score drops weaker matches and
+        after, an (id, score) pair previously returned, resumes the ranking after that row.
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        with self._lock:
+            if self._size == 0 or k <= 0:
+                return []
+
+            scores = self._matrix[:self._size] @ query
+            ids = self._ids[:self._size]
+
+            mask = None
+
+            def narrow(condition):
+                nonlocal mask
+                mask = condition if mask is None else mask & condition
+
+            for name, value in (filters or {}).items():
+                narrow(self._attributes[name][:self._size] == value)
+            for name, (low, high) in (ranges or {}).items():
+                values = self._attributes[name][:self._size]
+                present = values != None  # noqa: E711 - elementwise comparison on an object array
+                numeric = np.where(present, values, np.nan).astype(np.float64)
+                if low is not None:
+                    present = present & (numeric >= low)
+                if high is not None:
+                    present = present & (numeric <= high)
+                narrow(present)
+            if min_score is not None:
+                narrow(scores >= min_score)
+            if after is not None:
+                after_id, after_score = after
+                narrow((scores < after_score) | ((scores == np.float32(after_score)) & (ids > after_id)))
+            if exclude_ids:
+                narrow(~np.isin(ids, list(exclude_ids)))
+
+            if mask is not None:
+                candidates = np.flatnonzero(mask)
+                if candidates.size == 0:
+                    return []
+                scores = scores[candidates]
+            else:
+                candidates = None
+
+            k = min(k, scores.shape[0])
+            top = np.argpartition(-scores, k - 1)[:k]
+            positions = top if candidates is None else candidates[top]
+            order = np.lexsort((ids[positions], -scores[top]))
+            top = top[order]
+            positions = positions[order]
+            return [(int(self._ids[p]), float(s)) for p, s in zip(positions, scores[top])]
+
+    def search_many(self, queries, k, exclude_ids=None, min_score=None, block_size=256):
+        """
+        Search for many queries at once with matrix-matrix products, one block of query rows at a
+        time to bound memory. Returns one list of up to k (id, score) pairs per query, ordered as
+        in search. exclude_ids gives one id (or None) per query to leave out of its own results,
+        typically the query row itself.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dimension)
+        results = []
+        with self._lock:
+            if self._size == 0 or k <= 0:
+                return [[] for _ in range(queries.shape[0])]
+
+            matrix = self._matrix[:self._size]
+            ids = self._ids[:self._size]
+            k = min(k, self._size)
+            for start in range(0, queries.shape[0], block_size):
+                scores = queries[start:start + block_size] @ matrix.T
+                if exclude_ids is not None:
+                    for row, row_id in enumerate(exclude_ids[start:start + block_size]):
+                        position = self._positions.get(row_id)
+                        if position is not None:
+                            scores[row, position] = -np.inf
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                top_scores = np.take_along_axis(scores, top, axis=1)
+                for positions, row_scores in zip(top, top_scores):
+                    order = np.lexsort((ids[positions], -row_scores))
+                    results.append([
+                        (int(ids[p]), float(s))
+                        for p, s in zip(positions[order], row_scores[order])
+                        if s != -np.inf and (min_score is None or s >= min_score)
+                    ])
+        return results